@@ -1,119 +1,136 @@
-from openai import OpenAI
-import json
 import time
-from flask import Flask, render_template, request, jsonify
+
+# Import-time report (see startup.phases_ms in /api/health)
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import os
+import random
+from collections.abc import Mapping
+from flask import Flask, Response, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime
 from config import Config
 from metrics import MetricsTracker
-from kb_retriever import SmartKBRetriever
+from profiler import SamplingProfiler
+from response_cache import ResponseCache
+from session_store import create_session_store
+from stream_parser import JSONEnvelopeStreamParser
+from phrase_matcher import PhraseMatcher, load_phrases, tokenize
+from prompt_builder import PromptBuilder
+from single_flight import AsyncSingleFlight, SingleFlight, fingerprint
+from llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable, RateLimiter
+from micro_batch import MicroBatcher
+from llm_envelope import (
+    ANSWER_SCHEMA, ENVELOPE_SCHEMA, FALLBACK, INVALID_FIELDS, OK, EnvelopeValidator, parse_envelope
+)
+from json_codec import make_encoder
+from startup import StartupTracker
+from cluster import MetricsPublisher, merged_metrics
+from transcript_log import TranscriptLog
 
-# Validate configuration
-Config.validate()
+# openai, scikit-learn (kb_retriever, persona_classifier) and scipy are imported
+# where they are first used, so that cost is paid by the startup thread
+startup = StartupTracker(started=_IMPORT_STARTED)
+startup.record("imports", time.perf_counter() - _IMPORT_STARTED)
 
-app = Flask(__name__)
 
-# Knowledge Base - organized by persona
-KNOWLEDGE_BASE = {
-    "technical_expert": [
-        {
-            "id": 1,
-            "title": "API Authentication",
-            "content": "Use Bearer tokens in Authorization header. Generate tokens via /api/auth/token endpoint with client_id and client_secret. Tokens expire after 24 hours.",
-            "keywords": ["api", "auth", "authentication", "token", "bearer", "oauth"]
-        },
-        {
-            "id": 2,
-            "title": "Webhook Configuration",
-            "content": "Configure webhooks at /api/webhooks. Supports POST requests with HMAC-SHA256 signatures. Retry logic: 3 attempts with exponential backoff (1s, 2s, 4s).",
-            "keywords": ["webhook", "callback", "event", "integration", "hmac"]
-        },
-        {
-            "id": 3,
-            "title": "Rate Limits",
-            "content": "Standard tier: 1000 req/hour. Enterprise: 10000 req/hour. Headers: X-RateLimit-Remaining, X-RateLimit-Reset. Use exponential backoff when rate limited.",
-            "keywords": ["rate", "limit", "throttle", "quota", "429"]
-        }
-    ],
-    "frustrated_user": [
-        {
-            "id": 4,
-            "title": "Quick Fixes",
-            "content": "Most common issues resolved by: 1) Clear browser cache and cookies 2) Check internet connection 3) Log out and back in 4) Update to latest version 5) Disable browser extensions",
-            "keywords": ["not working", "broken", "error", "fix", "help", "issue"]
-        },
-        {
-            "id": 5,
-            "title": "Service Status",
-            "content": "Check status.ourservice.com for real-time system status. Current uptime: 99.97%. Subscribe for SMS/email alerts about outages.",
-            "keywords": ["down", "outage", "status", "unavailable", "slow"]
-        },
-        {
-            "id": 6,
-            "title": "Refund Policy",
-            "content": "30-day money back guarantee, no questions asked. Refunds processed within 5-7 business days to original payment method. Contact billing@ourservice.com",
-            "keywords": ["refund", "money back", "cancel", "unsatisfied", "return"]
-        }
-    ],
-    "business_exec": [
-        {
-            "id": 7,
-            "title": "ROI & Metrics",
-            "content": "Average customers see 40% efficiency gain within 3 months. 99.9% uptime SLA. Enterprise analytics dashboard with custom KPIs. Typical payback period: 6-8 months.",
-            "keywords": ["roi", "metrics", "analytics", "kpi", "performance", "value"]
-        },
-        {
-            "id": 8,
-            "title": "Pricing & Plans",
-            "content": "Starter: $49/mo (up to 5 users), Professional: $149/mo (up to 25 users), Enterprise: Custom pricing. Volume discounts: 10% off for 50+ seats, 20% off for 200+ seats. Annual billing saves 15%.",
-            "keywords": ["pricing", "cost", "price", "plan", "subscription", "discount"]
-        },
-        {
-            "id": 9,
-            "title": "Security & Compliance",
-            "content": "SOC 2 Type II certified. GDPR and CCPA compliant. HIPAA available for Enterprise. Data encrypted at rest (AES-256) and in transit (TLS 1.3). Annual penetration testing.",
-            "keywords": ["security", "compliance", "gdpr", "hipaa", "encryption", "audit"]
-        }
-    ]
-}
+class AppJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that also serializes read-only views like KB results
+
+    Encoding goes through Config.JSON_ENCODER (orjson when installed), which
+    matters for large payloads such as escalations with inlined history.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
 
-# In-memory storage
-conversations = {}
-persona_cache = {}  # Cache persona detections
+    def __init__(self, app):
+        super().__init__(app)
+        self.encode = make_encoder(Config.JSON_ENCODER, default=self.default)
+
+    def dumps(self, obj, **kwargs):
+        return self.encode(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype=self.mimetype)
+
+
+app = Flask(__name__)
+app.json = AppJSONProvider(app)
+
+# Conversation history, cached persona and sentiment trend per session
+session_store = create_session_store(
+    Config.SESSION_BACKEND,
+    path=Config.SESSION_DB_PATH,
+    ttl_seconds=Config.SESSION_TTL_SECONDS,
+    max_sessions=Config.SESSION_MAX_SESSIONS,
+    max_bytes=Config.SESSION_MAX_BYTES,
+    history_window=Config.SESSION_HISTORY_WINDOW,
+    sentiment_window=Config.SESSION_SENTIMENT_WINDOW
+)
 metrics_tracker = MetricsTracker()
+# Set when several workers publish metrics for a merged /api/metrics (see cluster.py)
+metrics_publisher = MetricsPublisher(
+    metrics_tracker, Config.CLUSTER_METRICS_DIR, Config.CLUSTER_METRICS_INTERVAL_SECONDS
+) if Config.CLUSTER_METRICS_DIR else None
+# Every finished turn, written to disk off the request path (see transcript_log.py)
+transcript_log = TranscriptLog(
+    Config.TRANSCRIPT_LOG_DIR,
+    tracker=metrics_tracker,
+    queue_size=Config.TRANSCRIPT_QUEUE_SIZE,
+    flush_interval_seconds=Config.TRANSCRIPT_FLUSH_INTERVAL_SECONDS,
+    segment_max_bytes=Config.TRANSCRIPT_SEGMENT_MAX_MB << 20,
+    fsync=Config.TRANSCRIPT_FSYNC
+) if Config.TRANSCRIPT_LOG_DIR else None
+profiler = SamplingProfiler()
+if Config.PROFILER_ENABLED:
+    profiler.start(Config.PROFILER_INTERVAL_MS)
 
+# Envelope fields needed before escalation can be decided
+METADATA_FIELDS = ("persona", "confidence", "sentiment", "urgency")
 
-class SupportAgent:
-    def __init__(self):
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
-        self.kb_retriever = SmartKBRetriever(KNOWLEDGE_BASE)
-    
-    def detect_persona_and_generate(self, message, conversation_history, kb_articles):
-        """
-        OPTIMIZED: Combined persona detection + response generation in single LLM call
-        This reduces latency and cost by 50%
-        """
-        
-        context = ""
-        if conversation_history:
-            context = "\n".join([
-                f"{'Customer' if msg['role'] == 'user' else 'Agent'}: {msg['content']}" 
-                for msg in conversation_history[-4:]
-            ])
-        
-        kb_context = "\n".join([
-            f"- {article['title']}: {article['content']}" 
-            for article in kb_articles
-        ]) if kb_articles else "No specific KB articles found."
-        
-        prompt = f"""You are an intelligent customer support agent. Analyze the customer's message and respond appropriately.
+# Used when the LLM output can't be parsed
+FALLBACK_RESULT = {
+    "persona": "frustrated_user",
+    "confidence": 0.5,
+    "sentiment": "neutral",
+    "urgency": "medium",
+    "response": "I understand your question. Let me help you with that. Could you provide more details?",
+    "kb_articles_used": [],
+    "reasoning": "Error in LLM response parsing"
+}
 
-CONVERSATION HISTORY:
-{context if context else "No prior context"}
+# Envelope validation: invalid fields fall back to these, the reasoning to ""
+VALIDATION_DEFAULTS = {**FALLBACK_RESULT, "reasoning": ""}
+ENVELOPE_VALIDATOR = EnvelopeValidator(ENVELOPE_SCHEMA, VALIDATION_DEFAULTS)
+ANSWER_VALIDATOR = EnvelopeValidator(ANSWER_SCHEMA, VALIDATION_DEFAULTS)
+METADATA_VALIDATOR = EnvelopeValidator(
+    {field: ENVELOPE_SCHEMA[field] for field in METADATA_FIELDS}, VALIDATION_DEFAULTS, required=()
+)
 
-CURRENT MESSAGE: "{message}"
+# Models that accept response_format={"type": "json_object"} (LLM_JSON_MODE=auto)
+JSON_MODE_MODEL_PREFIXES = (
+    "gpt-4o", "gpt-4.1", "gpt-4-turbo", "gpt-4-1106", "gpt-4-0125", "gpt-3.5-turbo", "gpt-5", "o1", "o3", "o4"
+)
 
-AVAILABLE KNOWLEDGE BASE:
-{kb_context}
+# Tone instructions per persona, also used for the persona-specific fast-path prompt
+PERSONA_TONES = {
+    "technical_expert": "Be precise, technical, concise. Include specifics.",
+    "frustrated_user": "Lead with empathy, be reassuring, offer quick solutions.",
+    "business_exec": "Focus on business value, ROI, be professional and strategic.",
+}
+
+# Instructions and output schema: the static prefix of every full prompt.
+# Keep per-request data out of it so provider prompt caching can reuse it.
+SYSTEM_PROMPT = """You are an intelligent customer support agent. Analyze the customer's message and respond appropriately.
+
+The conversation so far follows as user/assistant messages. The last user message lists the AVAILABLE KNOWLEDGE BASE and the CURRENT MESSAGE to answer.
 
 YOUR TASK - Respond with valid JSON containing:
 1. PERSONA DETECTION: Classify customer into ONE persona
@@ -129,7 +146,7 @@ YOUR TASK - Respond with valid JSON containing:
 3. USE KB CONTENT when relevant to answer the question.
 
 RESPOND ONLY WITH VALID JSON (no markdown):
-{{
+{
   "persona": "technical_expert" | "frustrated_user" | "business_exec",
   "confidence": 0.0-1.0,
   "sentiment": "positive" | "neutral" | "negative",
@@ -137,63 +154,427 @@ RESPOND ONLY WITH VALID JSON (no markdown):
   "response": "your tone-adapted response here",
   "kb_articles_used": ["list of KB article titles you referenced"],
   "reasoning": "brief explanation of persona classification"
-}}"""
+}"""
+
+
+def persona_system_prompt(persona):
+    """Static prefix of the fast-path prompt for one persona"""
+    return f"""You are a customer support agent replying to a {persona.replace('_', ' ')}. {PERSONA_TONES[persona]}
+
+The conversation so far follows as user/assistant messages. The last user message lists the AVAILABLE KNOWLEDGE BASE and the CURRENT MESSAGE to answer.
+
+Use KB content when relevant. RESPOND ONLY WITH VALID JSON (no markdown):
+{{"response": "your answer", "kb_articles_used": ["KB article titles you referenced"]}}"""
 
-        try:
-            response = self.client.chat.completions.create(
-                model=Config.OPENAI_MODEL,
-                max_tokens=Config.OPENAI_MAX_TOKENS,
-                temperature=0.7,
-                messages=[{"role": "user", "content": prompt}]
-            )
 
-            result_text = response.choices[0].message.content.strip()
-            result_text = result_text.replace("```json", "").replace("```", "").strip()
-            return json.loads(result_text)
+# Cache of LLM results for repeated first messages (None when disabled)
+response_cache = ResponseCache(
+    max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=Config.RESPONSE_CACHE_TTL_SECONDS,
+    similarity_threshold=Config.RESPONSE_CACHE_SIMILARITY_THRESHOLD
+) if Config.RESPONSE_CACHE_ENABLED else None
+
+
+class SupportAgent:
+    def __init__(self, client=None, async_client=None, knowledge_base=None):
+        """
+        client / async_client replace the OpenAI clients, e.g. with the fake
+        backend in benchmarks/fake_llm.py for offline load tests.
+        knowledge_base defaults to the one at Config.KB_PATH.
+        """
+        if client is None:
+            with startup.phase("llm_client"):
+                from openai import OpenAI
+                # Retries are done by the gateway below, not inside the client
+                client = OpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL, max_retries=0)
+        self.client = client
+        self._async_client = async_client
+        self._llm_semaphore = None
+        self._single_flight = SingleFlight()
+        self._async_single_flight = None
+        
+        # Quotas, retries and circuit breaker shared by every LLM call
+        limiter = None
+        if Config.LLM_RPM_LIMIT or Config.LLM_TPM_LIMIT:
+            limiter = RateLimiter(Config.LLM_RPM_LIMIT or None, Config.LLM_TPM_LIMIT or None)
+        self.llm_gateway = LLMGateway(
+            limiter=limiter,
+            breaker=CircuitBreaker(
+                failure_threshold=Config.LLM_BREAKER_FAILURE_THRESHOLD,
+                reset_seconds=Config.LLM_BREAKER_RESET_SECONDS,
+                on_transition=self._on_circuit_transition
+            ),
+            max_retries=Config.LLM_MAX_RETRIES,
+            retry_base_seconds=Config.LLM_RETRY_BASE_SECONDS,
+            retry_max_seconds=Config.LLM_RETRY_MAX_SECONDS,
+            max_wait_seconds=Config.LLM_RATE_LIMIT_MAX_WAIT_SECONDS,
+            metrics=metrics_tracker
+        )
+        
+        # Optional micro-batching: non-streaming LLM calls go out in bursts from one event loop
+        self._batch_client = async_client
+        self.llm_batcher = MicroBatcher(
+            self._batched_completion,
+            max_batch_size=Config.LLM_BATCH_MAX_SIZE,
+            max_delay_ms=Config.LLM_BATCH_MAX_DELAY_MS,
+            max_in_flight=Config.LLM_MAX_CONCURRENCY,
+            metrics=metrics_tracker
+        ) if Config.LLM_BATCH_ENABLED else None
+        
+        # Escalation phrases compiled once; per-message cost doesn't grow with the list
+        escalation_phrases = list(Config.ESCALATION_KEYWORDS)
+        if Config.ESCALATION_KEYWORDS_FILE:
+            escalation_phrases += load_phrases(Config.ESCALATION_KEYWORDS_FILE)
+        self.escalation_matcher = PhraseMatcher(escalation_phrases)
+        
+        # Optional local classifier that lets confident turns use a smaller prompt
+        self.persona_classifier = None
+        if Config.PERSONA_CLASSIFIER_PATH and os.path.exists(Config.PERSONA_CLASSIFIER_PATH):
+            with startup.phase("persona_classifier"):
+                from persona_classifier import PersonaClassifier
+                self.persona_classifier = PersonaClassifier.load(Config.PERSONA_CLASSIFIER_PATH)
+            print(f"[OK] Persona classifier loaded from {Config.PERSONA_CLASSIFIER_PATH}")
+        
+        # Static system prefixes, one for the full prompt and one per fast-path persona
+        self.prompt_builders = {
+            kind: PromptBuilder(
+                system_prompt,
+                budget_tokens=Config.PROMPT_TOKEN_BUDGET,
+                kb_snippet_tokens=Config.PROMPT_KB_SNIPPET_TOKENS,
+                history_messages=Config.PROMPT_HISTORY_MESSAGES
+            )
+            for kind, system_prompt in [("full", SYSTEM_PROMPT)] + [
+                (persona, persona_system_prompt(persona)) for persona in PERSONA_TONES
+            ]
+        }
+        
+        # Memory-mapped from KB_INDEX_DIR when a prebuilt index matches the KB
+        with startup.phase("kb_index"):
+            from kb_retriever import SmartKBRetriever, load_knowledge_base
+            if knowledge_base is None:
+                knowledge_base = load_knowledge_base(Config.KB_PATH)
+            self.kb_retriever = SmartKBRetriever(
+                knowledge_base,
+                refit_drift_threshold=Config.KB_REFIT_DRIFT_THRESHOLD,
+                index_dir=Config.KB_INDEX_DIR,
+                context_decay=Config.KB_CONTEXT_DECAY,
+                context_weight=Config.KB_CONTEXT_WEIGHT,
+                context_max_terms=Config.KB_CONTEXT_MAX_TERMS,
+                dense=Config.KB_DENSE_ENABLED,
+                dense_dim=Config.KB_DENSE_DIM,
+                dense_weight=Config.KB_DENSE_WEIGHT,
+                dense_n_probe=Config.KB_DENSE_N_PROBE,
+                chunk_words=Config.KB_CHUNK_WORDS
+            )
+    
+    def build_prompt(self, message, conversation_history, kb_articles):
+        """Prompt for the combined persona detection + response generation call"""
+        return self.prompt_builders["full"].build(message, conversation_history, kb_articles)
+    
+    def build_persona_prompt(self, message, conversation_history, kb_articles, persona):
+        """Smaller prompt for the fast path: persona is known, only the answer is needed"""
+        return self.prompt_builders[persona].build(message, conversation_history, kb_articles)
+    
+    def classify_turn(self, message):
+        """
+        Run the local classifier ahead of the LLM call
         
-        except json.JSONDecodeError as e:
-            # Fallback response
+        Returns:
+            (prediction, fast_path): prediction is None without a classifier;
+            fast_path is True when every label is confident enough to use the
+            persona-specific prompt. A PERSONA_CLASSIFIER_AUDIT_RATE share of
+            confident turns still takes the full prompt, to keep measuring
+            agreement where it matters.
+        """
+        if self.persona_classifier is None:
+            return None, False
+        with metrics_tracker.time_stage("classifier"):
+            prediction = self.persona_classifier.predict(message)
+        if (min(prediction.confidence.values()) < Config.PERSONA_CLASSIFIER_THRESHOLD
+                or prediction.labels["persona"] not in PERSONA_TONES):
+            route = "low_confidence"
+        elif random.random() < Config.PERSONA_CLASSIFIER_AUDIT_RATE:
+            route = "audit"
+        else:
+            route = "fast_path"
+        metrics_tracker.record_classifier_route(route)
+        return prediction, route == "fast_path"
+    
+    def plan_llm_call(self, message, conversation_history, kb_articles):
+        """(prompt, model, prediction, fast_path): the fast path when the classifier is confident"""
+        prediction, fast_path = self.classify_turn(message)
+        with metrics_tracker.time_stage("prompt_build"):
+            if fast_path:
+                persona = prediction.labels["persona"]
+                prompt = self.build_persona_prompt(message, conversation_history, kb_articles, persona)
+            else:
+                prompt = self.build_prompt(message, conversation_history, kb_articles)
+        metrics_tracker.record_prompt(prompt)
+        model = Config.PERSONA_FAST_PATH_MODEL if fast_path else Config.OPENAI_MODEL
+        return prompt, model, prediction, fast_path
+    
+    def finish_llm_result(self, message, parsed, prediction, fast_path):
+        """
+        Final result of the LLM call
+        
+        On the fast path the classifier's labels fill in what the smaller prompt
+        didn't ask for. Otherwise the LLM's labels are compared with the local
+        prediction and, if configured, logged as training data.
+        """
+        if fast_path:
+            probability = prediction.confidence["persona"]
+            reasoning = parsed.get("reasoning")
+            if reasoning != FALLBACK_RESULT["reasoning"]:
+                reasoning = f"Local classifier (p={probability:.2f})"
             return {
-                "persona": "frustrated_user",
-                "confidence": 0.5,
-                "sentiment": "neutral",
-                "urgency": "medium",
-                "response": "I understand your question. Let me help you with that. Could you provide more details?",
                 "kb_articles_used": [],
-                "reasoning": "Error in LLM response parsing"
+                **parsed,
+                **prediction.labels,
+                "confidence": probability,
+                "reasoning": reasoning,
             }
+        
+        if parsed.get("reasoning") != FALLBACK_RESULT["reasoning"]:
+            if prediction is not None:
+                confident = min(prediction.confidence.values()) >= Config.PERSONA_CLASSIFIER_THRESHOLD
+                metrics_tracker.record_classifier_agreement(prediction, parsed, confident)
+            if Config.PERSONA_LABEL_LOG:
+                from persona_classifier import log_label
+                log_label(Config.PERSONA_LABEL_LOG, message, parsed)
+        return parsed
+
+    def llm_request(self, prompt, model=None):
+        """Keyword arguments for chat.completions.create"""
+        model = model or Config.OPENAI_MODEL
+        request = {
+            "model": model,
+            "max_tokens": Config.OPENAI_MAX_TOKENS,
+            "temperature": 0.7,
+            "messages": prompt.messages
+        }
+        if self.json_mode(model):
+            request["response_format"] = {"type": "json_object"}
+        return request
+
+    def json_mode(self, model):
+        """Whether to ask the provider for structured JSON output"""
+        if Config.LLM_JSON_MODE == "auto":
+            return model.startswith(JSON_MODE_MODEL_PREFIXES)
+        return Config.LLM_JSON_MODE == "true"
+
+    def parse_llm_output(self, result_text, fast_path=False):
+        """Parse and validate the model's JSON envelope, falling back to a safe default"""
+        envelope, outcome = parse_envelope(result_text, ANSWER_VALIDATOR if fast_path else ENVELOPE_VALIDATOR)
+        metrics_tracker.record_parse(outcome)
+        if envelope is None:
+            return dict(FALLBACK_RESULT)
+        return envelope
+
+    def validate_llm_output(self, fields, fast_path=False):
+        """Validate an envelope the stream parser already decoded"""
+        envelope, invalid = (ANSWER_VALIDATOR if fast_path else ENVELOPE_VALIDATOR).validate(fields)
+        metrics_tracker.record_parse(FALLBACK if envelope is None else INVALID_FIELDS if invalid else OK)
+        if envelope is None:
+            return dict(FALLBACK_RESULT)
+        return envelope
+
+    def detect_persona_and_generate(self, message, conversation_history, kb_articles):
+        """
+        OPTIMIZED: Combined persona detection + response generation in single LLM call
+        This reduces latency and cost by 50%
+        """
+        prompt, model, prediction, fast_path = self.plan_llm_call(message, conversation_history, kb_articles)
+
+        def call_llm():
+            with metrics_tracker.time_stage("llm"):
+                if self.llm_batcher is not None:
+                    response = self.llm_batcher.submit((prompt, model)).result()
+                else:
+                    response = self.llm_gateway.call(
+                        lambda: self.client.chat.completions.create(**self.llm_request(prompt, model)),
+                        tokens=self.request_tokens(prompt)
+                    )
+            metrics_tracker.record_usage(response.usage, prompt="fast" if fast_path else "full")
+            with metrics_tracker.time_stage("parse"):
+                return self.parse_llm_output(response.choices[0].message.content, fast_path)
+
+        try:
+            key = self.coalesce_key(conversation_history, prompt, model)
+            if key is None:
+                parsed = call_llm()
+            else:
+                parsed, shared = self._single_flight.do(key, call_llm)
+                metrics_tracker.record_coalescing(shared)
+                parsed = dict(parsed)  # Followers share the leader's dict
+            return self.finish_llm_result(message, parsed, prediction, fast_path)
+        except LLMUnavailable as e:
+            return self.degraded_result(kb_articles, e.reason)
+        except Exception as e:
+            raise Exception(f"LLM API Error: {str(e)}")
+
+    async def adetect_persona_and_generate(self, message, conversation_history, kb_articles):
+        """
+        Async variant of detect_persona_and_generate for the asyncio serving mode
+
+        Waits for one of Config.LLM_MAX_CONCURRENCY slots, so a burst of chats
+        queues here instead of opening unbounded provider connections.
+        """
+        prompt, model, prediction, fast_path = self.plan_llm_call(message, conversation_history, kb_articles)
+
+        async def attempt():
+            async with self._llm_slots():
+                return await asyncio.wait_for(
+                    self.async_client.chat.completions.create(**self.llm_request(prompt, model)),
+                    timeout=Config.LLM_TIMEOUT_SECONDS
+                )
+
+        async def call_llm():
+            # Slots are held per attempt, not while backing off between retries
+            with metrics_tracker.time_stage("llm"):
+                if self.llm_batcher is not None:
+                    response = await asyncio.wrap_future(self.llm_batcher.submit((prompt, model)))
+                else:
+                    response = await self.llm_gateway.acall(attempt, tokens=self.request_tokens(prompt))
+            metrics_tracker.record_usage(response.usage, prompt="fast" if fast_path else "full")
+            with metrics_tracker.time_stage("parse"):
+                return self.parse_llm_output(response.choices[0].message.content, fast_path)
+
+        try:
+            key = self.coalesce_key(conversation_history, prompt, model)
+            if key is None:
+                parsed = await call_llm()
+            else:
+                parsed, shared = await self._async_flights().do(key, call_llm)
+                metrics_tracker.record_coalescing(shared)
+                parsed = dict(parsed)  # Followers share the leader's dict
+            return self.finish_llm_result(message, parsed, prediction, fast_path)
+        except LLMUnavailable as e:
+            return self.degraded_result(kb_articles, e.reason)
+        except asyncio.TimeoutError:
+            raise Exception(f"LLM API Error: no response within {Config.LLM_TIMEOUT_SECONDS}s")
         except Exception as e:
             raise Exception(f"LLM API Error: {str(e)}")
+
+    @property
+    def async_client(self):
+        """AsyncOpenAI client, created on first use so sync-only workers never build one"""
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                timeout=Config.LLM_TIMEOUT_SECONDS,
+                max_retries=0
+            )
+        return self._async_client
+
+    async def _batched_completion(self, request):
+        """One completion inside a micro-batch (runs on the batcher's event loop)"""
+        prompt, model = request
+        if self._batch_client is None:
+            # Created on the batcher's loop; the async serving mode keeps its own client
+            from openai import AsyncOpenAI
+            self._batch_client = AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                timeout=Config.LLM_TIMEOUT_SECONDS,
+                max_retries=0
+            )
+        return await self.llm_gateway.acall(
+            lambda: asyncio.wait_for(
+                self._batch_client.chat.completions.create(**self.llm_request(prompt, model)),
+                timeout=Config.LLM_TIMEOUT_SECONDS
+            ),
+            tokens=self.request_tokens(prompt)
+        )
     
-    def check_escalation(self, persona_data, message, conversation_history, session_id):
-        """Enhanced escalation logic with sentiment tracking"""
+    def request_tokens(self, prompt):
+        """Tokens a request counts against the TPM quota: prompt plus the completion cap"""
+        return prompt.tokens + Config.OPENAI_MAX_TOKENS
+    
+    def _on_circuit_transition(self, state):
+        metrics_tracker.record_llm_gateway("circuit_transitions", state)
+        print(f"[{'OK' if state == CircuitBreaker.CLOSED else 'WARN'}] LLM circuit breaker {state}")
+    
+    def degraded_result(self, kb_articles, reason):
+        """
+        KB-only answer while the LLM provider is unavailable
         
-        escalation_triggers = {
-            "keywords": ["speak to manager", "lawyer", "sue", "terrible service", 
-                        "cancel account", "refund now", "waste of time", "useless"],
-            "conversation_length": Config.ESCALATION_MESSAGE_THRESHOLD
+        Neutral sentiment and zero confidence, so the turn is neither escalated
+        nor cached, and the persona isn't pinned on the session.
+        """
+        metrics_tracker.record_llm_gateway("degraded_answers", reason)
+        if kb_articles:
+            top = kb_articles[0]
+            response = (
+                "We're seeing very high demand and can't write a personalized answer right now. "
+                f"This article should help - {top['title']}: {top['content']}"
+            )
+            used = [top["title"]]
+        else:
+            response = (
+                "We're seeing very high demand and can't answer right now. "
+                "Please try again in a few minutes."
+            )
+            used = []
+        return {
+            **FALLBACK_RESULT,
+            "confidence": 0.0,
+            "response": response,
+            "kb_articles_used": used,
+            "reasoning": f"Degraded answer: LLM unavailable ({reason})",
+            "degraded": True,
         }
+    
+    def _llm_slots(self):
+        """Semaphore capping outstanding async LLM calls (one per event loop)"""
+        loop = asyncio.get_running_loop()
+        if self._llm_semaphore is None or self._llm_semaphore[0] is not loop:
+            self._llm_semaphore = (loop, asyncio.Semaphore(Config.LLM_MAX_CONCURRENCY))
+        return self._llm_semaphore[1]
+    
+    def _async_flights(self):
+        """In-flight async LLM calls for request coalescing (one table per event loop)"""
+        loop = asyncio.get_running_loop()
+        if self._async_single_flight is None or self._async_single_flight[0] is not loop:
+            self._async_single_flight = (loop, AsyncSingleFlight())
+        return self._async_single_flight[1]
+    
+    def coalesce_key(self, conversation_history, prompt, model):
+        """
+        Single-flight key for an LLM call, or None when it shouldn't be coalesced
         
-        # Check keyword triggers
-        message_lower = message.lower()
-        keyword_match = any(trigger in message_lower for trigger in escalation_triggers["keywords"])
+        Concurrent turns with byte-identical requests (same model and messages,
+        i.e. same history, KB hits and message) share one in-flight call. With
+        COALESCE_REQUESTS=first_turn only conversation openers qualify - the
+        outage case where many users send "site is down" at once.
+        """
+        scope = Config.COALESCE_REQUESTS
+        if scope == "off" or (scope == "first_turn" and conversation_history):
+            return None
+        return fingerprint(model, prompt.messages)
+    
+    def check_escalation(self, persona_data, message, session):
+        """Enhanced escalation logic with sentiment tracking"""
         
-        # Check sentiment degradation (track sentiment changes)
-        if session_id not in persona_cache:
-            persona_cache[session_id] = {"sentiment_history": []}
+        conversation_history = session["history"]
         
-        persona_cache[session_id]["sentiment_history"].append(persona_data.get("sentiment"))
+        # Check keyword triggers
+        keyword_match = self.escalation_matcher.search(message) is not None
+        
+        # Check sentiment degradation (this turn's sentiment is recorded in complete_turn)
+        sentiment_history = session["sentiment_history"] + [persona_data.get("sentiment")]
         
         # If last 2 sentiments are negative, escalate
-        recent_sentiments = persona_cache[session_id]["sentiment_history"][-2:]
+        recent_sentiments = sentiment_history[-2:]
         sentiment_degradation = all(s == "negative" for s in recent_sentiments) and len(recent_sentiments) >= 2
         
         # Check urgency and sentiment combination
         high_urgency = persona_data.get("urgency") == "high"
         negative_sentiment = persona_data.get("sentiment") == "negative"
         
-        # Check conversation length
-        long_conversation = len(conversation_history) >= escalation_triggers["conversation_length"]
+        # Check conversation length (history itself is compacted to a window)
+        long_conversation = session["message_count"] >= Config.ESCALATION_MESSAGE_THRESHOLD
         
         # Frustrated users with high urgency escalate faster
         frustrated_and_urgent = (
@@ -205,11 +586,12 @@ RESPOND ONLY WITH VALID JSON (no markdown):
         # Repeated questions (same question asked 2+ times)
         repeated_question = False
         if len(conversation_history) >= 4:
-            user_messages = [msg['content'].lower() for msg in conversation_history[-4:] if msg['role'] == 'user']
-            if len(user_messages) >= 2:
+            # Token sets of the last 2 user messages, cached in the session as they arrive
+            user_tokens = [set(tokens) for tokens in session.get("user_tokens", [])[-2:]]
+            if len(user_tokens) >= 2:
                 # Simple check: if messages are very similar
-                for i in range(len(user_messages) - 1):
-                    similarity = len(set(user_messages[i].split()) & set(user_messages[i+1].split()))
+                for i in range(len(user_tokens) - 1):
+                    similarity = len(user_tokens[i] & user_tokens[i+1])
                     if similarity > 3:  # If 3+ words match
                         repeated_question = True
                         break
@@ -233,154 +615,507 @@ RESPOND ONLY WITH VALID JSON (no markdown):
             elif frustrated_and_urgent:
                 reason = "Frustrated customer with high urgency detected"
             elif long_conversation:
-                reason = f"Conversation exceeded {escalation_triggers['conversation_length']} exchanges"
+                reason = f"Conversation exceeded {Config.ESCALATION_MESSAGE_THRESHOLD} exchanges"
         
         return should_escalate, reason
     
-    def process_message(self, session_id, message):
-        """Main processing pipeline with metrics tracking"""
+    def prepare_turn(self, session_id, message):
+        """
+        Load session state and retrieve KB content ahead of the LLM call
+
+        Callers start the turn (metrics_tracker.start_turn()) first, in the
+        thread or task that owns it, so stages timed on a worker thread are
+        collected too.
+        """
         
-        start_time = time.time()
+        # Get or create the session
+        with metrics_tracker.time_stage("session_load"):
+            session = session_store.get_or_create(session_id)
+        conversation_history = session["history"]
         
-        try:
-            # Get or create conversation history
-            if session_id not in conversations:
-                conversations[session_id] = []
-            
-            conversation_history = conversations[session_id]
-            
-            # Check if persona is cached and confident
-            cached_persona = None
-            if session_id in persona_cache:
-                cache_data = persona_cache[session_id]
-                if cache_data.get("confidence", 0) >= Config.PERSONA_CONFIDENCE_THRESHOLD:
-                    cached_persona = cache_data.get("persona")
-            
-            # Step 1: Retrieve KB content (use cached persona if available)
-            if cached_persona:
-                kb_articles = self.kb_retriever.retrieve(
-                    cached_persona, message, conversation_history
-                )
-            else:
-                # First message - try all personas
-                all_articles = []
-                for persona in KNOWLEDGE_BASE.keys():
-                    articles = self.kb_retriever.retrieve(persona, message, conversation_history, top_k=1)
-                    all_articles.extend(articles)
-                # Get top 3 overall
-                all_articles.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
-                kb_articles = all_articles[:3]
-            
-            # Step 2: Combined persona detection + response generation
-            result = self.detect_persona_and_generate(message, conversation_history, kb_articles)
-            
-            # Cache persona if confidence is high
-            if result["confidence"] >= Config.PERSONA_CONFIDENCE_THRESHOLD:
-                persona_cache[session_id] = {
-                    "persona": result["persona"],
-                    "confidence": result["confidence"],
-                    "sentiment_history": persona_cache.get(session_id, {}).get("sentiment_history", [])
-                }
-            
-            # Step 3: Check escalation
-            should_escalate, escalation_reason = self.check_escalation(
-                result, message, conversation_history, session_id
+        # Check if persona is cached and confident
+        cached_persona = None
+        if session.get("confidence", 0) >= Config.PERSONA_CONFIDENCE_THRESHOLD:
+            cached_persona = session.get("persona")
+        
+        # Retrieve KB content (use cached persona if available); the session's
+        # context vector stands in for re-vectorizing earlier messages
+        session_context = session.get("kb_context", {}) if Config.KB_SESSION_CONTEXT else None
+        retrieval_start = time.perf_counter()
+        if cached_persona:
+            kb_articles, query_vector = self.kb_retriever.retrieve(
+                cached_persona, message, conversation_history, with_query_vector=True,
+                session_context=session_context
             )
-            
-            # Update conversation history
-            conversations[session_id].append({"role": "user", "content": message})
-            conversations[session_id].append({"role": "assistant", "content": result["response"]})
-            
-            # Calculate response time
-            response_time = time.time() - start_time
-            
-            # Track metrics
-            metrics_tracker.record_request(
-                persona=result["persona"],
-                kb_articles=kb_articles,
-                confidence=result["confidence"],
-                response_time=response_time,
-                escalated=should_escalate,
-                sentiment=result["sentiment"],
-                urgency=result["urgency"]
+        else:
+            # First message - best article per persona from one index pass
+            _, by_persona, query_vector = self.kb_retriever.retrieve_all(
+                message, conversation_history, per_persona_k=1, with_query_vector=True,
+                session_context=session_context
+            )
+            all_articles = [
+                article for articles in by_persona.values() for article in articles
+            ]
+            # Get top 3 overall
+            all_articles.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+            kb_articles = all_articles[:3]
+        metrics_tracker.record_stage("kb_retrieval", time.perf_counter() - retrieval_start)
+        
+        return session, cached_persona, kb_articles, query_vector
+
+    def lookup_response(self, session, message, kb_articles, query_vector):
+        """
+        Check the response cache before calling the LLM
+
+        Returns:
+            (cache_key, result): cache_key is None when the cache is bypassed,
+            result is None on a miss
+        """
+        if response_cache is None:
+            return None, None
+        
+        # Upset customers always get a freshly generated answer
+        sentiment_history = session["sentiment_history"]
+        if sentiment_history and sentiment_history[-1] == "negative":
+            metrics_tracker.record_cache_bypass()
+            return None, None
+        
+        with metrics_tracker.time_stage("cache_lookup"):
+            cache_key = response_cache.make_key(
+                message, kb_articles, session["history"], history_window=Config.PROMPT_HISTORY_MESSAGES
             )
+            result = response_cache.get(cache_key, query_vector)
+        if result is not None:
+            metrics_tracker.record_cache_lookup(result["persona"], hit=True)
+        return cache_key, result
+
+    def store_response(self, cache_key, result, query_vector):
+        """Record a cache miss and keep the fresh LLM result for later turns"""
+        if cache_key is None:
+            return
+        metrics_tracker.record_cache_lookup(result["persona"], hit=False)
+        if (result.get("sentiment") != "negative" and not result.get("degraded")
+                and result.get("reasoning") != FALLBACK_RESULT["reasoning"]):
+            if query_vector is not None:
+                query_vector = query_vector._replace(context_update=None)  # Only this turn needs it
+            response_cache.put(cache_key, result, query_vector)
+
+    def complete_turn(self, session_id, session, message, cached_persona,
+                      kb_articles, result, start_time, escalation=None, query_vector=None):
+        """
+        Apply the LLM result: persona cache, escalation, history, metrics, response
+        
+        session is the snapshot taken in prepare_turn; the history, sentiment
+        and persona updates are applied to the stored session in one
+        transaction, so concurrent turns on the same session don't lose them.
+
+        escalation is an already computed (should_escalate, reason) pair, for the
+        streaming path where the check runs as soon as the metadata arrives.
+        query_vector (from prepare_turn) carries the message's contribution to
+        the session's retrieval context.
+        """
+        
+        # Check escalation
+        if escalation is None:
+            with metrics_tracker.time_stage("escalation_check"):
+                escalation = self.check_escalation(result, message, session)
+        should_escalate, escalation_reason = escalation
+        
+        with metrics_tracker.time_stage("session_update"), session_store.transaction(session_id) as session:
+            # Cache persona if confidence is high
+            if result["confidence"] >= Config.PERSONA_CONFIDENCE_THRESHOLD:
+                session["persona"] = result["persona"]
+                session["confidence"] = result["confidence"]
             
-            # Build response
-            response_data = {
-                "persona": {
-                    "persona": result["persona"],
-                    "confidence": result["confidence"],
-                    "sentiment": result["sentiment"],
-                    "urgency": result["urgency"],
-                    "reasoning": result["reasoning"],
-                    "cached": cached_persona is not None
-                },
+            # Update conversation history and sentiment trend
+            session["sentiment_history"].append(result.get("sentiment"))
+            session["history"].append({"role": "user", "content": message})
+            session.setdefault("user_tokens", []).append(sorted(set(tokenize(message))))
+            session["history"].append({"role": "assistant", "content": result["response"]})
+            session["message_count"] += 2
+            if query_vector is not None and query_vector.context_update is not None:
+                session["kb_context"] = self.kb_retriever.advance_context(
+                    session.get("kb_context"), query_vector.context_update
+                )
+        
+        # Calculate response time
+        response_time = time.time() - start_time
+        
+        # Track metrics
+        metrics_tracker.record_request(
+            persona=result["persona"],
+            kb_articles=kb_articles,
+            confidence=result["confidence"],
+            response_time=response_time,
+            escalated=should_escalate,
+            sentiment=result["sentiment"],
+            urgency=result["urgency"]
+        )
+        
+        # Build response
+        response_data = {
+            "persona": {
+                "persona": result["persona"],
+                "confidence": result["confidence"],
+                "sentiment": result["sentiment"],
+                "urgency": result["urgency"],
+                "reasoning": result["reasoning"],
+                "cached": cached_persona is not None
+            },
+            "response": result["response"],
+            "kb_articles": kb_articles,
+            "kb_used": result.get("kb_articles_used", []),
+            "escalate": should_escalate,
+            "escalation_reason": escalation_reason,
+            "metrics": {
+                "response_time": round(response_time, 2),
+                "kb_articles_found": len(kb_articles),
+                "conversation_length": session["message_count"]
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        if result.get("degraded"):
+            response_data["degraded"] = True
+        
+        if transcript_log is not None:
+            transcript_log.append({
+                "ts": time.time(),
+                "session_id": session_id,
+                "turn": session["message_count"] // 2,
+                "message": message,
                 "response": result["response"],
-                "kb_articles": kb_articles,
+                "persona": result["persona"],
+                "confidence": result["confidence"],
+                "persona_cached": cached_persona is not None,
+                "sentiment": result["sentiment"],
+                "urgency": result["urgency"],
+                "kb_ids": [article["id"] for article in kb_articles],
                 "kb_used": result.get("kb_articles_used", []),
                 "escalate": should_escalate,
                 "escalation_reason": escalation_reason,
-                "metrics": {
-                    "response_time": round(response_time, 2),
-                    "kb_articles_found": len(kb_articles),
-                    "conversation_length": len(conversation_history)
-                },
-                "timestamp": datetime.now().isoformat()
+                "degraded": bool(result.get("degraded")),
+                "response_time": response_time,
+                "stages": metrics_tracker.turn_stages(),
+            })
+        
+        # Add escalation context if needed
+        if should_escalate:
+            context = {
+                "session_id": session_id,
+                "conversation_length": session["message_count"],
+                "persona": result["persona"],
+                "sentiment": result["sentiment"],
+                "urgency": result["urgency"],
             }
-            
-            # Add escalation context if needed
-            if should_escalate:
-                response_data["escalation_context"] = {
+            if Config.ESCALATION_HISTORY_MODE == "reference":
+                # Absolute index of the oldest message the session still holds
+                offset = session["message_count"] - len(session["history"])
+                context["history_ref"] = {
                     "session_id": session_id,
-                    "conversation_length": len(conversation_history),
-                    "persona": result["persona"],
-                    "sentiment": result["sentiment"],
-                    "urgency": result["urgency"],
-                    "full_history": conversation_history,
-                    "sentiment_history": persona_cache.get(session_id, {}).get("sentiment_history", [])
+                    "offset": offset,
+                    "count": len(session["history"]),
+                    "url": f"/api/sessions/{session_id}/history?offset={offset}"
                 }
+            else:
+                context["full_history"] = session["history"]
+                context["sentiment_history"] = session["sentiment_history"]
+            response_data["escalation_context"] = context
+        
+        return response_data
+
+    def error_response(self, session_id, e, start_time):
+        """Graceful error handling with fallback"""
+        response_time = time.time() - start_time
+        session = session_store.get(session_id)
+        
+        return {
+            "persona": {
+                "persona": "unknown",
+                "confidence": 0.0,
+                "sentiment": "neutral",
+                "urgency": "medium",
+                "reasoning": "Error occurred",
+                "cached": False
+            },
+            "response": (
+                "I apologize, but I'm experiencing technical difficulties. "
+                "Let me connect you with a human agent who can better assist you. "
+                f"Error details: {str(e)}"
+            ),
+            "kb_articles": [],
+            "kb_used": [],
+            "escalate": True,
+            "escalation_reason": f"System error: {str(e)}",
+            "metrics": {
+                "response_time": round(response_time, 2),
+                "kb_articles_found": 0,
+                "conversation_length": session["message_count"] if session else 0
+            },
+            "timestamp": datetime.now().isoformat(),
+            "error": str(e)
+        }
+
+    def process_message(self, session_id, message):
+        """Main processing pipeline with metrics tracking"""
+        
+        start_time = time.time()
+        metrics_tracker.start_turn()  # Per-turn stage timings for the transcript log
+        
+        try:
+            # Step 1: Retrieve KB content (use cached persona if available)
+            session, cached_persona, kb_articles, query_vector = self.prepare_turn(
+                session_id, message
+            )
             
-            return response_data
+            # Step 2: Combined persona detection + response generation (unless cached)
+            cache_key, result = self.lookup_response(session, message, kb_articles, query_vector)
+            if result is None:
+                result = self.detect_persona_and_generate(message, session["history"], kb_articles)
+                self.store_response(cache_key, result, query_vector)
+            
+            # Step 3: Escalation, history and metrics
+            return self.complete_turn(
+                session_id, session, message, cached_persona,
+                kb_articles, result, start_time, query_vector=query_vector
+            )
         
         except Exception as e:
-            # Graceful error handling with fallback
-            response_time = time.time() - start_time
+            return self.error_response(session_id, e, start_time)
+
+    def stream_message(self, session_id, message):
+        """
+        Streaming pipeline: yields (event, data) pairs while the model generates
+
+        Events:
+            meta  - persona/sentiment/urgency plus the escalation decision, sent
+                    as soon as those fields have been parsed from the stream
+            delta - the next piece of the response text
+            done  - the same payload /api/chat would return; its escalate field
+                    is final and may differ from meta if the model put the
+                    response before the metadata
+        """
+        start_time = time.time()
+        metrics_tracker.start_turn()
+        
+        try:
+            session, cached_persona, kb_articles, query_vector = self.prepare_turn(
+                session_id, message
+            )
+            cache_key, result = self.lookup_response(session, message, kb_articles, query_vector)
+            escalation = None
+            if result is None:
+                result, escalation = yield from self._stream_llm(
+                    session, message, cached_persona, kb_articles
+                )
+                self.store_response(cache_key, result, query_vector)
             
-            return {
-                "persona": {
-                    "persona": "unknown",
-                    "confidence": 0.0,
-                    "sentiment": "neutral",
-                    "urgency": "medium",
-                    "reasoning": "Error occurred",
-                    "cached": False
-                },
-                "response": (
-                    "I apologize, but I'm experiencing technical difficulties. "
-                    "Let me connect you with a human agent who can better assist you. "
-                    f"Error details: {str(e)}"
+            yield "done", self.complete_turn(
+                session_id, session, message, cached_persona,
+                kb_articles, result, start_time, escalation=escalation, query_vector=query_vector
+            )
+        
+        except Exception as e:
+            yield "done", self.error_response(session_id, e, start_time)
+
+    def _stream_llm(self, session, message, cached_persona, kb_articles):
+        """
+        Stream the LLM call, yielding meta/delta events
+
+        Returns:
+            (result, escalation): the parsed envelope and the escalation decision
+            made when the metadata arrived (None if it never did, or the meta
+            event had to be sent before all of it was parsed)
+        """
+        prompt, model, prediction, fast_path = self.plan_llm_call(message, session["history"], kb_articles)
+        
+        llm_start = time.perf_counter()
+        try:
+            # Only opening the stream is retried; failures mid-stream fall back at the end
+            stream = self.llm_gateway.call(
+                lambda: self.client.chat.completions.create(
+                    **self.llm_request(prompt, model), stream=True, stream_options={"include_usage": True}
                 ),
-                "kb_articles": [],
-                "kb_used": [],
-                "escalate": True,
-                "escalation_reason": f"System error: {str(e)}",
-                "metrics": {
-                    "response_time": round(response_time, 2),
-                    "kb_articles_found": 0,
-                    "conversation_length": len(conversations.get(session_id, []))
-                },
-                "timestamp": datetime.now().isoformat(),
-                "error": str(e)
-            }
+                tokens=self.request_tokens(prompt)
+            )
+        except LLMUnavailable as e:
+            result = self.degraded_result(kb_articles, e.reason)
+            escalation = yield from self._meta_event(result, message, session, cached_persona)
+            yield "delta", {"text": result["response"]}
+            return result, escalation
+        except Exception as e:
+            raise Exception(f"LLM API Error: {str(e)}")
+        
+        parser = JSONEnvelopeStreamParser(stream_fields=("response",))
+        chunks = []
+        escalation = None
+        meta_sent = False
+        if fast_path:
+            # Metadata is already known locally: send it before the first token
+            meta = self.finish_llm_result(message, {}, prediction, fast_path)
+            escalation = yield from self._meta_event(meta, message, session, cached_persona)
+            meta_sent = True
+        for text in self._stream_text(stream, "fast" if fast_path else "full"):
+            if not chunks:
+                metrics_tracker.record_stage("llm_first_token", time.perf_counter() - llm_start)
+            chunks.append(text)
+            if parser is None:
+                continue
+            try:
+                events = parser.feed(text)
+            except ValueError:
+                parser = None  # Malformed envelope - the fallback applies at the end
+                continue
+            
+            for kind, key, value in events:
+                if not meta_sent and (
+                    kind == "delta" or all(f in parser.fields for f in METADATA_FIELDS)
+                ):
+                    # Metadata is in: decide on escalation before the answer finishes
+                    complete = all(f in parser.fields for f in METADATA_FIELDS)
+                    decision = yield from self._meta_event(parser.fields, message, session, cached_persona)
+                    meta_sent = True
+                    # The answer started before some fields: the meta event used defaults for them,
+                    # so complete_turn decides again from the final envelope
+                    escalation = decision if complete else None
+                if kind == "delta":
+                    yield "delta", {"text": value}
+        metrics_tracker.record_stage("llm_stream", time.perf_counter() - llm_start)
+        
+        if parser is not None and parser.complete:
+            result = self.validate_llm_output(parser.fields, fast_path)
+        else:
+            result = self.parse_llm_output("".join(chunks), fast_path)
+        return self.finish_llm_result(message, result, prediction, fast_path), escalation
+
+    def _meta_event(self, fields, message, session, cached_persona):
+        """Decide on escalation from the metadata fields and yield the meta event"""
+        meta, _ = METADATA_VALIDATOR.validate(fields)
+        with metrics_tracker.time_stage("escalation_check"):
+            escalation = self.check_escalation(meta, message, session)
+        yield "meta", {
+            **meta,
+            "cached": cached_persona is not None,
+            "escalate": escalation[0],
+            "escalation_reason": escalation[1]
+        }
+        return escalation
+
+    def _stream_text(self, stream, prompt_kind="full"):
+        """Content deltas from a streaming completion; closing it aborts generation"""
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    metrics_tracker.record_usage(chunk.usage, prompt=prompt_kind)  # Final chunk with include_usage
+        except Exception as e:
+            raise Exception(f"LLM API Error: {str(e)}")
+        finally:
+            stream.close()
+
+    async def aprocess_message(self, session_id, message):
+        """
+        Async pipeline: same steps as process_message, awaiting the LLM call
+
+        Retrieval and the session reads/writes run on worker threads: a busy
+        SQLite session store (BEGIN IMMEDIATE waits up to its busy timeout)
+        must not stall every chat on the event loop.
+        """
+        
+        start_time = time.time()
+        # Set on the loop: the worker threads run in copies of this context and add to the same stages
+        metrics_tracker.start_turn()
+        
+        try:
+            session, cached_persona, kb_articles, query_vector = await asyncio.to_thread(
+                self.prepare_turn, session_id, message
+            )
+            cache_key, result = self.lookup_response(session, message, kb_articles, query_vector)
+            if result is None:
+                result = await self.adetect_persona_and_generate(
+                    message, session["history"], kb_articles
+                )
+                self.store_response(cache_key, result, query_vector)
+            return await asyncio.to_thread(
+                self.complete_turn, session_id, session, message, cached_persona,
+                kb_articles, result, start_time, query_vector=query_vector
+            )
+        
+        except Exception as e:
+            return await asyncio.to_thread(self.error_response, session_id, e, start_time)
 
 
-# Initialize agent
-try:
-    agent = SupportAgent()
+# Set by create_app(); None until startup has finished
+agent = None
+
+
+def build_agent():
+    """Startup work: validate the configuration and build the agent (LLM client, KB index)"""
+    global agent
+    if agent is not None:
+        return  # Injected through create_app() meanwhile
+    with startup.phase("config"):
+        Config.validate()
+    built = SupportAgent()
+    if agent is None:
+        agent = built
     print("[OK] Support Agent initialized successfully!")
-except Exception as e:
-    print(f"[ERROR] Error initializing agent: {e}")
-    exit(1)
+
+
+def create_app(support_agent=None, background=None):
+    """
+    Application factory: the Flask app, with the agent being built
+
+    Without support_agent, build_agent() runs once - on a background thread
+    unless background (default Config.STARTUP_BACKGROUND) is False - so the
+    worker answers /api/health/live at once and /api/health/ready turns 200
+    when the KB index is built. A failure is reported there instead of
+    exiting. Pass support_agent (e.g. one with a fake LLM client) to use it
+    as-is. Serving app directly (gunicorn app:app) starts up on the first
+    request.
+    """
+    global agent
+    if support_agent is not None:
+        agent = support_agent
+        startup.mark_ready()
+    else:
+        startup.run(build_agent, Config.STARTUP_BACKGROUND if background is None else background)
+    if transcript_log is not None:
+        transcript_log.start()
+    return app
+
+
+@app.before_request
+def ensure_started():
+    if startup.state == startup.STARTING:
+        create_app()
+    if metrics_publisher is not None:
+        metrics_publisher.start()  # Once per process, after any fork
+    if transcript_log is not None:
+        transcript_log.start()
+
+
+def metrics_view():
+    """
+    (tracker, processes) behind the metrics routes: cluster-wide when workers
+    publish to CLUSTER_METRICS_DIR, unless ?scope=worker asks for this process only
+    """
+    if metrics_publisher is None or request.args.get('scope') == 'worker':
+        return metrics_tracker, 1
+    return merged_metrics(metrics_tracker, Config.CLUSTER_METRICS_DIR)
+
+
+def not_ready_payload():
+    """Body of the 503 for routes that need the agent while startup is running (or failed)"""
+    return {
+        "error": "Service is starting" if startup.state == startup.STARTING else "Startup failed",
+        "startup": startup.status()
+    }
+
+
+def not_ready():
+    return jsonify(not_ready_payload()), 503
 
 
 @app.route('/')
@@ -397,9 +1132,41 @@ def chat():
         
         if not message:
             return jsonify({"error": "No message provided"}), 400
+        if agent is None:
+            return not_ready()
         
         result = agent.process_message(session_id, message)
-        return jsonify(result)
+        with metrics_tracker.time_stage("serialization"):
+            return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "message": "An error occurred. Please try again or contact support."
+        }), 500
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /api/chat, streamed as server-sent events (meta, delta..., done)"""
+    try:
+        data = request.json
+        message = data.get('message')
+        session_id = data.get('session_id', 'default')
+        
+        if not message:
+            return jsonify({"error": "No message provided"}), 400
+        if agent is None:
+            return not_ready()
+        
+        def generate():
+            for event, payload in agent.stream_message(session_id, message):
+                yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+        
+        return Response(generate(), mimetype='text/event-stream', headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Don't let proxies buffer the stream
+        })
     
     except Exception as e:
         return jsonify({
@@ -408,33 +1175,118 @@ def chat():
         }), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters and latency summaries in Prometheus text format"""
+    tracker, _ = metrics_view()
+    return Response(tracker.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    """
+    GET: profiler status and top stacks (?format=collapsed for flamegraph input)
+    POST {"enabled": bool, "interval_ms": int, "reset": bool}: switch it at runtime
+    """
+    if request.method == 'POST':
+        data = request.json or {}
+        interval_ms = data.get('interval_ms', Config.PROFILER_INTERVAL_MS)  # The default is clamped by start()
+        if 'interval_ms' in data and (isinstance(interval_ms, bool) or not isinstance(interval_ms, int) or not (
+            profiler.MIN_INTERVAL_MS <= interval_ms <= profiler.MAX_INTERVAL_MS
+        )):
+            return jsonify({
+                "error": f"interval_ms must be an integer from {profiler.MIN_INTERVAL_MS} "
+                         f"to {profiler.MAX_INTERVAL_MS}"
+            }), 400
+        if data.get('reset'):
+            profiler.reset()
+        if data.get('enabled') is True:
+            profiler.start(interval_ms)
+        elif data.get('enabled') is False:
+            profiler.stop()
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    return jsonify(profiler.status())
+
+
 @app.route('/api/reset/<session_id>', methods=['POST'])
 def reset_conversation(session_id):
     """Reset conversation and clear cache"""
-    if session_id in conversations:
-        del conversations[session_id]
-    if session_id in persona_cache:
-        del persona_cache[session_id]
+    session_store.delete(session_id)
     return jsonify({"message": "Conversation reset successfully"})
 
 
+@app.route('/api/sessions/<session_id>/history', methods=['GET'])
+def session_history(session_id):
+    """
+    Conversation history from an absolute message offset (see history_ref in
+    escalation_context). Only the compacted window is kept, so the returned
+    offset may be later than the one requested.
+    """
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found"}), 404
+    history = session["history"]
+    first = session["message_count"] - len(history)
+    start = min(max(request.args.get('offset', first, type=int) - first, 0), len(history))
+    return jsonify({
+        "session_id": session_id,
+        "offset": first + start,
+        "message_count": session["message_count"],
+        "messages": history[start:],
+        "sentiment_history": session["sentiment_history"]
+    })
+
+
+@app.route('/api/kb/reload', methods=['POST'])
+def reload_knowledge_base():
+    """Reload the KB from Config.KB_PATH and apply only the changed articles"""
+    if agent is None:
+        return not_ready()
+    try:
+        from kb_retriever import load_knowledge_base
+        summary = agent.kb_retriever.reload(load_knowledge_base(Config.KB_PATH))
+        return jsonify({"message": "Knowledge base reloaded", **summary})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/metrics', methods=['GET'])
 def get_metrics():
     """Get system metrics - great for demos!"""
-    return jsonify(metrics_tracker.get_summary())
+    tracker, processes = metrics_view()
+    summary = tracker.get_summary()
+    if metrics_publisher is not None:
+        summary["cluster"] = {"processes": processes, "worker_pid": os.getpid()}
+    return jsonify(summary)
 
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint: always 200 while the process is up, with startup details"""
     return jsonify({
-        "status": "healthy",
+        "status": "healthy" if startup.ready else startup.state,
+        "ready": startup.ready,
+        "startup": startup.status(),
         "openai_configured": bool(Config.OPENAI_API_KEY),
-        "active_sessions": len(conversations),
+        "llm_circuit": agent.llm_gateway.breaker.state if agent is not None else None,
+        "active_sessions": len(session_store),
         "total_requests": metrics_tracker.metrics["total_requests"]
     })
 
 
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the process answers requests"""
+    return jsonify({"status": "alive", "uptime_seconds": round(startup.uptime(), 3)})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 200 once startup has finished, 503 while starting or after a failure"""
+    return jsonify(startup.status()), 200 if startup.ready else 503
+
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("INTELLIGENT SUPPORT AGENT - PRODUCTION READY")
@@ -446,4 +1298,4 @@ if __name__ == '__main__':
     print(f"[OK] Optimized LLM Calls: Combined Detection + Generation")
     print("="*50 + "\n")
 
-    app.run(debug=Config.FLASK_DEBUG, port=5000)
\ No newline at end of file
+    create_app().run(debug=Config.FLASK_DEBUG, port=5000)
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Async serving mode
+
+POST /api/chat runs on the event loop with AsyncOpenAI, so an in-flight chat
+holds no worker thread while it waits for the model; retrieval and session
+reads/writes before and after the call run on the default thread pool. Outstanding LLM calls are
+capped by Config.LLM_MAX_CONCURRENCY and each call by Config.LLM_TIMEOUT_SECONDS.
+If the client disconnects, its pipeline task is cancelled, which also aborts the
+provider request. Every other route is served by the Flask app.
+
+The agent is built on a background thread at lifespan startup (see
+app.create_app); until it is ready POST /api/chat answers 503.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as app_module
+from app import app as flask_app, metrics_tracker
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+
+async def read_body(receive):
+    """Read the full request body; returns None if the client went away"""
+    body = b""
+    while True:
+        event = await receive()
+        if event["type"] == "http.disconnect":
+            return None
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            return body
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_json(send, status, payload=None, body=None):
+    if body is None:
+        body = flask_app.json.encode(payload)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def chat(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    try:
+        data = json.loads(body or b"null")
+        message = data.get('message')
+        session_id = data.get('session_id', 'default')
+    except (ValueError, AttributeError) as e:
+        await send_json(send, 500, {
+            "error": str(e),
+            "message": "An error occurred. Please try again or contact support."
+        })
+        return
+
+    if not message:
+        await send_json(send, 400, {"error": "No message provided"})
+        return
+
+    agent = app_module.agent
+    if agent is None:
+        app_module.create_app()  # Without a lifespan event, start up on the first request
+        await send_json(send, 503, app_module.not_ready_payload())
+        return
+
+    task = asyncio.create_task(agent.aprocess_message(session_id, message))
+    disconnect = asyncio.create_task(wait_for_disconnect(receive))
+    done, _ = await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+
+    if task not in done:
+        # Client is gone: stop the pipeline and free its LLM slot
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return
+
+    disconnect.cancel()
+    with metrics_tracker.time_stage("serialization"):
+        body = flask_app.json.encode(task.result())
+    await send_json(send, 200, body=body)
+
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            app_module.create_app()
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif (scope["type"] == "http" and scope["method"] == "POST"
+            and scope["path"] == "/api/chat"):
+        await chat(scope, receive, send)
+    else:
+        await flask_asgi(scope, receive, send)
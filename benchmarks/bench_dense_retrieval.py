@@ -0,0 +1,158 @@
+"""
+Recall/latency benchmark for the dense retrieval tier
+
+Builds synthetic knowledge bases of long, multi-section articles (each
+section mixing its own two topics) and compares:
+- the IVF search against exact brute-force search over the same section
+  embeddings: recall@k and p50/p95 latency for several n_probe values
+- retrieve_all() with TF-IDF only against the hybrid (TF-IDF + dense)
+  retriever: latency, and how often the article a query was drawn from
+  is in the top 3
+
+Usage:
+    python -m benchmarks.bench_dense_retrieval
+    python -m benchmarks.bench_dense_retrieval --sizes 2000 20000 --n-probe 4 8 16 --json out.json
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from benchmarks.bench_kb_retrieval import make_vocabulary, time_queries
+from kb_retriever import SmartKBRetriever
+
+
+def make_knowledge_base(n_articles, n_personas, rng, vocab_size=20000, words_per_topic=40):
+    """
+    Articles of 3-6 sections; returns (knowledge_base, sections) where
+    sections lists (article id, topic words, topic words) for query sampling
+    """
+    vocabulary = make_vocabulary(vocab_size, rng)
+    n_topics = max(20, n_articles // 25)
+    topics = [rng.sample(vocabulary[200:], words_per_topic) for _ in range(n_topics)]
+    background = vocabulary[:200]
+
+    knowledge_base = {f"persona_{p}": [] for p in range(n_personas)}
+    sections = []
+    for article_id in range(n_articles):
+        paragraphs = []
+        for _ in range(rng.randint(3, 6)):
+            first, second = rng.sample(topics, 2)
+            words = (rng.choices(first, k=rng.randint(25, 45)) + rng.choices(second, k=rng.randint(25, 45))
+                     + rng.choices(background, k=30))
+            rng.shuffle(words)
+            paragraphs.append(" ".join(words))
+            sections.append((article_id, first, second))
+        knowledge_base[f"persona_{article_id % n_personas}"].append({
+            "id": article_id,
+            "title": " ".join(rng.sample(rng.choice(topics), 3)),
+            "content": "\n\n".join(paragraphs),
+            "keywords": [],
+        })
+    return knowledge_base, sections
+
+
+def make_queries(sections, n_queries, rng):
+    """(query, source article id): words of both topics of a random section"""
+    queries = []
+    for article_id, first, second in rng.sample(sections, min(n_queries, len(sections))):
+        words = rng.sample(first, 3) + rng.sample(second, 3)
+        rng.shuffle(words)
+        queries.append((" ".join(words), article_id))
+    return queries
+
+
+def hit_rate(retriever, queries, k=3):
+    hits = sum(
+        any(article["id"] == article_id for article in retriever.retrieve_all(query, top_k=k)[0])
+        for query, article_id in queries
+    )
+    return round(hits / len(queries), 4)
+
+
+def ann_recall(dense, query_vectors, k, n_probe):
+    recalls = []
+    for vector in query_vectors:
+        exact = set(dense.exact_search(vector, k)[0].tolist())
+        approx = set(dense.search(vector, k, n_probe)[0].tolist())
+        recalls.append(len(exact & approx) / max(1, len(exact)))
+    return round(float(np.mean(recalls)), 4)
+
+
+def run(sizes, n_queries, n_personas, n_probes, k, seed):
+    results = []
+    for size in sizes:
+        rng = random.Random(seed)
+        knowledge_base, sections = make_knowledge_base(size, n_personas, rng)
+        queries = make_queries(sections, n_queries, rng)
+        texts = [query for query, _ in queries]
+
+        start = time.perf_counter()
+        sparse = SmartKBRetriever(knowledge_base)
+        sparse_build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        hybrid = SmartKBRetriever(knowledge_base, dense=True)
+        hybrid_build_s = time.perf_counter() - start
+
+        dense = hybrid._index.dense
+        query_vectors = [dense.encoder.encode_one(text) for text in texts]
+        positions = range(len(query_vectors))
+        ann = {
+            n_probe: {
+                "recall": ann_recall(dense, query_vectors, k, n_probe),
+                **time_queries(lambda i: dense.search(query_vectors[i], k, n_probe), positions),
+            }
+            for n_probe in n_probes
+        }
+        results.append({
+            "articles": size,
+            "sections": len(dense),
+            "lists": dense.n_lists,
+            "sparse_build_s": round(sparse_build_s, 3),
+            "hybrid_build_s": round(hybrid_build_s, 3),
+            "exact_search": time_queries(lambda i: dense.exact_search(query_vectors[i], k), positions),
+            "ann_search": ann,
+            "sparse_retrieve_all": time_queries(lambda q: sparse.retrieve_all(q), texts),
+            "hybrid_retrieve_all": time_queries(lambda q: hybrid.retrieve_all(q), texts),
+            "sparse_hit_at_3": hit_rate(sparse, queries),
+            "hybrid_hit_at_3": hit_rate(hybrid, queries),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 20000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--personas", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("-k", type=int, default=10, help="Sections compared for recall@k")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.personas, args.n_probe, args.k, args.seed)
+
+    for row in results:
+        print(f"\n{row['articles']} articles, {row['sections']} sections in {row['lists']} lists; "
+              f"build {row['sparse_build_s']}s TF-IDF only, {row['hybrid_build_s']}s with dense")
+        print(f"{'search':>16} {'recall@' + str(args.k):>10} {'p50 ms':>9} {'p95 ms':>9}")
+        exact = row["exact_search"]
+        print(f"{'exact':>16} {1.0:>10.4f} {exact['p50_ms']:>9.3f} {exact['p95_ms']:>9.3f}")
+        for n_probe, stats in row["ann_search"].items():
+            print(f"{'ivf n_probe=' + str(n_probe):>16} {stats['recall']:>10.4f} "
+                  f"{stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f}")
+        print(f"{'retrieve_all':>16} {'hit@3':>10} {'p50 ms':>9} {'p95 ms':>9}")
+        for name in ("sparse", "hybrid"):
+            stats = row[f"{name}_retrieve_all"]
+            print(f"{name:>16} {row[f'{name}_hit_at_3']:>10.4f} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Micro-benchmark for SmartKBRetriever per-query latency
+
+Builds synthetic knowledge bases of increasing size and times retrieve() and
+retrieve_all() against the original scoring path (sklearn cosine_similarity +
+full argsort + dict copies) on the same index, plus the amortized per-query
+cost of one retrieve_many() batch.
+
+Usage:
+    python -m benchmarks.bench_kb_retrieval
+    python -m benchmarks.bench_kb_retrieval --sizes 1000 10000 --queries 500 --json out.json
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from kb_retriever import SmartKBRetriever
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "tu", "sha", "vo", "pex", "qui", "dar",
+             "el", "ion", "zu", "bra", "nok", "ter", "ast", "ul", "ph", "ox"]
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_knowledge_base(n_articles, n_personas, rng, vocab_size=5000):
+    """Articles with Zipf-like word frequencies, spread evenly over personas"""
+    vocabulary = make_vocabulary(vocab_size, rng)
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    knowledge_base = {f"persona_{p}": [] for p in range(n_personas)}
+    for article_id in range(n_articles):
+        words = rng.choices(vocabulary, weights=weights, k=rng.randint(30, 60))
+        knowledge_base[f"persona_{article_id % n_personas}"].append({
+            "id": article_id,
+            "title": " ".join(words[:4]),
+            "content": " ".join(words[4:]),
+            "keywords": words[:3],
+        })
+    return knowledge_base
+
+
+def make_queries(knowledge_base, n_queries, rng):
+    articles = [a for articles in knowledge_base.values() for a in articles]
+    queries = []
+    for _ in range(n_queries):
+        words = rng.choice(articles)["content"].split()
+        queries.append(" ".join(rng.sample(words, min(len(words), rng.randint(4, 10)))))
+    return queries
+
+
+def legacy_retrieve(retriever, persona_matrix, rows, query, top_k=3):
+    """The pre-optimization scoring path, run on the same index for comparison"""
+    index = retriever._index
+    query_vector = index.vectorizer.transform([query])
+    similarities = cosine_similarity(query_vector, persona_matrix).flatten()
+    results = []
+    for idx in np.argsort(similarities)[-top_k:][::-1]:
+        if similarities[idx] > 0.1:
+            article = index.articles[rows[idx]].copy()
+            article['relevance_score'] = float(similarities[idx])
+            results.append(article)
+    return results
+
+
+def time_queries(fn, queries):
+    fn(queries[0])  # warm up
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": round(float(latencies_ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 4),
+    }
+
+
+def time_batch(retriever, persona, queries):
+    retriever.retrieve_many(persona, queries[:1])  # warm up
+    start = time.perf_counter()
+    retriever.retrieve_many(persona, queries)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def run(sizes, n_queries, n_personas, seed):
+    results = []
+    for size in sizes:
+        rng = random.Random(seed)
+        knowledge_base = make_knowledge_base(size, n_personas, rng)
+        queries = make_queries(knowledge_base, n_queries, rng)
+
+        start = time.perf_counter()
+        retriever = SmartKBRetriever(knowledge_base)
+        build_s = time.perf_counter() - start
+
+        persona = "persona_0"
+        rows = retriever._index.persona_rows[persona]
+        persona_matrix = retriever.article_matrix[rows]
+        results.append({
+            "articles": size,
+            "personas": n_personas,
+            "build_s": round(build_s, 3),
+            "retrieve": time_queries(lambda q: retriever.retrieve(persona, q), queries),
+            "retrieve_all": time_queries(lambda q: retriever.retrieve_all(q), queries),
+            "legacy_retrieve": time_queries(lambda q: legacy_retrieve(retriever, persona_matrix, rows, q), queries),
+            "retrieve_many_per_query_ms": round(time_batch(retriever, persona, queries), 4),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--personas", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.personas, args.seed)
+
+    print(f"{'articles':>9} {'build s':>8} {'retrieve p50/p95 ms':>22} "
+          f"{'retrieve_all p50/p95 ms':>25} {'legacy p50/p95 ms':>20} {'batched ms/query':>17}")
+    for row in results:
+        cells = [f"{row[k]['p50_ms']:.3f}/{row[k]['p95_ms']:.3f}"
+                 for k in ("retrieve", "retrieve_all", "legacy_retrieve")]
+        print(f"{row['articles']:>9} {row['build_s']:>8} {cells[0]:>22} {cells[1]:>25} {cells[2]:>20} "
+              f"{row['retrieve_many_per_query_ms']:>17.4f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
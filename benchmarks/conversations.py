@@ -0,0 +1,87 @@
+"""
+Synthetic support conversations for load tests
+
+Every persona gets everyday questions, and dedicated scripts walk into each
+escalation trigger in SupportAgent.check_escalation: escalation keywords,
+repeated questions, two negative turns in a row, a frustrated user with high
+urgency, and conversations longer than ESCALATION_MESSAGE_THRESHOLD.
+Generation is seeded, so the same arguments always produce the same traffic.
+"""
+import random
+from collections import namedtuple
+
+Conversation = namedtuple("Conversation", ["session_id", "kind", "messages"])
+
+PERSONA_MESSAGES = {
+    "technical_expert": [
+        "How do I authenticate API requests with a bearer token?",
+        "What are the rate limit headers on the REST endpoint?",
+        "Can I verify webhook signatures with the SDK?",
+        "Which auth scopes does the export endpoint need?",
+        "Is there an API endpoint for rotating tokens?",
+    ],
+    "frustrated_user": [
+        "I can't log in to my account",
+        "How do I reset my password?",
+        "Where do I find my invoices?",
+        "The app keeps asking me to sign in again",
+        "How do I change my email address?",
+    ],
+    "business_exec": [
+        "What does the enterprise plan cost per seat?",
+        "Can you summarize the ROI for a team of 200?",
+        "Which compliance certifications do you hold?",
+        "Is there volume pricing for an annual plan?",
+        "What is included in the enterprise SLA?",
+    ],
+}
+
+ESCALATION_SCRIPTS = {
+    "keyword": [
+        "My export failed again",
+        "This is a waste of time, I want to speak to manager right now",
+    ],
+    "repeated_question": [
+        "How do I reset my password on the mobile app?",
+        "How do I reset my password on the mobile app please?",
+        "I asked already: how do I reset my password on the mobile app?",
+    ],
+    "negative_streak": [
+        "The dashboard is broken again",
+        "It is still not working and I am angry",
+        "Everything is down",
+    ],
+    "frustrated_urgent": [
+        "Our whole team is locked out and the login is broken",
+    ],
+}
+
+
+def generate_conversations(n_sessions, seed=7, turns=(2, 4), escalation_share=0.2, long_share=0.05):
+    """
+    n_sessions conversations mixing personas and escalation scripts
+
+    turns is the (min, max) number of messages for everyday conversations;
+    escalation_share and long_share set how many sessions follow an escalation
+    script or run past the conversation-length threshold.
+    """
+    rng = random.Random(seed)
+    personas = sorted(PERSONA_MESSAGES)
+    scripts = sorted(ESCALATION_SCRIPTS)
+    conversations = []
+    for index in range(n_sessions):
+        session_id = f"load-{seed}-{index}"
+        roll = rng.random()
+        if roll < escalation_share:
+            kind = scripts[index % len(scripts)]
+            messages = list(ESCALATION_SCRIPTS[kind])
+        elif roll < escalation_share + long_share:
+            kind = "long_conversation"
+            pool = PERSONA_MESSAGES[personas[index % len(personas)]]
+            messages = [f"{rng.choice(pool)} (follow-up {turn})" for turn in range(6)]
+        else:
+            kind = personas[index % len(personas)]
+            pool = PERSONA_MESSAGES[kind]
+            messages = rng.sample(pool, rng.randint(*turns))
+        conversations.append(Conversation(session_id, kind, messages))
+    return conversations
@@ -0,0 +1,209 @@
+"""
+Deterministic in-process stand-in for the OpenAI chat completions client
+
+FakeLLMClient and AsyncFakeLLMClient expose the subset of the OpenAI client
+that SupportAgent uses (chat.completions.create, with and without stream=True)
+and can be passed to SupportAgent(client=..., async_client=...). Replies are
+the same canned persona envelopes as the HTTP stub, delayed by a configurable
+latency distribution. A share of them is malformed so the JSON fallback path
+gets exercised too.
+
+With error_rate, a share of calls fails like the real client does on a
+429/5xx (status_code plus a retry-after header), to exercise the gateway's
+retries and circuit breaker. Change error_rate at runtime to simulate an
+outage and its recovery.
+
+Malformed replies, injected errors and latency samples are drawn from a
+seeded RNG, so repeated runs are comparable.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from benchmarks.openai_stub import canned_envelope
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+
+class FakeAPIError(Exception):
+    """Stands in for openai.APIStatusError: status_code and response.headers"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Error code: {status_code} (injected by the fake backend)")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def malformed_variants(content):
+    """Ways the model's envelope can come back broken"""
+    return [
+        content[:len(content) // 2],                    # truncated mid-object
+        "Sure! Here is my answer: " + content[:40],     # prose before a partial envelope
+        content.replace('"', "'"),                      # single-quoted pseudo-JSON
+        "",                                             # empty completion
+    ]
+
+
+class FakeLLMBackend:
+    """Latency model and canned outputs shared by the sync and async clients"""
+
+    def __init__(self, latency_ms=300.0, distribution="lognormal", malformed_rate=0.0, seed=7,
+                 error_rate=0.0, error_status=429, retry_after=None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution!r}")
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.calls = 0
+        self.malformed = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self):
+        """Seconds for one completion; latency_ms is the mean (median for lognormal)"""
+        with self._lock:
+            self.calls += 1
+            if self.distribution == "constant":
+                ms = self.latency_ms
+            elif self.distribution == "uniform":
+                ms = self._rng.uniform(0.5 * self.latency_ms, 1.5 * self.latency_ms)
+            else:
+                ms = self.latency_ms * self._rng.lognormvariate(0, 0.5)
+        return ms / 1000
+
+    def maybe_fail(self):
+        """Raise an injected provider error for error_rate of the calls"""
+        with self._lock:
+            if not self._rng.random() < self.error_rate:
+                return
+            self.errors += 1
+        raise FakeAPIError(self.error_status, self.retry_after)
+
+    def reply(self, messages):
+        """(content, prompt_tokens, completion_tokens) for a request's messages"""
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        content = json.dumps(canned_envelope(prompt))
+        with self._lock:
+            if self._rng.random() < self.malformed_rate:
+                self.malformed += 1
+                content = self._rng.choice(malformed_variants(content))
+        return content, len(prompt) // 4, len(content) // 4
+
+    def completion(self, model, content, prompt_tokens, completion_tokens):
+        return SimpleNamespace(
+            id="chatcmpl-fake",
+            model=model,
+            choices=[SimpleNamespace(
+                index=0,
+                message=SimpleNamespace(role="assistant", content=content),
+                finish_reason="stop"
+            )],
+            usage=self.usage(prompt_tokens, completion_tokens)
+        )
+
+    def chunks(self, content, prompt_tokens, completion_tokens, include_usage, piece_size=8):
+        for i in range(0, len(content), piece_size):
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=content[i:i + piece_size]))],
+                usage=None
+            )
+        if include_usage:
+            yield SimpleNamespace(choices=[], usage=self.usage(prompt_tokens, completion_tokens))
+
+    @staticmethod
+    def usage(prompt_tokens, completion_tokens):
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+
+
+class FakeStream:
+    """Iterable of completion chunks, spread over the sampled latency"""
+
+    def __init__(self, chunks, latency):
+        self._chunks = list(chunks)
+        self._latency = latency
+        self.closed = False
+
+    def __iter__(self):
+        time.sleep(self._latency * 0.2)
+        gap = self._latency * 0.8 / max(1, len(self._chunks))
+        for chunk in self._chunks:
+            if self.closed:
+                return
+            yield chunk
+            time.sleep(gap)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncStream(FakeStream):
+    """Async iterable of completion chunks, like openai.AsyncStream"""
+
+    async def __aiter__(self):
+        await asyncio.sleep(self._latency * 0.2)
+        gap = self._latency * 0.8 / max(1, len(self._chunks))
+        for chunk in self._chunks:
+            if self.closed:
+                return
+            yield chunk
+            await asyncio.sleep(gap)
+
+    async def close(self):
+        self.closed = True
+
+
+class _Completions:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def create(self, model="fake", messages=(), stream=False, stream_options=None, **kwargs):
+        backend = self._backend
+        backend.maybe_fail()
+        content, prompt_tokens, completion_tokens = backend.reply(messages)
+        latency = backend.sample_latency()
+        if stream:
+            include_usage = bool((stream_options or {}).get("include_usage"))
+            return FakeStream(backend.chunks(content, prompt_tokens, completion_tokens, include_usage), latency)
+        time.sleep(latency)
+        return backend.completion(model, content, prompt_tokens, completion_tokens)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model="fake", messages=(), stream=False, stream_options=None, **kwargs):
+        backend = self._backend
+        backend.maybe_fail()
+        content, prompt_tokens, completion_tokens = backend.reply(messages)
+        latency = backend.sample_latency()
+        if stream:
+            include_usage = bool((stream_options or {}).get("include_usage"))
+            return FakeAsyncStream(backend.chunks(content, prompt_tokens, completion_tokens, include_usage), latency)
+        await asyncio.sleep(latency)
+        return backend.completion(model, content, prompt_tokens, completion_tokens)
+
+
+class FakeLLMClient:
+    """Drop-in for openai.OpenAI in SupportAgent"""
+
+    def __init__(self, backend=None, **backend_options):
+        self.backend = backend or FakeLLMBackend(**backend_options)
+        self.chat = SimpleNamespace(completions=_Completions(self.backend))
+
+
+class AsyncFakeLLMClient:
+    """Drop-in for openai.AsyncOpenAI in SupportAgent"""
+
+    def __init__(self, backend=None, **backend_options):
+        self.backend = backend or FakeLLMBackend(**backend_options)
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(self.backend))
@@ -0,0 +1,284 @@
+"""
+Offline load test for /api/chat
+
+Serves the Flask app in-process with the fake LLM backend (no network, no
+API credits) and drives /api/chat over HTTP at a target request rate. Many
+concurrent sessions replay synthetic conversations, and each session sends
+its next message only after the previous answer arrives. Arrivals are
+scheduled open-loop, so a slow server shows up as latency, not as a lower
+offered rate.
+
+Reports throughput, latency percentiles, error/fallback/escalation counts
+and memory growth per session, and can write them as JSON. With --compare,
+flags regressions against an earlier report and exits non-zero.
+
+Usage:
+    python -m benchmarks.load_test --rps 50 --duration 20 --json run.json
+    python -m benchmarks.load_test --rps 50 --duration 20 --compare run.json
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --rps 5   # a running server
+"""
+import argparse
+import json
+import os
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.conversations import generate_conversations
+
+FALLBACK_REASONING = "Error in LLM response parsing"
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux), or None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def start_local_server(args):
+    """Serve app.py in a background thread with the fake LLM client; returns (base_url, app module)"""
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("KB_INDEX_DIR", "")
+    os.environ.setdefault("SESSION_MAX_SESSIONS", str(max(10000, args.sessions * 2)))
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    import app as app_module
+    from benchmarks.fake_llm import AsyncFakeLLMClient, FakeLLMBackend, FakeLLMClient
+
+    backend = FakeLLMBackend(
+        latency_ms=args.latency_ms,
+        distribution=args.latency_dist,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+        error_rate=args.error_rate,
+        error_status=args.error_status
+    )
+    # The async client serves micro-batched calls (LLM_BATCH_ENABLED=true)
+    app_module.create_app(app_module.SupportAgent(
+        client=FakeLLMClient(backend), async_client=AsyncFakeLLMClient(backend)
+    ))
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass  # Keep benchmark output clean
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", app_module
+
+
+def post_chat(base_url, session_id, message, timeout):
+    body = json.dumps({"message": message, "session_id": session_id}).encode()
+    req = urllib.request.Request(
+        f"{base_url}/api/chat", data=body, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (urllib.error.URLError, TimeoutError, OSError):
+        return None, None
+
+
+def drive(base_url, conversations, rps, duration, concurrency, timeout):
+    """
+    Send one message per arrival slot to an idle session, for `duration` seconds
+
+    Returns a list of per-request records and the number of arrivals that
+    found every session busy (the client side could not keep up).
+    """
+    idle = deque(conversations)
+    position = {c.session_id: 0 for c in conversations}
+    lock = threading.Lock()
+    records = []
+    starved = 0
+
+    def send(conversation):
+        message = conversation.messages[position[conversation.session_id]]
+        start = time.perf_counter()
+        status, payload = post_chat(base_url, conversation.session_id, message, timeout)
+        latency = time.perf_counter() - start
+        with lock:
+            records.append({
+                "kind": conversation.kind,
+                "status": status,
+                "latency": latency,
+                "error": status != 200 or payload is None or "error" in payload,
+                "fallback": bool(payload) and payload.get("persona", {}).get("reasoning") == FALLBACK_REASONING,
+                "escalated": bool(payload) and payload.get("escalate", False),
+                "degraded": bool(payload) and payload.get("degraded", False),
+            })
+            position[conversation.session_id] += 1
+            if position[conversation.session_id] >= len(conversation.messages):
+                position[conversation.session_id] = 0  # Start the conversation over
+            idle.append(conversation)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        arrival = 0
+        while True:
+            due = start + arrival / rps
+            if due - start >= duration:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                conversation = idle.popleft() if idle else None
+            if conversation is None:
+                starved += 1
+            else:
+                pool.submit(send, conversation)
+            arrival += 1
+    return records, starved
+
+
+def summarize(records, starved, elapsed):
+    latencies_ms = np.array([r["latency"] for r in records if not r["error"]]) * 1000
+    percentiles = {
+        f"p{q}_ms": round(float(np.percentile(latencies_ms, q)), 2) if len(latencies_ms) else None
+        for q in (50, 95, 99)
+    }
+    by_kind = {}
+    for record in records:
+        kind = by_kind.setdefault(record["kind"], {"requests": 0, "escalated": 0})
+        kind["requests"] += 1
+        kind["escalated"] += record["escalated"]
+    return {
+        "requests": len(records),
+        "throughput_rps": round(len(records) / elapsed, 2),
+        "errors": sum(r["error"] for r in records),
+        "fallbacks": sum(r["fallback"] for r in records),
+        "escalations": sum(r["escalated"] for r in records),
+        "degraded": sum(r["degraded"] for r in records),
+        "starved_arrivals": starved,
+        "latency": {
+            "mean_ms": round(float(latencies_ms.mean()), 2) if len(latencies_ms) else None,
+            **percentiles,
+            "max_ms": round(float(latencies_ms.max()), 2) if len(latencies_ms) else None,
+        },
+        "by_kind": by_kind,
+    }
+
+
+def compare(report, baseline, max_regression):
+    """Print deltas against a baseline report; returns False on a regression"""
+    ok = True
+    checks = [
+        ("throughput_rps", report["results"]["throughput_rps"], baseline["results"]["throughput_rps"], False),
+    ] + [
+        (key, report["results"]["latency"][key], baseline["results"]["latency"][key], True)
+        for key in ("p50_ms", "p95_ms", "p99_ms")
+    ]
+    print(f"\nAgainst baseline {baseline.get('commit', '?')} ({baseline.get('timestamp', '?')}):")
+    for name, current, previous, lower_is_better in checks:
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        regressed = change > max_regression if lower_is_better else change < -max_regression
+        ok = ok and not regressed
+        print(f"  {'[FAIL]' if regressed else '[OK]  '} {name}: {previous} -> {current} ({change:+.1%})")
+    return ok
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Target a running server instead of an in-process one")
+    parser.add_argument("--rps", type=float, default=50, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--sessions", type=int, default=500, help="Concurrent conversations")
+    parser.add_argument("--concurrency", type=int, default=128, help="Max requests in flight")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fake LLM latency")
+    parser.add_argument("--latency-dist", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--malformed-rate", type=float, default=0.05, help="Share of broken LLM envelopes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of LLM calls failing with --error-status")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Baseline report to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    conversations = generate_conversations(args.sessions, seed=args.seed)
+    app_module = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        base_url, app_module = start_local_server(args)
+    rss_before = rss_bytes()
+
+    start = time.perf_counter()
+    records, starved = drive(base_url, conversations, args.rps, args.duration, args.concurrency, args.timeout)
+    results = summarize(records, starved, time.perf_counter() - start)
+
+    if app_module is not None:
+        rss_after = rss_bytes()
+        sessions = len(app_module.session_store)
+        results["memory"] = {
+            "sessions": sessions,
+            "rss_growth_bytes": rss_after - rss_before if rss_before and rss_after else None,
+            "rss_growth_per_session_bytes": (
+                round((rss_after - rss_before) / sessions) if rss_before and rss_after and sessions else None
+            ),
+            "session_store_bytes": getattr(app_module.session_store, "current_bytes", None),
+        }
+        results["llm"] = {
+            "calls": app_module.agent.client.backend.calls,
+            "malformed": app_module.agent.client.backend.malformed,
+            "injected_errors": app_module.agent.client.backend.errors,
+            "gateway": app_module.metrics_tracker.get_gateway_summary(),
+        }
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": vars(args),
+        "results": results,
+    }
+
+    latency = results["latency"]
+    print(f"{results['requests']} requests in {args.duration:.0f}s -> {results['throughput_rps']} req/s "
+          f"(target {args.rps}), errors {results['errors']}, fallbacks {results['fallbacks']}, "
+          f"escalations {results['escalations']}, degraded {results['degraded']}, "
+          f"starved arrivals {results['starved_arrivals']}")
+    print(f"latency ms: mean {latency['mean_ms']} p50 {latency['p50_ms']} p95 {latency['p95_ms']} "
+          f"p99 {latency['p99_ms']} max {latency['max_ms']}")
+    if "memory" in results:
+        memory = results["memory"]
+        print(f"memory: {memory['sessions']} sessions, RSS +{memory['rss_growth_bytes']} bytes "
+              f"({memory['rss_growth_per_session_bytes']} per session)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint
+
+Answers POST /v1/chat/completions with a canned persona JSON envelope after a
+configurable delay, streamed as SSE chunks when the request sets "stream". This
+lets the sync, async and streaming serving modes run without network access or
+API credits.
+
+--error-rate injects provider failures (--error-status, default 429, with an
+optional Retry-After) for testing the LLM gateway's retries and breaker.
+
+Usage:
+    python -m benchmarks.openai_stub --port 8089 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub uvicorn asgi:application
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PERSONA_HINTS = [
+    ("business_exec", ("price", "pricing", "cost", "roi", "compliance", "enterprise", "plan")),
+    ("technical_expert", ("api", "webhook", "token", "rate limit", "endpoint", "sdk", "auth")),
+]
+
+
+def canned_envelope(prompt):
+    """Persona envelope chosen from keywords in the prompt's CURRENT MESSAGE"""
+    match = re.search(r'CURRENT MESSAGE: "(.*)"', prompt)
+    message = (match.group(1) if match else prompt).lower()
+    persona = next(
+        (name for name, hints in PERSONA_HINTS if any(h in message for h in hints)),
+        "frustrated_user"
+    )
+    negative = any(w in message for w in ("broken", "not working", "angry", "useless", "down"))
+    return {
+        "persona": persona,
+        "confidence": 0.9,
+        "sentiment": "negative" if negative else "neutral",
+        "urgency": "high" if negative else "medium",
+        "response": f"Stub answer for a {persona.replace('_', ' ')}.",
+        "kb_articles_used": [],
+        "reasoning": "Canned response from the local OpenAI stub",
+    }
+
+
+def completion_body(model, content, prompt_tokens=0):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        },
+    }
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 429
+    retry_after = None
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        if random.random() < self.error_rate:
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            self._send_json(self.error_status, {"error": {
+                "message": f"Injected error {self.error_status}",
+                "type": "rate_limit_error" if self.error_status == 429 else "server_error",
+                "code": None,
+            }}, headers)
+            return
+
+        prompt = "\n".join(str(m.get("content", "")) for m in payload.get("messages", []))
+        content = json.dumps(canned_envelope(prompt))
+        if payload.get("stream"):
+            include_usage = (payload.get("stream_options") or {}).get("include_usage", False)
+            self._send_stream(payload.get("model", "stub"), content, len(prompt) // 4 if include_usage else None)
+            return
+        time.sleep(self.latency)
+        self._send_json(200, completion_body(payload.get("model", "stub"), content, len(prompt) // 4))
+
+    def _send_stream(self, model, content, prompt_tokens=None, piece_size=8):
+        """
+        SSE chunks: first token after 20% of the latency, the rest spread evenly
+
+        With prompt_tokens (stream_options.include_usage) a final chunk with no
+        choices carries the usage, like the real API.
+        """
+        pieces = [content[i:i + piece_size] for i in range(0, len(content), piece_size)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(self.latency * 0.2)
+        gap = self.latency * 0.8 / max(1, len(pieces))
+        for index, piece in enumerate(pieces):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece},
+                    "finish_reason": "stop" if index == len(pieces) - 1 else None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(gap)
+        if prompt_tokens is not None:
+            usage = completion_body(model, content, prompt_tokens)
+            usage.update(object="chat.completion.chunk", choices=[])
+            self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, error_status=429, retry_after=None):
+    """Start the stub in a daemon thread; returns (server, base_url)"""
+    handler = type("ConfiguredStubHandler", (StubOpenAIHandler,), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "error_status": error_status,
+        "retry_after": retry_after,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429, help="HTTP status of injected failures")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with injected failures")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(
+        args.host, args.port, args.latency, args.error_rate, args.error_status, args.retry_after
+    )
+    print(f"[OK] OpenAI stub listening at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
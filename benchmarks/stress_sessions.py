@@ -0,0 +1,114 @@
+"""
+Concurrency stress check for session and metrics state
+
+Runs many threads through SupportAgent.process_message against the local
+OpenAI stub, with several threads sharing each session, then checks that no
+update was lost:
+    - every session's message_count is 2x the messages sent to it
+    - its sentiment history and compacted history are full and alternate
+      user/assistant in order
+    - metrics counted every request exactly once
+
+A very small thread switch interval makes lost-update races likely if any
+shared state is read-modify-written without protection. Exits non-zero on
+failure.
+
+Usage:
+    python -m benchmarks.stress_sessions
+    python -m benchmarks.stress_sessions --threads 32 --sessions 4 --messages 50 --backend sqlite
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.openai_stub import start_stub_server
+
+
+def configure(args):
+    """Environment for the app module; must run before it is imported"""
+    _, base_url = start_stub_server(latency=args.latency)
+    os.environ.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": base_url,
+        "KB_INDEX_DIR": "",
+        "RESPONSE_CACHE_ENABLED": "False",
+        "SESSION_BACKEND": args.backend,
+        "SESSION_DB_PATH": os.path.join(tempfile.mkdtemp(), "sessions.db"),
+        "SESSION_MAX_SESSIONS": str(max(args.sessions, 10000)),
+    })
+
+
+def run(args):
+    import app
+
+    app.create_app(background=False)
+    barrier = threading.Barrier(args.threads)
+    errors = []
+
+    def worker(thread_id):
+        session_id = f"stress-{thread_id % args.sessions}"
+        barrier.wait()
+        for i in range(args.messages):
+            result = app.agent.process_message(session_id, f"thread {thread_id} message {i} about the api")
+            if "error" in result:
+                errors.append(result["error"])
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    failures = [f"pipeline error: {e}" for e in errors[:5]]
+    sent = {f"stress-{s}": 0 for s in range(args.sessions)}
+    for t in range(args.threads):
+        sent[f"stress-{t % args.sessions}"] += args.messages
+
+    for session_id, messages in sent.items():
+        session = app.session_store.get(session_id)
+        if session is None:
+            failures.append(f"{session_id}: missing")
+            continue
+        if session["message_count"] != 2 * messages:
+            failures.append(f"{session_id}: message_count {session['message_count']} != {2 * messages}")
+        if len(session["sentiment_history"]) != min(messages, app.session_store.sentiment_window):
+            failures.append(f"{session_id}: sentiment history has {len(session['sentiment_history'])} entries")
+        roles = [msg["role"] for msg in session["history"]]
+        if roles != ["user", "assistant"] * (len(roles) // 2) or len(roles) != app.session_store.history_window:
+            failures.append(f"{session_id}: history out of order: {roles}")
+
+    total = app.metrics_tracker.metrics["total_requests"]
+    expected = args.threads * args.messages
+    if total != expected:
+        failures.append(f"metrics: total_requests {total} != {expected}")
+
+    print(f"{expected} messages on {args.threads} threads / {args.sessions} sessions "
+          f"({args.backend}) in {elapsed:.2f}s")
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if not failures:
+        print("[OK] No lost session or metrics updates")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=4, help="Sessions shared by the threads")
+    parser.add_argument("--messages", type=int, default=25, help="Messages per thread")
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub LLM latency in seconds")
+    args = parser.parse_args()
+
+    sys.setswitchinterval(1e-6)
+    configure(args)
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
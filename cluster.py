@@ -0,0 +1,239 @@
+"""
+Pre-fork multi-process serving
+
+The master process imports app.py and builds the agent once, so the KB
+index, vectorizer and persona classifier sit in memory pages that every
+forked worker shares copy-on-write. It then opens the listening socket and
+forks --workers processes that accept from it, restarting any that die.
+Sessions are kept in the SQLite backend, so consecutive turns of a
+conversation can land on different workers. Each worker publishes its
+metrics to CLUSTER_METRICS_DIR; /api/metrics and /metrics on any worker
+serve the merged, cluster-wide view (?scope=worker for one process).
+
+POSIX only (os.fork). Run with:
+    python cluster.py --workers 4 --port 5000
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from config import Config
+from metrics import MetricsTracker
+
+# A worker that exits sooner than this after starting is restarted with a delay
+MIN_WORKER_LIFETIME_SECONDS = 1.0
+
+
+class MetricsPublisher:
+    """
+    Periodically writes one process's metrics state to a shared directory
+
+    The file is <directory>/worker-<pid>.json, replaced atomically, so
+    readers never see a partial write. start() is a no-op when this process
+    already runs the publishing thread; after a fork the child starts its own.
+    """
+
+    def __init__(self, tracker, directory, interval_seconds=5.0):
+        self.tracker = tracker
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"worker-{os.getpid()}.json")
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="metrics-publisher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.publish()
+            except OSError as e:
+                print(f"[WARN] Could not publish metrics to {self.directory}: {e}")
+
+    def publish(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".worker-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.tracker.export_state(), f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def load_published_states(directory, exclude_pid=None):
+    """export_state() of every worker that has published to directory"""
+    states = []
+    for path in glob.glob(os.path.join(directory, "worker-*.json")):
+        if exclude_pid is not None and path.endswith(f"worker-{exclude_pid}.json"):
+            continue
+        try:
+            with open(path) as f:
+                states.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Removed meanwhile
+    return states
+
+
+def merged_metrics(tracker, directory):
+    """
+    (tracker, processes): this process's live metrics plus the other
+    workers' last published ones, merged into a new MetricsTracker
+
+    Workers that exited keep contributing their final state, so counters
+    stay cumulative for the life of the cluster.
+    """
+    states = load_published_states(directory, exclude_pid=os.getpid())
+    return MetricsTracker.merged([tracker.export_state()] + states), len(states) + 1
+
+
+def configure_cluster(workers):
+    """
+    Config overrides for running several worker processes; call before
+    importing app. Returns the metrics directory if it was created here.
+    """
+    if workers > 1 and Config.SESSION_BACKEND == "memory":
+        print("[WARN] SESSION_BACKEND=memory can't be shared by workers; using sqlite")
+        Config.SESSION_BACKEND = "sqlite"
+    # Provider quotas are per process: split them so the cluster stays within them
+    if Config.LLM_RPM_LIMIT:
+        Config.LLM_RPM_LIMIT = max(1, math.floor(Config.LLM_RPM_LIMIT / workers))
+    if Config.LLM_TPM_LIMIT:
+        Config.LLM_TPM_LIMIT = max(1, math.floor(Config.LLM_TPM_LIMIT / workers))
+
+    created = None
+    if not Config.CLUSTER_METRICS_DIR:
+        Config.CLUSTER_METRICS_DIR = created = tempfile.mkdtemp(prefix="support-metrics-")
+    os.makedirs(Config.CLUSTER_METRICS_DIR, exist_ok=True)
+    for stale in glob.glob(os.path.join(Config.CLUSTER_METRICS_DIR, "worker-*.json")):
+        os.unlink(stale)  # Left by a previous run
+    return created
+
+
+def run_worker(app_module, sock, host, port):
+    """Serve app_module.app from the inherited socket until SIGTERM (runs in the child)"""
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    random.seed()  # Otherwise every worker draws the same audit samples and backoff jitter
+    if Config.PROFILER_ENABLED:
+        app_module.profiler.start(Config.PROFILER_INTERVAL_MS)  # Threads don't survive fork
+
+    server = make_server(host, port, app_module.app, threaded=True, fd=sock.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        if app_module.transcript_log is not None:
+            app_module.transcript_log.close()  # os._exit() skips atexit
+        if app_module.metrics_publisher is not None:
+            app_module.metrics_publisher.publish()  # Final counts outlive the worker
+
+
+def serve(host, port, workers):
+    """Master process: build once, fork workers, restart them until SIGTERM/SIGINT; returns the exit code"""
+    temp_metrics_dir = configure_cluster(workers)
+    try:
+        return _serve(host, port, workers)
+    finally:
+        if temp_metrics_dir:
+            shutil.rmtree(temp_metrics_dir, ignore_errors=True)
+
+
+def _serve(host, port, workers):
+    import app as app_module
+
+    try:
+        app_module.create_app(background=False)
+    except Exception:
+        return 1  # Reported by the startup tracker
+    app_module.session_store.close()  # Workers open their own connections
+
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    print(f"[OK] Serving on http://{host}:{port} with {workers} workers "
+          f"(metrics in {Config.CLUSTER_METRICS_DIR})")
+
+    children = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                run_worker(app_module, sock, host, port)
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException as e:
+                print(f"[ERROR] Worker {os.getpid()} crashed: {e}")
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        print(f"[WARN] Worker {pid} exited (status {status}); restarting")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME_SECONDS:
+            time.sleep(MIN_WORKER_LIFETIME_SECONDS)  # Don't spin on a worker that can't start
+        if not stopping:
+            spawn()
+    sock.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork multi-process server for app.py")
+    parser.add_argument("--workers", type=int, default=Config.CLUSTER_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        parser.error("cluster.py needs os.fork (POSIX); use a single process or another server")
+    sys.exit(serve(args.host, args.port, max(1, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,39 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
     OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "1000"))
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # e.g. a local stub server
+    
+    # Async Serving Configuration (asgi.py)
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))  # Outstanding LLM calls per process
+    LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+    
+    # Prompt Assembly (see prompt_builder.py)
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # Input tokens; keep under the model context minus OPENAI_MAX_TOKENS
+    PROMPT_KB_SNIPPET_TOKENS = int(os.getenv("PROMPT_KB_SNIPPET_TOKENS", "300"))  # Cap per KB article
+    PROMPT_HISTORY_MESSAGES = int(os.getenv("PROMPT_HISTORY_MESSAGES", "4"))
+    
+    # Micro-batching: gather concurrent LLM calls and send them as one burst (see micro_batch.py)
+    LLM_BATCH_ENABLED = os.getenv("LLM_BATCH_ENABLED", "False").lower() == "true"
+    LLM_BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "16"))
+    LLM_BATCH_MAX_DELAY_MS = float(os.getenv("LLM_BATCH_MAX_DELAY_MS", "10"))  # Most queueing a request can add
+    
+    # Request Coalescing: identical concurrent LLM calls share one request
+    COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "first_turn").lower()  # off | first_turn | all
+    
+    # LLM Gateway: client-side quotas, retries and circuit breaker (see llm_gateway.py)
+    LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))  # Requests per minute per process (0 = unlimited)
+    LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))  # Tokens per minute per process (0 = unlimited)
+    LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "5"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))  # On 429/5xx/timeouts
+    LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+    LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))  # Longer retry-after = give up
+    LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+    LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+    
+    # LLM Output Handling
+    LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "auto").lower()  # auto (by model name) | true | false
+    JSON_ENCODER = os.getenv("JSON_ENCODER", "auto").lower()  # auto (orjson if installed) | orjson | json
+    ESCALATION_HISTORY_MODE = os.getenv("ESCALATION_HISTORY_MODE", "inline").lower()  # inline | reference
     
     # Flask Configuration
     FLASK_ENV = os.getenv("FLASK_ENV", "development")
@@ -19,8 +52,82 @@ class Config:
     # Agent Configuration
     PERSONA_CONFIDENCE_THRESHOLD = 0.8  # Cache persona if confidence > 80%
     ESCALATION_MESSAGE_THRESHOLD = 5
+    ESCALATION_KEYWORDS = [
+        "speak to manager", "lawyer", "sue", "terrible service",
+        "cancel account", "refund now", "waste of time", "useless"
+    ]  # Matched on word boundaries
+    ESCALATION_KEYWORDS_FILE = os.getenv("ESCALATION_KEYWORDS_FILE")  # Extra phrases, one per line
     SENTIMENT_DEGRADATION_THRESHOLD = 2  # Escalate if sentiment drops 2 times
     
+    # Local Persona Classifier (fast path; see persona_classifier.py)
+    PERSONA_CLASSIFIER_PATH = os.getenv(
+        "PERSONA_CLASSIFIER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "persona_classifier.joblib")
+    )  # Used when the file exists
+    PERSONA_CLASSIFIER_THRESHOLD = float(os.getenv("PERSONA_CLASSIFIER_THRESHOLD", "0.85"))
+    PERSONA_CLASSIFIER_AUDIT_RATE = float(os.getenv("PERSONA_CLASSIFIER_AUDIT_RATE", "0.05"))  # Confident turns sent to the full prompt anyway
+    PERSONA_FAST_PATH_MODEL = os.getenv("PERSONA_FAST_PATH_MODEL") or OPENAI_MODEL
+    PERSONA_LABEL_LOG = os.getenv("PERSONA_LABEL_LOG")  # JSONL of LLM labels for training (unset = off)
+    
+    # Knowledge Base Configuration
+    KB_PATH = os.getenv(
+        "KB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base.json")
+    )  # JSON file or directory of JSON files
+    KB_REFIT_DRIFT_THRESHOLD = float(os.getenv("KB_REFIT_DRIFT_THRESHOLD", "0.2"))
+    KB_INDEX_DIR = os.getenv(
+        "KB_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kb_index")
+    )  # Persisted, memory-mapped indexes keyed by KB content hash ("" disables)
+    # Per-session decayed TF-IDF context vector for retrieval (False = query + last 2 user messages)
+    KB_SESSION_CONTEXT = os.getenv("KB_SESSION_CONTEXT", "True").lower() == "true"
+    KB_CONTEXT_DECAY = float(os.getenv("KB_CONTEXT_DECAY", "0.5"))  # Weight kept by each earlier message per turn
+    KB_CONTEXT_WEIGHT = float(os.getenv("KB_CONTEXT_WEIGHT", "0.5"))  # Context vs the current message (1.0)
+    KB_CONTEXT_MAX_TERMS = int(os.getenv("KB_CONTEXT_MAX_TERMS", "32"))  # Terms stored per session
+    # Dense retrieval tier: LSA embeddings of article sections in an IVF index,
+    # fused with the TF-IDF scores (built at startup and persisted with the index)
+    KB_DENSE_ENABLED = os.getenv("KB_DENSE_ENABLED", "False").lower() == "true"
+    KB_DENSE_DIM = int(os.getenv("KB_DENSE_DIM", "128"))  # Embedding dimensions
+    KB_DENSE_WEIGHT = float(os.getenv("KB_DENSE_WEIGHT", "0.5"))  # Dense share of the fused score
+    KB_DENSE_N_PROBE = int(os.getenv("KB_DENSE_N_PROBE", "16"))  # IVF lists searched per query
+    KB_CHUNK_WORDS = int(os.getenv("KB_CHUNK_WORDS", "120"))  # Words per article section
+    
+    # Startup: build the agent (LLM client, KB index) on a background thread so
+    # health checks are answered at once; /api/health/ready reports when it's done
+    STARTUP_BACKGROUND = os.getenv("STARTUP_BACKGROUND", "True").lower() == "true"
+    
+    # Multi-process serving (cluster.py)
+    CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0"))  # 0 = one per CPU
+    CLUSTER_METRICS_DIR = os.getenv("CLUSTER_METRICS_DIR", "")  # Where workers publish metrics to merge ("" = single process)
+    CLUSTER_METRICS_INTERVAL_SECONDS = float(os.getenv("CLUSTER_METRICS_INTERVAL_SECONDS", "5"))
+    
+    # Write-behind transcript log: every finished turn, written in bulk by a
+    # background thread to append-only segment files ("" disables)
+    TRANSCRIPT_LOG_DIR = os.getenv("TRANSCRIPT_LOG_DIR", "")
+    TRANSCRIPT_QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", "10000"))  # Turns buffered; more are dropped
+    TRANSCRIPT_FLUSH_INTERVAL_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL_SECONDS", "1"))
+    TRANSCRIPT_SEGMENT_MAX_MB = int(os.getenv("TRANSCRIPT_SEGMENT_MAX_MB", "64"))  # Start a new segment past this
+    TRANSCRIPT_FSYNC = os.getenv("TRANSCRIPT_FSYNC", "False").lower() == "true"  # fsync after every batch
+    
+    # Profiling Configuration (switchable at runtime via /api/profiler)
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "False").lower() == "true"
+    PROFILER_INTERVAL_MS = int(os.getenv("PROFILER_INTERVAL_MS", "10"))
+    
+    # Session Store Configuration
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" or "sqlite" (shared by workers)
+    SESSION_DB_PATH = os.getenv(
+        "SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db")
+    )
+    SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))  # Idle sessions expire
+    SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+    SESSION_HISTORY_WINDOW = int(os.getenv("SESSION_HISTORY_WINDOW", "4"))  # Messages kept (min 4)
+    SESSION_SENTIMENT_WINDOW = int(os.getenv("SESSION_SENTIMENT_WINDOW", "10"))
+
+    # Response Cache Configuration
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "True").lower() == "true"
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    # Reuse answers for near-identical messages above this TF-IDF cosine (unset = exact only)
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD") or 0) or None
+    
     # Validate required configuration
     @classmethod
     def validate(cls):
@@ -0,0 +1,320 @@
+"""
+Dense retrieval tier: LSA embeddings of article sections in an IVF index
+
+Articles are cut into sections (chunk_spans) so a long document can match on
+any part of it. Each section is embedded locally with LSA (sublinear TF-IDF
+projected by a truncated SVD fitted on the KB), so no model download or
+network call is involved. Embeddings go into an inverted-file index: a
+spherical k-means coarse quantizer whose lists are stored contiguously, so a
+search scores the centroids, then only the n_probe closest lists.
+
+Everything is plain numpy arrays, saved with np.save and memory-mapped on
+load like the TF-IDF index.
+"""
+import bisect
+import json
+import os
+import re
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_WORD = re.compile(r"\S+")
+
+# Below this many sections, search is exhaustive (a single list)
+MIN_SECTIONS_FOR_IVF = 1024
+# k-means is trained on at most this many points per list
+TRAIN_POINTS_PER_LIST = 64
+# Rows scored per block when assigning vectors to lists
+ASSIGN_BLOCK_ROWS = 4096
+
+
+def chunk_spans(text, max_words=120, overlap=20):
+    """
+    Character spans (start, end) of text's sections
+
+    Paragraphs are packed together up to max_words; a paragraph longer than
+    that is split into windows of max_words that share overlap words. A text
+    of at most max_words is one span.
+    """
+    words = [m.span() for m in _WORD.finditer(text)]
+    if len(words) <= max_words:
+        return [(0, len(text))]
+
+    word_starts = [start for start, _ in words]
+    breaks = [bisect.bisect_left(word_starts, m.end()) for m in _PARAGRAPH_BREAK.finditer(text)]
+    bounds = sorted(set([0, *breaks, len(words)]))
+    step = max(1, max_words - overlap)
+
+    spans, start = [], 0  # word indices; the open section is [start, paragraph start)
+    for para_start, para_end in zip(bounds, bounds[1:]):
+        if para_end - start <= max_words:
+            continue
+        if para_start > start:
+            spans.append((start, para_start))
+            start = para_start
+        while para_end - start > max_words:
+            spans.append((start, start + max_words))
+            start += step
+    spans.append((start, len(words)))
+    return [(words[first][0], words[last - 1][1]) for first, last in spans]
+
+
+def section_text(article, span):
+    """Text the section is embedded from: title, section and keywords"""
+    start, end = span
+    return f"{article['title']} {article['content'][start:end]} {' '.join(article.get('keywords', []))}"
+
+
+class LSAEncoder:
+    """Sublinear TF-IDF projected onto the top singular vectors of the KB"""
+
+    def __init__(self, vectorizer, projection):
+        self.vectorizer = vectorizer
+        self.projection = projection  # (features x dim) float32
+        self._analyzer = vectorizer.build_analyzer()
+        self._vocabulary = vectorizer.vocabulary_ if hasattr(vectorizer, "vocabulary_") else vectorizer.vocabulary
+
+    @property
+    def dim(self):
+        return self.projection.shape[1]
+
+    @classmethod
+    def fit(cls, documents, dim=128, max_features=50000, seed=0):
+        """None when the corpus is too small for even one component"""
+        vectorizer = _new_vectorizer(max_features)
+        matrix = vectorizer.fit_transform(documents)
+        dim = min(dim, matrix.shape[0] - 1, matrix.shape[1] - 1)
+        if dim < 1:
+            return None
+        svd = TruncatedSVD(n_components=dim, random_state=seed).fit(matrix)
+        return cls(vectorizer, np.ascontiguousarray(svd.components_.T, dtype=np.float32))
+
+    def encode(self, texts):
+        """(len(texts) x dim) L2-normalized embeddings"""
+        return _normalize_rows(np.asarray(self.vectorizer.transform(texts) @ self.projection, dtype=np.float32))
+
+    def encode_one(self, text):
+        """
+        encode([text])[0] without sklearn's per-call overhead
+
+        The TF-IDF row is not L2-normalized first: the embedding is
+        normalized at the end, which gives the same direction.
+        """
+        counts = {}
+        for term in self._analyzer(text):
+            col = self._vocabulary.get(term)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        if not counts:
+            return np.zeros(self.dim, dtype=np.float32)
+        cols = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts))))
+        weights *= self.vectorizer.idf_[cols]
+        vector = (weights @ self.projection[cols]).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def _new_vectorizer(max_features, vocabulary=None):
+    return TfidfVectorizer(
+        stop_words="english",
+        sublinear_tf=True,  # Long sections shouldn't be dominated by repeated words
+        max_features=max_features,
+        vocabulary=vocabulary,
+        dtype=np.float32
+    )
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _nearest_list(vectors, centroids):
+    """Index of the most similar centroid for every row"""
+    return np.concatenate([
+        np.argmax(vectors[start:start + ASSIGN_BLOCK_ROWS] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS)
+    ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+def train_centroids(vectors, n_lists, iterations=10, seed=0):
+    """Spherical k-means over (a sample of) unit vectors; returns (n_lists x dim) unit centroids"""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > n_lists * TRAIN_POINTS_PER_LIST:
+        sample = vectors[np.sort(rng.choice(len(vectors), n_lists * TRAIN_POINTS_PER_LIST, replace=False))]
+    centroids = np.array(sample[rng.choice(len(sample), n_lists, replace=False)])
+    for _ in range(iterations):
+        assign = _nearest_list(sample, centroids)
+        # Sum each list's members with one sparse indicator product
+        members = sp.csr_matrix(
+            (np.ones(len(sample), dtype=np.float32), (assign, np.arange(len(sample)))),
+            shape=(n_lists, len(sample))
+        )
+        sums = np.asarray(members @ sample)
+        empty = np.flatnonzero(np.asarray(members.sum(axis=1)).ravel() == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = _normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+class DenseIndex:
+    """
+    IVF index over the section embeddings of one KB snapshot
+
+    vectors are grouped by list: list l holds rows offsets[l]:offsets[l + 1].
+    section_rows/section_spans map every stored row back to its article row
+    and character span in the article's content.
+    """
+
+    def __init__(self, encoder, centroids, offsets, vectors, section_rows, section_spans):
+        self.encoder = encoder
+        self.centroids = centroids          # (lists x dim) unit vectors
+        self.offsets = offsets              # (lists + 1,) list boundaries in vectors
+        self.vectors = vectors              # (sections x dim) unit vectors, grouped by list
+        self.section_rows = section_rows    # (sections,) article row
+        self.section_spans = section_spans  # (sections x 2) span in the article content
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, articles, dim=128, chunk_words=120, chunk_overlap=20, n_lists=None,
+              max_features=50000, seed=0):
+        """Chunk, embed and index articles; None if the KB is too small to embed"""
+        rows, spans, documents = _sections(articles, range(len(articles)), chunk_words, chunk_overlap)
+        encoder = LSAEncoder.fit(documents, dim, max_features, seed) if documents else None
+        if encoder is None:
+            return None
+        vectors = encoder.encode(documents)
+        if n_lists is None:
+            n_lists = int(round(np.sqrt(len(vectors)))) if len(vectors) >= MIN_SECTIONS_FOR_IVF else 1
+        n_lists = max(1, min(n_lists, len(vectors)))
+        if n_lists == 1:
+            centroids = _normalize_rows(vectors.mean(axis=0, keepdims=True))
+        else:
+            centroids = train_centroids(vectors, n_lists, seed=seed)
+        return cls._grouped(encoder, centroids, vectors, np.array(rows, dtype=np.int64),
+                            np.array(spans, dtype=np.int64).reshape(-1, 2))
+
+    @classmethod
+    def _grouped(cls, encoder, centroids, vectors, rows, spans):
+        """Assign rows to their nearest list and store them grouped by list"""
+        assign = _nearest_list(vectors, centroids) if len(centroids) > 1 else np.zeros(len(vectors), dtype=np.int64)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        return cls(encoder, centroids, offsets, vectors[order], rows[order], spans[order])
+
+    def search(self, query_vector, k=10, n_probe=16):
+        """(section indices, scores) of the approximate top-k sections, best first"""
+        if n_probe >= self.n_lists:
+            candidates = None
+            scores = self.vectors @ query_vector
+        else:
+            lists = np.argpartition(-(self.centroids @ query_vector), n_probe - 1)[:n_probe]
+            candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            scores = self.vectors[candidates] @ query_vector
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return (top if candidates is None else candidates[top]), scores[top]
+
+    def exact_search(self, query_vector, k=10):
+        """Brute-force top-k over every section (the reference for recall)"""
+        return self.search(query_vector, k, n_probe=self.n_lists)
+
+    def article_scores(self, text, n_articles, k=50, n_probe=16):
+        """
+        Dense relevance per article row for a query text
+
+        Returns (scores, best_section): scores is an n_articles array holding,
+        for articles with a section among the top-k, the best section's cosine
+        (floored at 0); best_section maps those rows to that section's index.
+        """
+        scores = np.zeros(n_articles)
+        best_section = {}
+        sections, section_scores = self.search(self.encoder.encode_one(text), k, n_probe)
+        for section, score in zip(sections.tolist(), section_scores.tolist()):
+            row = int(self.section_rows[section])
+            if row not in best_section and score > 0:
+                best_section[row] = section
+                scores[row] = score
+        return scores, best_section
+
+    def splice(self, articles, old_to_new, changed_rows, chunk_words=120, chunk_overlap=20):
+        """
+        Index after a KB edit, keeping the encoder and the lists
+
+        old_to_new maps each current article row to its new row, or -1 when the
+        article was removed or changed. changed_rows are the new rows whose
+        articles (in articles, the new row order) are chunked and embedded again.
+        """
+        new_rows = np.asarray(old_to_new)[self.section_rows]
+        kept = new_rows >= 0
+        rows, spans, documents = _sections(articles, changed_rows, chunk_words, chunk_overlap)
+        vectors = np.concatenate([self.vectors[kept], self.encoder.encode(documents)]) if documents else self.vectors[kept]
+        return self._grouped(
+            self.encoder, self.centroids, vectors,
+            np.concatenate([new_rows[kept], np.array(rows, dtype=np.int64)]),
+            np.concatenate([self.section_spans[kept], np.array(spans, dtype=np.int64).reshape(-1, 2)])
+        )
+
+    def save(self, directory):
+        """Write the index arrays into directory (which must exist)"""
+        arrays = {
+            "projection": self.encoder.projection,
+            "idf": self.encoder.vectorizer.idf_,
+            "centroids": self.centroids,
+            "offsets": self.offsets,
+            "vectors": self.vectors,
+            "section_rows": self.section_rows,
+            "section_spans": self.section_spans,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump({term: int(col) for term, col in self.encoder._vocabulary.items()}, f)
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"max_features": self.encoder.vectorizer.max_features}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Open an index written by save() with memory-mapped arrays"""
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "vocabulary.json"), encoding="utf-8") as f:
+            vocabulary = json.load(f)
+
+        def mapped(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        vectorizer = _new_vectorizer(meta["max_features"], vocabulary=vocabulary)
+        vectorizer.idf_ = np.asarray(mapped("idf"))
+        encoder = LSAEncoder(vectorizer, mapped("projection"))
+        return cls(encoder, np.asarray(mapped("centroids")), np.asarray(mapped("offsets")),
+                   mapped("vectors"), mapped("section_rows"), mapped("section_spans"))
+
+
+def _sections(articles, rows, chunk_words, chunk_overlap):
+    """(article rows, spans, texts) of the sections of articles[row] for each row"""
+    section_rows, spans, documents = [], [], []
+    for row in rows:
+        article = articles[row]
+        for span in chunk_spans(article["content"], chunk_words, chunk_overlap):
+            section_rows.append(row)
+            spans.append(span)
+            documents.append(section_text(article, span))
+    return section_rows, spans, documents
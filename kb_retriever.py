@@ -1,100 +1,918 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from dense_index import DenseIndex
+from phrase_matcher import PhraseMatcher
 import numpy as np
+import scipy.sparse as sp
 
-class SmartKBRetriever:
-    """Enhanced KB retrieval using TF-IDF and cosine similarity"""
-    
-    def __init__(self, knowledge_base):
-        self.knowledge_base = knowledge_base
-        self.vectorizers = {}
-        self.article_vectors = {}
-        self._build_indexes()
-    
-    def _build_indexes(self):
-        """Build TF-IDF indexes for each persona"""
-        for persona, articles in self.knowledge_base.items():
-            if not articles:
+
+def load_knowledge_base(path):
+    """
+    Load the knowledge base from a JSON file or a directory of JSON files
+
+    A file holds {persona: [articles]}. In a directory, each *.json file is
+    either such a mapping or a plain list of articles for the persona named
+    by the file stem (e.g. technical_expert.json).
+    """
+    if os.path.isdir(path):
+        knowledge_base = {}
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".json"):
                 continue
-            
-            # Combine title, content, and keywords for better matching
-            documents = []
-            for article in articles:
-                doc_text = f"{article['title']} {article['content']} {' '.join(article['keywords'])}"
-                documents.append(doc_text)
-            
-            # Create TF-IDF vectorizer
-            vectorizer = TfidfVectorizer(
-                stop_words='english',
-                ngram_range=(1, 2),  # Use unigrams and bigrams
-                max_features=100
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                data = {os.path.splitext(name)[0]: data}
+            for persona, articles in data.items():
+                knowledge_base.setdefault(persona, []).extend(articles)
+        return knowledge_base
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _document_text(article):
+    """Combine title, content, and keywords for better matching"""
+    return f"{article['title']} {article['content']} {' '.join(article['keywords'])}"
+
+
+def select_top_k(scores, top_k, threshold):
+    """
+    Indices of the top_k scores above threshold, best first
+
+    Filters with one vectorized comparison, then uses an O(n) argpartition so
+    only the k survivors are sorted. Ties break toward the lower index.
+    """
+    candidates = np.flatnonzero(scores > threshold)
+    if len(candidates) > top_k:
+        if top_k <= 0:
+            return candidates[:0]
+        candidate_scores = scores[candidates]
+        kth = candidate_scores[np.argpartition(-candidate_scores, top_k - 1)[top_k - 1]]
+        # Everything above the k-th score, then the lowest-index ties to fill up
+        above = candidates[candidate_scores > kth]
+        ties = candidates[candidate_scores == kth][:top_k - len(above)]
+        candidates = np.concatenate((above, ties))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def select_top_k_rows(scores, top_k, threshold):
+    """
+    Row-wise select_top_k over a (queries x articles) score matrix
+
+    Same result and tie-breaking as calling select_top_k on every row, but done
+    with whole-matrix partition/mask operations instead of a per-row loop.
+
+    Returns:
+        List with one index array per row, best first
+    """
+    n_rows, n_cols = scores.shape
+    valid = scores > threshold
+    if n_rows == 0:
+        return []
+    if top_k <= 0 or n_cols == 0:
+        return [np.empty(0, dtype=np.int64) for _ in range(n_rows)]
+
+    if n_cols > top_k:
+        masked = np.where(valid, scores, -np.inf)
+        kth = -np.partition(-masked, top_k - 1, axis=1)[:, top_k - 1:top_k]
+        above = masked > kth
+        ties = masked == kth
+        # Keep the lowest-index ties needed to fill each row up to top_k
+        need = top_k - above.sum(axis=1, keepdims=True)
+        selected = valid & (above | (ties & (np.cumsum(ties, axis=1) <= need)))
+    else:
+        selected = valid
+
+    rows, cols = np.nonzero(selected)
+    order = np.lexsort((cols, -scores[rows, cols], rows))
+    rows, cols = rows[order], cols[order]
+    return np.split(cols, np.searchsorted(rows, np.arange(1, n_rows)))
+
+
+class ScoredArticle(Mapping):
+    """
+    Read-only view of a KB article plus its relevance_score (no dict copy)
+
+    section, when set, is the part of the content that matched best (dense
+    retrieval over a long, chunked article) and is exposed as a key too.
+    """
+
+    __slots__ = ("article", "relevance_score", "section")
+
+    def __init__(self, article, relevance_score, section=None):
+        self.article = article
+        self.relevance_score = relevance_score
+        self.section = section
+
+    def _extra_keys(self):
+        keys = ("relevance_score", "section") if self.section is not None else ("relevance_score",)
+        return [key for key in keys if key not in self.article]
+
+    def __getitem__(self, key):
+        if key == "relevance_score":
+            return self.relevance_score
+        if key == "section" and self.section is not None:
+            return self.section
+        return self.article[key]
+
+    def __iter__(self):
+        yield from self.article
+        yield from self._extra_keys()
+
+    def __len__(self):
+        return len(self.article) + len(self._extra_keys())
+
+    def __repr__(self):
+        return f"ScoredArticle(id={self.article.get('id')!r}, relevance_score={self.relevance_score:.3f})"
+
+    def copy(self):
+        return dict(self)
+
+
+_vocabulary_versions = itertools.count(1)
+
+# L2-normalized TF-IDF query vector plus the vocabulary version it was built with;
+# context_update is set when scoring used a session context (see advance_context)
+QueryVector = namedtuple("QueryVector", ["vector", "vocabulary_version", "context_update"], defaults=(None,))
+
+# The current message's dense TF-IDF row, to add to the session context once the
+# turn commits; base is the context rebuilt from history when the stored one was unusable
+ContextUpdate = namedtuple("ContextUpdate", ["vocabulary_id", "message_vector", "base"])
+
+
+def _csr_row(vector):
+    """1 x n CSR matrix of a dense row (the response cache keeps query vectors sparse)"""
+    cols = np.flatnonzero(vector)
+    return sp.csr_matrix((vector[cols], cols, np.array([0, len(cols)])), shape=(1, len(vector)))
+
+
+class _KBIndex:
+    """Immutable snapshot of the KB and its TF-IDF index"""
+
+    def __init__(self, vectorizer, article_matrix, articles, article_personas,
+                 fit_terms, drift_terms=0, vocabulary_version=None, dense=None):
+        self.vectorizer = vectorizer
+        # Query vectors are only comparable within one vocabulary version;
+        # delta updates keep it, refits get a new one
+        self.vocabulary_version = vocabulary_version or next(_vocabulary_versions)
+        self.article_matrix = article_matrix  # rows are L2-normalized TF-IDF vectors
+        self.articles = articles              # row i -> article i
+        self.article_personas = article_personas  # row i -> persona label
+        self.fit_terms = fit_terms            # analyzed terms in the corpus at fit time
+        self.drift_terms = drift_terms        # terms the vocabulary has missed since
+        self.dense = dense                    # DenseIndex over article sections, if enabled
+        self._keyword_matcher = None
+        self._vocabulary_id = None
+        self._analyzer = None
+
+        self.id_to_row = {article["id"]: row for row, article in enumerate(articles)}
+        self.knowledge_base = {}
+        rows_by_persona = {}
+        for row, (persona, article) in enumerate(zip(article_personas, articles)):
+            self.knowledge_base.setdefault(persona, []).append(article)
+            rows_by_persona.setdefault(persona, []).append(row)
+        self.persona_rows = {
+            persona: np.array(rows, dtype=np.int64)
+            for persona, rows in rows_by_persona.items()
+        }
+
+    @property
+    def drift(self):
+        return self.drift_terms / self.fit_terms if self.fit_terms else 1.0
+
+    @property
+    def vocabulary_id(self):
+        """
+        Fingerprint of the vocabulary, stable across processes and restarts
+
+        Session context vectors are stored with it (vocabulary_version is a
+        per-process counter), so column indices are never read against a
+        different vocabulary.
+        """
+        if self._vocabulary_id is None:
+            self._vocabulary_id = hashlib.sha1(
+                json.dumps(sorted((term, int(col)) for term, col in self.vocabulary.items())).encode()
+            ).hexdigest()[:16]
+        return self._vocabulary_id
+
+    @property
+    def vocabulary(self):
+        return getattr(self.vectorizer, "vocabulary_", None) or self.vectorizer.vocabulary or {}
+
+    def dense_vector(self, text):
+        """
+        vectorizer.transform([text]) as a dense 1-D row
+
+        Same tokens, idf weighting and L2 norm, without sklearn's per-call
+        validation and sparse assembly, which dominate for one short message.
+        """
+        if self._analyzer is None:
+            self._analyzer = self.vectorizer.build_analyzer()
+        vocabulary = self.vocabulary
+        vector = np.zeros(len(self.vectorizer.idf_))
+        for term in self._analyzer(text):
+            col = vocabulary.get(term)
+            if col is not None:
+                vector[col] += 1
+        vector *= self.vectorizer.idf_
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @property
+    def keyword_matcher(self):
+        """Article keywords -> row, compiled on first use for this snapshot"""
+        if self._keyword_matcher is None:
+            self._keyword_matcher = PhraseMatcher(
+                (keyword, row)
+                for row, article in enumerate(self.articles)
+                for keyword in article.get("keywords", [])
             )
-            
-            # Fit and transform documents
-            vectors = vectorizer.fit_transform(documents)
-            
-            self.vectorizers[persona] = vectorizer
-            self.article_vectors[persona] = vectors
-    
-    def retrieve(self, persona, query, conversation_history=None, top_k=3):
-        """
-        Retrieve relevant KB articles using TF-IDF similarity
-        
+        return self._keyword_matcher
+
+
+# Bump when the on-disk layout or the vectorizer settings change
+INDEX_FORMAT_VERSION = 1
+
+
+def kb_content_hash(articles, personas, max_features_per_persona, dense_settings=None):
+    """Version key for a persisted index: KB content plus index settings"""
+    digest = hashlib.sha256()
+    digest.update(f"v{INDEX_FORMAT_VERSION}:{max_features_per_persona}".encode())
+    if dense_settings:
+        digest.update(json.dumps(dense_settings, sort_keys=True).encode())
+    for persona, article in zip(personas, articles):
+        digest.update(json.dumps([persona, article], sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def save_index(index, directory):
+    """
+    Persist an index as raw CSR arrays plus vocabulary/IDF, and the dense
+    index (if any) in a dense/ subdirectory
+
+    Written to a temp directory and renamed into place, so readers never see a
+    partial index and concurrent writers of the same version are harmless.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        matrix = index.article_matrix
+        np.save(os.path.join(tmp_dir, "data.npy"), matrix.data)
+        np.save(os.path.join(tmp_dir, "indices.npy"), matrix.indices)
+        np.save(os.path.join(tmp_dir, "indptr.npy"), matrix.indptr)
+        np.save(os.path.join(tmp_dir, "idf.npy"), index.vectorizer.idf_)
+        with open(os.path.join(tmp_dir, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump({term: int(col) for term, col in index.vectorizer.vocabulary_.items()}, f)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INDEX_FORMAT_VERSION,
+                "shape": list(matrix.shape),
+                "max_features": index.vectorizer.max_features,
+                "fit_terms": index.fit_terms,
+                "drift_terms": index.drift_terms,
+            }, f)
+        if index.dense is not None:
+            os.mkdir(os.path.join(tmp_dir, "dense"))
+            index.dense.save(os.path.join(tmp_dir, "dense"))
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Another worker won the race; its copy is identical
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+
+def load_index(directory, articles, personas, dense=False):
+    """Open a persisted index with memory-mapped, read-only CSR arrays (and dense index)"""
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["version"] != INDEX_FORMAT_VERSION or meta["shape"][0] != len(articles):
+        raise ValueError(f"Incompatible KB index at {directory}")
+    with open(os.path.join(directory, "vocabulary.json"), encoding="utf-8") as f:
+        vocabulary = json.load(f)
+
+    def mapped(name):
+        return np.load(os.path.join(directory, name), mmap_mode="r")
+
+    article_matrix = sp.csr_matrix(
+        (mapped("data.npy"), mapped("indices.npy"), mapped("indptr.npy")),
+        shape=tuple(meta["shape"]),
+        copy=False
+    )
+    vectorizer = _new_vectorizer(meta["max_features"], vocabulary=vocabulary)
+    vectorizer.idf_ = np.asarray(mapped("idf.npy"))
+    dense_dir = os.path.join(directory, "dense")
+    # A dense-enabled KB too small to embed was saved without one
+    dense_index = DenseIndex.load(dense_dir) if dense and os.path.isdir(dense_dir) else None
+    return _KBIndex(vectorizer, article_matrix, articles, personas,
+                    meta["fit_terms"], meta["drift_terms"], dense=dense_index)
+
+
+def _new_vectorizer(max_features, vocabulary=None):
+    """TF-IDF vectorizer used for the KB (rows come out L2-normalized)"""
+    return TfidfVectorizer(
+        stop_words='english',
+        ngram_range=(1, 2),  # Use unigrams and bigrams
+        max_features=max_features,
+        vocabulary=vocabulary
+    )
+
+
+class SmartKBRetriever:
+    """Enhanced KB retrieval using a single TF-IDF index across all personas"""
+
+    # Vocabulary budget per persona (the global index scales with the KB)
+    MAX_FEATURES_PER_PERSONA = 100
+    RELEVANCE_THRESHOLD = 0.1
+    # Refit vocabulary/IDF once unseen terms reach this share of the fitted corpus
+    REFIT_DRIFT_THRESHOLD = 0.2
+    # Max dense score cells (articles x queries) per retrieve_many chunk
+    BATCH_SCORE_CELLS = 1 << 22
+    # Session context vector: earlier user messages count CONTEXT_DECAY times
+    # less per turn; the context is blended in at CONTEXT_WEIGHT of the current
+    # message and keeps its CONTEXT_MAX_TERMS heaviest terms
+    CONTEXT_DECAY = 0.5
+    CONTEXT_WEIGHT = 0.5
+    CONTEXT_MAX_TERMS = 32
+    # Optional dense tier (dense=True): articles are cut into sections of about
+    # CHUNK_WORDS words, embedded with DENSE_DIM-dimensional LSA and searched
+    # through an IVF index probing DENSE_N_PROBE lists for DENSE_CANDIDATES
+    # sections. An article's score is (1 - DENSE_WEIGHT) x TF-IDF cosine +
+    # DENSE_WEIGHT x its best section's cosine.
+    DENSE_DIM = 128
+    DENSE_WEIGHT = 0.5
+    DENSE_N_PROBE = 16
+    DENSE_CANDIDATES = 50
+    CHUNK_WORDS = 120
+    CHUNK_OVERLAP = 20
+
+    def __init__(self, knowledge_base, refit_drift_threshold=None, index_dir=None,
+                 context_decay=None, context_weight=None, context_max_terms=None,
+                 dense=False, dense_dim=None, dense_weight=None, dense_n_probe=None,
+                 chunk_words=None):
+        """
         Args:
-            persona: Customer persona type
-            query: Current user query
-            conversation_history: Previous conversation for context
-            top_k: Number of articles to return
+            knowledge_base: {persona: [articles]}
+            refit_drift_threshold: overrides REFIT_DRIFT_THRESHOLD
+            index_dir: directory for persisted indexes; when set, an index
+                matching the KB content hash is memory-mapped instead of rebuilt
+            context_decay / context_weight / context_max_terms: override the
+                CONTEXT_* session context settings
+            dense: also build the dense section index and fuse its scores
+            dense_dim / dense_weight / dense_n_probe / chunk_words: override
+                the DENSE_* and CHUNK_WORDS settings
         """
-        if persona not in self.vectorizers:
-            return []
-        
-        # Enhance query with conversation context
-        enhanced_query = query
+        if refit_drift_threshold is not None:
+            self.REFIT_DRIFT_THRESHOLD = refit_drift_threshold
+        if context_decay is not None:
+            self.CONTEXT_DECAY = context_decay
+        if context_weight is not None:
+            self.CONTEXT_WEIGHT = context_weight
+        if context_max_terms is not None:
+            self.CONTEXT_MAX_TERMS = context_max_terms
+        if dense_dim is not None:
+            self.DENSE_DIM = dense_dim
+        if dense_weight is not None:
+            self.DENSE_WEIGHT = dense_weight
+        if dense_n_probe is not None:
+            self.DENSE_N_PROBE = dense_n_probe
+        if chunk_words is not None:
+            self.CHUNK_WORDS = chunk_words
+            self.CHUNK_OVERLAP = min(self.CHUNK_OVERLAP, chunk_words // 4)
+        self.dense = dense
+        self.index_dir = index_dir
+        self.index_loaded_from_disk = False
+        self._write_lock = threading.Lock()
+        articles, personas = self._flatten(knowledge_base)
+        self._index = self._open_or_fit(articles, personas)
+
+    # Readers take one reference to the current snapshot; writers build a new
+    # snapshot and swap it in with a single assignment.
+    @property
+    def knowledge_base(self):
+        return self._index.knowledge_base
+
+    @property
+    def vectorizer(self):
+        return self._index.vectorizer
+
+    @property
+    def article_matrix(self):
+        return self._index.article_matrix
+
+    @staticmethod
+    def _flatten(knowledge_base):
+        articles, personas = [], []
+        for persona, persona_articles in knowledge_base.items():
+            for article in persona_articles:
+                articles.append(article)
+                personas.append(persona)
+        return articles, personas
+
+    @property
+    def dense_settings(self):
+        """Settings the dense index is built with (part of the persisted index key)"""
+        if not self.dense:
+            return None
+        return {"dim": self.DENSE_DIM, "chunk_words": self.CHUNK_WORDS, "chunk_overlap": self.CHUNK_OVERLAP}
+
+    def _index_path(self, articles, personas):
+        content_hash = kb_content_hash(articles, personas, self.MAX_FEATURES_PER_PERSONA, self.dense_settings)
+        return os.path.join(self.index_dir, content_hash)
+
+    def _open_or_fit(self, articles, personas):
+        """Memory-map the persisted index for this KB version, building it if missing"""
+        if not self.index_dir or not articles:
+            return self._fit(articles, personas)
+
+        path = self._index_path(articles, personas)
+        if os.path.isdir(path):
+            try:
+                index = load_index(path, articles, personas, dense=self.dense)
+                self.index_loaded_from_disk = True
+                return index
+            except (OSError, ValueError, KeyError):
+                pass  # Corrupt or incompatible - rebuild below
+
+        index = self._fit(articles, personas)
+        self._persist(index)
+        return index
+
+    def _persist(self, index):
+        if not self.index_dir or index.vectorizer is None:
+            return
+        path = self._index_path(index.articles, index.article_personas)
+        if not os.path.isdir(path):
+            try:
+                save_index(index, path)
+            except OSError as e:
+                # The in-memory index is still valid; the next boot just rebuilds
+                print(f"[WARN] Could not persist KB index to {path}: {e}")
+
+    def _fit(self, articles, personas):
+        """Build one global TF-IDF index with a persona label per article"""
+        if not articles:
+            return _KBIndex(None, None, [], [], 0)
+
+        vectorizer = _new_vectorizer(self.MAX_FEATURES_PER_PERSONA * len(set(personas)))
+
+        # Fit and transform documents
+        documents = [_document_text(article) for article in articles]
+        article_matrix = vectorizer.fit_transform(documents).tocsr()
+
+        analyzer = vectorizer.build_analyzer()
+        fit_terms = sum(len(analyzer(doc)) for doc in documents)
+        dense = None
+        if self.dense:
+            dense = DenseIndex.build(articles, self.DENSE_DIM, self.CHUNK_WORDS, self.CHUNK_OVERLAP)
+        return _KBIndex(vectorizer, article_matrix, articles, personas, fit_terms, dense=dense)
+
+    def _build_query(self, query, conversation_history):
+        """Enhance query with conversation context"""
         if conversation_history and len(conversation_history) > 0:
             # Add last 2 user messages for context
             recent_messages = [
                 msg['content'] for msg in conversation_history[-4:]
                 if msg['role'] == 'user'
             ][-2:]
-            enhanced_query = f"{query} {' '.join(recent_messages)}"
-        
-        # Transform query to vector
-        vectorizer = self.vectorizers[persona]
-        query_vector = vectorizer.transform([enhanced_query])
-        
-        # Calculate cosine similarity with all articles
-        similarities = cosine_similarity(
-            query_vector,
-            self.article_vectors[persona]
-        ).flatten()
-        
-        # Get top-k articles
-        articles = self.knowledge_base[persona]
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        
-        # Filter out articles with very low similarity (< 0.1)
+            return f"{query} {' '.join(recent_messages)}"
+        return query
+
+    def _score(self, index, query, conversation_history, session_context=None):
+        """
+        Cosine similarity of the query against every article in one sparse product
+
+        Without session_context the query text is extended with recent user
+        messages (_build_query). With it, only the current message is
+        vectorized and blended with the session's decayed context vector.
+        With the dense tier, its section scores are fused in (_fuse_dense).
+
+        Returns:
+            (similarities, query_vector, context_update or None,
+             {row: best section} or None)
+        """
+        if session_context is None:
+            text = self._build_query(query, conversation_history)
+            query_vector = index.vectorizer.transform([text])
+            # Rows and query are already L2-normalized, so a CSR mat-vec against the
+            # dense query gives cosine similarity without re-normalizing anything
+            similarities, sections = self._fuse_dense(
+                index, index.article_matrix @ query_vector.toarray().ravel(), text
+            )
+            return similarities, query_vector, None, sections
+
+        # The vocabulary is small, so the context math is done on dense rows
+        message = index.dense_vector(query)
+        context = self._context_vector(session_context, index.vocabulary_id, len(message))
+        rebuilt = None
+        if context is None:
+            context = rebuilt = self._context_from_history(index, conversation_history)
+        blended = self._blend(message, context)
+        context_update = ContextUpdate(index.vocabulary_id, message, rebuilt)
+        similarities, sections = self._fuse_dense(index, index.article_matrix @ blended, query)
+        return similarities, _csr_row(blended), context_update, sections
+
+    def _fuse_dense(self, index, similarities, text):
+        """
+        (1 - DENSE_WEIGHT) x TF-IDF + DENSE_WEIGHT x dense section scores
+
+        Returns the fused similarities and {article row: best section index}
+        for the articles the dense search found, or the inputs unchanged
+        without a dense index.
+        """
+        if index.dense is None:
+            return similarities, None
+        dense_scores, sections = index.dense.article_scores(
+            text, len(similarities), self.DENSE_CANDIDATES, self.DENSE_N_PROBE
+        )
+        return (1 - self.DENSE_WEIGHT) * similarities + self.DENSE_WEIGHT * dense_scores, sections
+
+    @staticmethod
+    def _section_text(index, row, sections):
+        """Content of the article's best section, or None if it's the whole article"""
+        if not sections or row not in sections:
+            return None
+        start, end = (int(pos) for pos in index.dense.section_spans[sections[row]])
+        content = index.articles[row]["content"]
+        if start == 0 and end == len(content):
+            return None
+        return content[start:end]
+
+    @staticmethod
+    def _context_vector(session_context, vocabulary_id, n_features):
+        """Stored context as a dense row, or None if missing or from another vocabulary"""
+        if not session_context or session_context.get("vocabulary_id") != vocabulary_id:
+            return None
+        context = np.zeros(n_features)
+        context[session_context["indices"]] = session_context["weights"]
+        return context
+
+    def _context_from_history(self, index, conversation_history):
+        """Context of the user messages still in the history window, for sessions without one"""
+        messages = [msg["content"] for msg in conversation_history or () if msg["role"] == "user"]
+        if not messages:
+            return None
+        decay = self.CONTEXT_DECAY ** np.arange(len(messages) - 1, -1, -1)
+        return np.asarray(index.vectorizer.transform(messages).T @ decay).ravel()
+
+    def _blend(self, message, context):
+        """L2-normalized current message + CONTEXT_WEIGHT x normalized context"""
+        context_norm = np.linalg.norm(context) if context is not None else 0
+        if not context_norm or self.CONTEXT_WEIGHT <= 0:
+            return message
+        blended = message + context * (self.CONTEXT_WEIGHT / context_norm)
+        norm = np.linalg.norm(blended)
+        return blended / norm if norm else blended
+
+    def advance_context(self, session_context, context_update):
+        """
+        Session context after this turn: the stored context decayed, plus the
+        current message. Only the new message was vectorized for it.
+
+        Meant to run inside the session transaction, on the freshly read
+        context, so concurrent turns on a session each add their message.
+        Returns a JSON-serializable dict to store in the session.
+        """
+        if context_update is None:
+            return session_context
+        context = self._context_vector(
+            session_context, context_update.vocabulary_id, len(context_update.message_vector)
+        )
+        if context is None:
+            context = context_update.base
+        if context is None:
+            context = context_update.message_vector
+        else:
+            context = context * self.CONTEXT_DECAY + context_update.message_vector
+
+        keep = np.flatnonzero(context >= 1e-4)
+        if len(keep) > self.CONTEXT_MAX_TERMS:
+            keep = np.sort(keep[np.argpartition(context[keep], -self.CONTEXT_MAX_TERMS)[-self.CONTEXT_MAX_TERMS:]])
+        return {
+            "vocabulary_id": context_update.vocabulary_id,
+            "indices": keep.tolist(),
+            "weights": np.round(context[keep], 4).tolist(),
+        }
+
+    def _top_articles(self, index, similarities, top_k, rows=None, sections=None):
+        """Pick the top-k rows (optionally within a row subset) above the relevance threshold"""
+        scores = similarities if rows is None else similarities[rows]
+        top = select_top_k(scores, top_k, self.RELEVANCE_THRESHOLD)
+        if rows is not None:
+            top = rows[top]
+        return [
+            ScoredArticle(index.articles[idx], float(similarities[idx]), self._section_text(index, idx, sections))
+            for idx in top
+        ]
+
+    def retrieve(self, persona, query, conversation_history=None, top_k=3,
+                 with_query_vector=False, session_context=None):
+        """
+        Retrieve relevant KB articles for one persona using TF-IDF similarity
+
+        Args:
+            persona: Customer persona type
+            query: Current user query
+            conversation_history: Previous conversation for context
+            top_k: Number of articles to return
+            with_query_vector: Also return the QueryVector used for scoring
+            session_context: The session's stored context ({} if it has none
+                yet) to use the decayed context vector instead of the last two
+                user messages; pass query_vector.context_update to
+                advance_context() when the turn commits
+        """
+        index = self._index
+        if persona not in index.persona_rows:
+            return ([], None) if with_query_vector else []
+
+        similarities, query_vector, context_update, sections = self._score(
+            index, query, conversation_history, session_context
+        )
+        results = self._top_articles(index, similarities, top_k, index.persona_rows[persona], sections)
+        if with_query_vector:
+            return results, QueryVector(query_vector, index.vocabulary_version, context_update)
+        return results
+
+    def retrieve_all(self, query, conversation_history=None, top_k=3, per_persona_k=1,
+                     with_query_vector=False, session_context=None):
+        """
+        Retrieve across every persona with a single transform and similarity pass
+
+        Returns:
+            (overall, by_persona): top_k articles over the whole KB, and a dict
+            of the top per_persona_k articles for each persona. With
+            with_query_vector, a third item holds the QueryVector.
+            session_context works as in retrieve().
+        """
+        index = self._index
+        if index.article_matrix is None:
+            return ([], {}, None) if with_query_vector else ([], {})
+
+        similarities, query_vector, context_update, sections = self._score(
+            index, query, conversation_history, session_context
+        )
+        overall = self._top_articles(index, similarities, top_k, sections=sections)
+        by_persona = {
+            persona: self._top_articles(index, similarities, per_persona_k, rows, sections)
+            for persona, rows in index.persona_rows.items()
+        }
+        if with_query_vector:
+            return overall, by_persona, QueryVector(query_vector, index.vocabulary_version, context_update)
+        return overall, by_persona
+
+    def retrieve_many(self, persona, queries, histories=None, top_k=3):
+        """
+        Batched retrieve(): one transform and one sparse matrix-matrix product
+
+        Results match calling retrieve() on each (query, history) pair.
+
+        Args:
+            persona: Customer persona type
+            queries: List of user queries
+            histories: Optional list of conversation histories, one per query
+            top_k: Number of articles to return per query
+        """
+        if histories is not None and len(histories) != len(queries):
+            raise ValueError(f"Got {len(histories)} histories for {len(queries)} queries")
+        index = self._index
+        if persona not in index.persona_rows:
+            return [[] for _ in queries]
+        if histories is None:
+            histories = [None] * len(queries)
+
+        rows = index.persona_rows[persona]
+        persona_matrix = index.article_matrix[rows]
+        texts = [self._build_query(query, history) for query, history in zip(queries, histories)]
+        query_matrix = index.vectorizer.transform(texts)
+
+        # Bound the dense (articles x queries) score block to ~32MB per chunk
+        chunk = max(1, self.BATCH_SCORE_CELLS // max(1, len(rows)))
         results = []
-        for idx in top_indices:
-            if similarities[idx] > 0.1:  # Threshold for relevance
-                article = articles[idx].copy()
-                article['relevance_score'] = float(similarities[idx])
-                results.append(article)
-        
+        for start in range(0, len(queries), chunk):
+            block = query_matrix[start:start + chunk].toarray().T
+            similarities = (persona_matrix @ block).T
+            sections = [None] * len(similarities)
+            if index.dense is not None:
+                # The dense search is per query; fuse it row by row
+                for i, text in enumerate(texts[start:start + chunk]):
+                    dense_scores, sections[i] = index.dense.article_scores(
+                        text, len(index.articles), self.DENSE_CANDIDATES, self.DENSE_N_PROBE
+                    )
+                    similarities[i] = (1 - self.DENSE_WEIGHT) * similarities[i] + self.DENSE_WEIGHT * dense_scores[rows]
+            top = select_top_k_rows(similarities, top_k, self.RELEVANCE_THRESHOLD)
+            for query_scores, query_top, query_sections in zip(similarities, top, sections):
+                results.append([
+                    ScoredArticle(index.articles[rows[idx]], float(query_scores[idx]),
+                                  self._section_text(index, rows[idx], query_sections))
+                    for idx in query_top
+                ])
         return results
-    
+
+    def add_article(self, persona, article):
+        """Add a new article (its id must not already exist)"""
+        if article["id"] in self._index.id_to_row:
+            raise ValueError(f"KB article {article['id']} already exists")
+        return self.apply_changes(upserts=[(persona, article)])
+
+    def update_article(self, article, persona=None):
+        """Replace the article with the same id, optionally moving it to another persona"""
+        if article["id"] not in self._index.id_to_row:
+            raise KeyError(f"KB article {article['id']} not found")
+        return self.apply_changes(upserts=[(persona, article)])
+
+    def remove_article(self, article_id):
+        """Remove an article by id"""
+        if article_id not in self._index.id_to_row:
+            raise KeyError(f"KB article {article_id} not found")
+        return self.apply_changes(removals=[article_id])
+
+    def reload(self, knowledge_base):
+        """Diff a freshly loaded KB against the index and apply only the changes"""
+        index = self._index
+        upserts, seen = [], set()
+        for persona, articles in knowledge_base.items():
+            for article in articles:
+                seen.add(article["id"])
+                row = index.id_to_row.get(article["id"])
+                if (row is None or index.articles[row] != article
+                        or index.article_personas[row] != persona):
+                    upserts.append((persona, article))
+        removals = [article_id for article_id in index.id_to_row if article_id not in seen]
+        return self.apply_changes(upserts=upserts, removals=removals)
+
+    def apply_changes(self, upserts=(), removals=()):
+        """
+        Apply a batch of article changes and atomically swap in the new index
+
+        Changed rows are re-vectorized with the current vocabulary and spliced
+        into the sparse matrix. Vocabulary and IDF are only refit once the
+        unseen terms since the last fit pass REFIT_DRIFT_THRESHOLD.
+
+        Args:
+            upserts: (persona, article) pairs; persona None keeps the current one
+            removals: article ids to delete
+        """
+        with self._write_lock:
+            index = self._index
+            articles = list(index.articles)
+            personas = list(index.article_personas)
+            keep = [True] * len(articles)
+            changed, removed_rows = {}, []  # dict keeps upsert order without dupes
+            id_to_row = dict(index.id_to_row)
+
+            for article_id in removals:
+                row = id_to_row.get(article_id)
+                if row is not None and keep[row]:
+                    keep[row] = False
+                    removed_rows.append(row)
+
+            for persona, article in upserts:
+                row = id_to_row.get(article["id"])
+                if row is None:
+                    row = id_to_row[article["id"]] = len(articles)
+                    articles.append(article)
+                    personas.append(persona)
+                    keep.append(True)
+                else:
+                    articles[row] = article
+                    if persona is not None:
+                        personas[row] = persona
+                    keep[row] = True
+                if personas[row] is None:
+                    raise ValueError(f"KB article {article['id']} has no persona")
+                changed[row] = None
+
+            changed_rows = list(changed)
+            summary = {
+                "upserted": len(changed_rows),
+                "removed": len(removed_rows),
+                "refit": False,
+            }
+            if not changed_rows and not removed_rows:
+                return summary
+
+            keep = np.array(keep, dtype=bool)
+            if index.vectorizer is None:
+                new_index = None
+            else:
+                new_index = self._splice(index, articles, personas, keep,
+                                         changed_rows, removed_rows)
+
+            if new_index is None or new_index.drift > self.REFIT_DRIFT_THRESHOLD:
+                kept_rows = np.flatnonzero(keep)
+                new_index = self._fit(
+                    [articles[row] for row in kept_rows],
+                    [personas[row] for row in kept_rows]
+                )
+                summary["refit"] = True
+
+            self._index = new_index
+            self._persist(new_index)
+            return summary
+
+    def _splice(self, index, articles, personas, keep, changed_rows, removed_rows):
+        """Re-vectorize only the changed rows with the current vocabulary"""
+        vectorizer = index.vectorizer
+        analyzer = vectorizer.build_analyzer()
+        vocabulary = vectorizer.vocabulary_
+
+        # Removed text and unseen terms in new text both make the IDF stale
+        drift_terms = index.drift_terms
+        for row in removed_rows:
+            drift_terms += len(analyzer(_document_text(index.articles[row])))
+        documents = [_document_text(articles[row]) for row in changed_rows]
+        for doc in documents:
+            drift_terms += sum(1 for term in analyzer(doc) if term not in vocabulary)
+
+        # Stack the new rows under the old matrix, then select the final row order
+        n_old = index.article_matrix.shape[0]
+        source = np.arange(len(articles))
+        source[changed_rows] = n_old + np.arange(len(changed_rows))
+        stacked = index.article_matrix
+        if documents:  # transform() rejects an empty batch (removal-only changes)
+            stacked = sp.vstack([stacked, vectorizer.transform(documents)], format="csr")
+        kept_rows = np.flatnonzero(keep)
+        kept_articles = [articles[row] for row in kept_rows]
+
+        dense = index.dense
+        if dense is not None:
+            # Same for the dense sections: keep unchanged ones, embed the changed articles
+            new_row = np.full(len(articles), -1, dtype=np.int64)
+            new_row[kept_rows] = np.arange(len(kept_rows))
+            old_to_new = new_row[:n_old].copy()
+            old_to_new[[row for row in changed_rows if row < n_old]] = -1
+            dense = dense.splice(kept_articles, old_to_new, new_row[changed_rows].tolist(),
+                                 self.CHUNK_WORDS, self.CHUNK_OVERLAP)
+        elif self.dense:
+            # The KB was too small to embed before
+            dense = DenseIndex.build(kept_articles, self.DENSE_DIM, self.CHUNK_WORDS, self.CHUNK_OVERLAP)
+
+        return _KBIndex(
+            vectorizer,
+            stacked[source[kept_rows]],
+            kept_articles,
+            [personas[row] for row in kept_rows],
+            index.fit_terms,
+            drift_terms,
+            index.vocabulary_version,
+            dense=dense
+        )
+
     def get_keyword_matches(self, persona, query):
         """
         Fallback: Simple keyword matching (used as backup)
+
+        Scores articles by how many of their keywords occur in the query (on
+        word boundaries), found in one pass with the index's keyword matcher.
         """
-        kb_articles = self.knowledge_base.get(persona, [])
-        message_lower = query.lower()
-        
-        scored_articles = []
-        for article in kb_articles:
-            score = sum(1 for keyword in article["keywords"] if keyword in message_lower)
-            if score > 0:
-                scored_articles.append((score, article))
-        
-        scored_articles.sort(reverse=True, key=lambda x: x[0])
-        return [article for _, article in scored_articles[:3]]
\ No newline at end of file
+        index = self._index
+        scores = {}
+        for row in index.keyword_matcher.find(query):
+            if index.article_personas[row] == persona:
+                scores[row] = scores.get(row, 0) + 1
+
+        ranked = sorted(scores, key=lambda row: (-scores[row], row))
+        return [index.articles[row] for row in ranked[:3]]
+
+
+def main():
+    """
+    Prebuild the persisted index, e.g. while building a deploy image, so
+    workers memory-map it at startup instead of fitting TF-IDF:
+
+        python -m kb_retriever --kb knowledge_base.json --index-dir .kb_index
+    """
+    import argparse
+
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Build the persisted KB index")
+    parser.add_argument("--kb", default=Config.KB_PATH, help="KB file or directory (default: KB_PATH)")
+    parser.add_argument("--index-dir", default=Config.KB_INDEX_DIR, help="Output directory (default: KB_INDEX_DIR)")
+    parser.add_argument("--dense", action="store_true", default=Config.KB_DENSE_ENABLED,
+                        help="Also build the dense section index (default: KB_DENSE_ENABLED)")
+    args = parser.parse_args()
+    if not args.index_dir:
+        parser.error("--index-dir is required when KB_INDEX_DIR is disabled")
+
+    retriever = SmartKBRetriever(
+        load_knowledge_base(args.kb), index_dir=args.index_dir, dense=args.dense,
+        dense_dim=Config.KB_DENSE_DIM, chunk_words=Config.KB_CHUNK_WORDS
+    )
+    index = retriever._index
+    state = "already built" if retriever.index_loaded_from_disk else "built"
+    print(f"[OK] KB index {state}: {retriever._index_path(index.articles, index.article_personas)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import ast
+import json
+import re
+
+PERSONAS = ("technical_expert", "frustrated_user", "business_exec")
+SENTIMENTS = ("positive", "neutral", "negative")
+URGENCIES = ("low", "medium", "high")
+
+# field -> (kind, argument); see _compile_check
+ENVELOPE_SCHEMA = {
+    "persona": ("enum", PERSONAS),
+    "confidence": ("number", (0.0, 1.0)),
+    "sentiment": ("enum", SENTIMENTS),
+    "urgency": ("enum", URGENCIES),
+    "response": ("text", None),
+    "kb_articles_used": ("string_list", None),
+    "reasoning": ("string", None),
+}
+
+# What the fast-path prompt asks for (persona labels come from the local classifier)
+ANSWER_SCHEMA = {field: ENVELOPE_SCHEMA[field] for field in ("response", "kb_articles_used")}
+
+# Parse outcomes, for metrics
+OK, REPAIRED, INVALID_FIELDS, FALLBACK = "ok", "repaired", "invalid_fields", "fallback"
+
+_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```\s*$")
+_MISSING = object()
+
+
+def _compile_check(kind, argument):
+    """fn(value) -> (ok, normalized value)"""
+    if kind == "enum":
+        allowed = frozenset(argument)
+
+        def check(value):
+            if isinstance(value, str) and value.strip().lower() in allowed:
+                return True, value.strip().lower()
+            return False, None
+    elif kind == "number":
+        low, high = argument
+
+        def check(value):
+            if isinstance(value, str):
+                try:
+                    value = float(value)
+                except ValueError:
+                    return False, None
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+                return False, None
+            return True, float(value)
+    elif kind == "text":
+        def check(value):
+            return (True, value) if isinstance(value, str) and value.strip() else (False, None)
+    elif kind == "string":
+        def check(value):
+            return (True, value) if isinstance(value, str) else (False, None)
+    elif kind == "string_list":
+        def check(value):
+            if isinstance(value, list) and all(isinstance(item, str) for item in value):
+                return True, value
+            return False, None
+    else:
+        raise ValueError(f"Unknown schema kind: {kind!r}")
+    return check
+
+
+class EnvelopeValidator:
+    """
+    Schema checks compiled once, applied to every parsed envelope
+
+    Unknown keys are dropped and values normalized (e.g. "High" -> "high",
+    "0.9" -> 0.9). A field that is missing or invalid - a persona outside
+    the enum, confidence outside [0, 1] - is replaced by its default and
+    reported; an unusable required field rejects the whole envelope.
+    """
+
+    def __init__(self, schema, defaults, required=("response",)):
+        self.required = frozenset(required)
+        self._checks = [
+            (field, _compile_check(kind, argument), defaults.get(field))
+            for field, (kind, argument) in schema.items()
+        ]
+
+    def validate(self, data):
+        """(envelope, invalid field names); envelope is None if it can't be used"""
+        if not isinstance(data, dict):
+            return None, ["<root>"]
+        envelope = {}
+        invalid = []
+        for field, check, default in self._checks:
+            value = data.get(field, _MISSING)
+            ok, normalized = check(value) if value is not _MISSING else (False, None)
+            if ok:
+                envelope[field] = normalized
+                continue
+            invalid.append(field)
+            if field in self.required:
+                return None, invalid
+            envelope[field] = list(default) if isinstance(default, list) else default
+        return envelope, invalid
+
+
+def repair_candidates(text):
+    """
+    Closing attempts for a truncated or wrapped JSON object, best first
+
+    Text before the first brace and after the matching closing brace is
+    dropped. For a truncated object, an open string is closed and then the
+    open brackets; if that doesn't parse, the last incomplete member is cut
+    off at the preceding comma.
+    """
+    start = text.find("{")
+    if start < 0:
+        return []
+    text = text[start:]
+    closers = []
+    in_string = escaped = False
+    last_comma = None  # (index, closers at that point)
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not closers:
+                return []
+            closers.pop()
+            if not closers:
+                return [text[:index + 1]]
+        elif char == ",":
+            last_comma = (index, list(closers))
+
+    candidates = []
+    if in_string:
+        candidates.append((text[:-1] if escaped else text) + '"' + "".join(reversed(closers)))
+    else:
+        candidates.append(text.rstrip().rstrip(",") + "".join(reversed(closers)))
+    if last_comma is not None:
+        index, open_closers = last_comma
+        candidates.append(text[:index] + "".join(reversed(open_closers)))
+    return candidates
+
+
+def parse_envelope(text, validator):
+    """
+    (envelope, outcome) for a model reply
+
+    outcome is OK, REPAIRED (fences aside, the JSON had to be fixed up),
+    INVALID_FIELDS (some fields replaced by defaults) or FALLBACK (nothing
+    usable; envelope is None).
+    """
+    text = _FENCE.sub("", (text or "").strip())
+    repaired = False
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = _MISSING
+        repaired = True
+        for candidate in repair_candidates(text):
+            try:
+                data = json.loads(candidate)
+                break
+            except ValueError:
+                try:
+                    # Single-quoted pseudo-JSON is a Python literal
+                    data = ast.literal_eval(candidate)
+                    break
+                except (ValueError, SyntaxError, MemoryError, RecursionError):
+                    continue
+        if data is _MISSING:
+            return None, FALLBACK
+
+    envelope, invalid = validator.validate(data)
+    if envelope is None:
+        return None, FALLBACK
+    if invalid:
+        return envelope, INVALID_FIELDS
+    return envelope, REPAIRED if repaired else OK
@@ -0,0 +1,267 @@
+import asyncio
+import random
+import threading
+import time
+
+
+class LLMUnavailable(Exception):
+    """
+    The provider can't be used for this request right now
+
+    reason is one of: circuit_open, rate_limited (local quota wait too long),
+    or the last transient failure (rate_limited_429, server_error, timeout,
+    connection) once retries are exhausted.
+    """
+
+    def __init__(self, reason, message=None):
+        super().__init__(message or f"LLM unavailable: {reason}")
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate_per_minute, holding up to capacity
+
+    reserve() takes tokens immediately and returns how long the caller must
+    wait for them (the balance may go negative), so one large request can't be
+    starved by a stream of small ones and waiting works the same for threads
+    and coroutines.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 10)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount, max_wait=None):
+        """Seconds to wait before using amount tokens, or None if that exceeds max_wait"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def refund(self, amount):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute quotas; either may be None (unlimited)"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens, max_wait=None):
+        """Seconds to wait for one request of `tokens` tokens, or None if over max_wait"""
+        reserved = []
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is None:
+                continue
+            bucket_wait = bucket.reserve(amount, max_wait)
+            if bucket_wait is None:
+                for taken, taken_amount in reserved:
+                    taken.refund(taken_amount)
+                return None
+            reserved.append((bucket, amount))
+            wait = max(wait, bucket_wait)
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Stops calling the provider after failure_threshold consecutive failures
+
+    closed -> open after the threshold; open -> half_open after reset_seconds,
+    when a single probe request is let through; the probe's outcome closes or
+    re-opens the circuit. A probe that fails with an error a retry won't fix
+    leaves the state as it is and frees the slot for the next probe; one that
+    never reports back (e.g. a cancelled request) is replaced after another
+    reset_seconds.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0, on_transition=None):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.on_transition = on_transition
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may go to the provider now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.reset_seconds:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self._probe_started is not None and now - self._probe_started < self.reset_seconds:
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_started = None
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def release_probe(self):
+        """The probe ended without telling us anything about the provider; let another through"""
+        with self._lock:
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_started = None
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_transition is not None:
+            self.on_transition(state)
+
+
+def retry_reason(error):
+    """Why a failed call is worth retrying, or None for errors a retry won't fix"""
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        # Out of credits is also a 429, but waiting won't help
+        return None if getattr(error, "code", None) == "insufficient_quota" else "rate_limited_429"
+    if status is not None and status >= 500:
+        return "server_error"
+    import openai  # Already loaded by the client that raised; not imported at startup
+
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, openai.APITimeoutError)):
+        return "timeout"
+    if isinstance(error, (ConnectionError, openai.APIConnectionError)):
+        return "connection"
+    return None
+
+
+def retry_after_seconds(error):
+    """Server-requested delay from retry-after-ms / retry-after headers, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue  # An HTTP date; fall back to our own backoff
+    return None
+
+
+class LLMGateway:
+    """
+    Rate limiting, retries and a circuit breaker around provider calls
+
+    call(fn, tokens) / acall(coro_fn, tokens) run one request: the circuit
+    must be closed (or probing), the local quota must have room within
+    max_wait_seconds, and 429/5xx/timeout/connection failures are retried
+    with full-jitter exponential backoff, or after the server's retry-after
+    when it sends one. Anything that leaves the provider unusable raises
+    LLMUnavailable; other errors (bad requests) propagate unchanged.
+
+    metrics, if given, receives record_llm_gateway(event, reason) calls and a
+    rate_limit_wait stage.
+    """
+
+    def __init__(self, limiter=None, breaker=None, max_retries=3, retry_base_seconds=0.5,
+                 retry_max_seconds=8.0, max_wait_seconds=5.0, metrics=None):
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.metrics = metrics
+
+    def call(self, fn, tokens=0):
+        """Run fn() (one provider request) with limits, retries and the breaker"""
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._admit(attempt, tokens))
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._backoff(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, coro_fn, tokens=0):
+        """Async call(): coro_fn() returns a fresh awaitable per attempt"""
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._admit(attempt, tokens))
+            try:
+                result = await coro_fn()
+            except Exception as e:
+                await asyncio.sleep(self._backoff(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _admit(self, attempt, tokens):
+        """Seconds to wait for the local quota before this attempt"""
+        if attempt == 0:
+            allowed = self.breaker.allow()
+        else:
+            allowed = self.breaker.state != CircuitBreaker.OPEN  # Opened while we backed off
+        if not allowed:
+            self._record("short_circuited")
+            raise LLMUnavailable("circuit_open")
+        if self.limiter is None:
+            return 0.0
+        wait = self.limiter.reserve(tokens, self.max_wait_seconds)
+        if wait is None:
+            self._record("rate_limit_rejected")
+            raise LLMUnavailable("rate_limited", "LLM unavailable: local rate limit queue is full")
+        if wait > 0:
+            self._record("rate_limit_waits")
+            if self.metrics is not None:
+                self.metrics.record_stage("rate_limit_wait", wait)
+        return wait
+
+    def _backoff(self, error, attempt):
+        """Seconds before the next attempt; raises when the error shouldn't be retried"""
+        reason = retry_reason(error)
+        if reason is None:
+            # Says nothing about provider health (a bad request, or a local error that
+            # never reached it): only a completed call may close the circuit
+            self.breaker.release_probe()
+            raise error
+        self.breaker.record_failure()
+        retry_after = retry_after_seconds(error)
+        if attempt >= self.max_retries or (retry_after or 0) > self.retry_max_seconds:
+            self._record("failures", reason)
+            raise LLMUnavailable(reason, f"LLM unavailable: {reason} ({error})") from error
+        self._record("retries", reason)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.retry_base_seconds)
+        return random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+
+    def _record(self, event, reason=None):
+        if self.metrics is not None:
+            self.metrics.record_llm_gateway(event, reason)
@@ -1,73 +1,744 @@
+import itertools
+import math
+import threading
 import time
 from collections import defaultdict
+from contextvars import ContextVar
 from datetime import datetime
 
+# Rolling windows reported for every distribution, in minutes
+WINDOWS_MINUTES = (1, 5, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RunningStats:
+    """Count, mean, variance, min and max in O(1) memory (Welford)"""
+    
+    __slots__ = ("count", "mean", "m2", "min", "max")
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+    
+    def merge(self, other):
+        """Combine with another RunningStats (Chan et al. parallel update)"""
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+    
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+    
+    def to_state(self):
+        return [self.count, self.mean, self.m2, self.min, self.max]
+    
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.count, stats.mean, stats.m2, stats.min, stats.max = state
+        return stats
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with bounded relative error (DDSketch-style)
+    
+    Positive values go into logarithmic buckets, so any quantile is within
+    relative_accuracy of the true value and memory depends on the value range,
+    not the number of samples. Past max_buckets the lowest buckets are
+    collapsed, which only affects the smallest values.
+    """
+    
+    MIN_VALUE = 1e-9  # Smaller values (and zero) are counted exactly as 0
+    
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+    
+    def add(self, value):
+        self.count += 1
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+    
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        while len(self.buckets) > self.max_buckets:
+            self._collapse()
+    
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i] in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+    
+    def _collapse(self):
+        lowest, second = sorted(self.buckets)[:2]
+        self.buckets[second] += self.buckets.pop(lowest)
+    
+    def to_state(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "buckets": list(self.buckets.items()),
+        }
+    
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state["relative_accuracy"])
+        sketch.zero_count = state["zero_count"]
+        sketch.count = state["count"]
+        sketch.buckets = {index: n for index, n in state["buckets"]}
+        return sketch
+
+
+class Distribution:
+    """RunningStats plus a QuantileSketch over the same samples"""
+    
+    __slots__ = ("stats", "sketch")
+    
+    def __init__(self):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch()
+    
+    def add(self, value):
+        self.stats.add(value)
+        self.sketch.add(value)
+    
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+    
+    def summary(self, digits=4):
+        stats = self.stats
+        if stats.count == 0:
+            return {"count": 0}
+        summary = {
+            "count": stats.count,
+            "mean": round(stats.mean, digits),
+            "stddev": round(stats.stddev, digits),
+            "min": round(stats.min, digits),
+            "max": round(stats.max, digits),
+        }
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}"] = round(self.sketch.quantile(q), digits)
+        return summary
+    
+    def to_state(self):
+        return {"stats": self.stats.to_state(), "sketch": self.sketch.to_state()}
+    
+    @classmethod
+    def from_state(cls, state):
+        distribution = cls()
+        distribution.stats = RunningStats.from_state(state["stats"])
+        distribution.sketch = QuantileSketch.from_state(state["sketch"])
+        return distribution
+
+
+class WindowedDistribution:
+    """
+    Lifetime Distribution plus rolling views over the last WINDOWS_MINUTES
+    
+    Samples also go into time slices: 10-second slices for the 1 minute view
+    and 1-minute slices for the longer ones. A window merges the slices it
+    covers (including the current, partial one), and slices older than the
+    longest window are dropped, so memory stays constant.
+    """
+    
+    FINE_SECONDS = 10
+    COARSE_SECONDS = 60
+    
+    def __init__(self):
+        self.lifetime = Distribution()
+        self._fine = {}    # slice number -> Distribution
+        self._coarse = {}
+        self._lock = threading.Lock()
+    
+    def add(self, value, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self.lifetime.add(value)
+            self._slice(self._fine, now, self.FINE_SECONDS, 60).add(value)
+            self._slice(self._coarse, now, self.COARSE_SECONDS, max(WINDOWS_MINUTES) * 60).add(value)
+    
+    def window(self, minutes, now=None):
+        """Merged Distribution of the samples from roughly the last `minutes`"""
+        now = time.time() if now is None else now
+        seconds = minutes * 60
+        slices, width = (self._fine, self.FINE_SECONDS) if seconds <= 60 else (self._coarse, self.COARSE_SECONDS)
+        oldest = int(now // width) - seconds // width
+        merged = Distribution()
+        with self._lock:
+            for number, distribution in slices.items():
+                if number > oldest:
+                    merged.merge(distribution)
+        return merged
+    
+    def summary(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            lifetime = self.lifetime.summary()
+        return {
+            "lifetime": lifetime,
+            "windows": {f"{m}m": self.window(m, now).summary() for m in WINDOWS_MINUTES},
+        }
+    
+    def to_state(self):
+        """JSON-serializable lifetime and time slices (see merge_state)"""
+        with self._lock:
+            return {
+                "lifetime": self.lifetime.to_state(),
+                "fine": [[number, d.to_state()] for number, d in self._fine.items()],
+                "coarse": [[number, d.to_state()] for number, d in self._coarse.items()],
+            }
+    
+    def merge_state(self, state):
+        """Add another process's to_state(); slices line up because they're numbered by wall-clock time"""
+        with self._lock:
+            self.lifetime.merge(Distribution.from_state(state["lifetime"]))
+            for slices, key in ((self._fine, "fine"), (self._coarse, "coarse")):
+                for number, distribution in state[key]:
+                    slices.setdefault(number, Distribution()).merge(Distribution.from_state(distribution))
+    
+    @staticmethod
+    def _slice(slices, now, width, span):
+        number = int(now // width)
+        distribution = slices.get(number)
+        if distribution is None:
+            distribution = slices[number] = Distribution()
+            oldest = number - span // width
+            for stale in [n for n in slices if n <= oldest]:
+                del slices[stale]
+        return distribution
+
+
+class ShardedCounters:
+    """
+    Counters that many threads can bump without one shared lock
+    
+    Each thread is handed one of STRIPES dicts round-robin, each with its
+    own lock, so concurrent writers rarely contend and increments are never
+    lost. The stripe count is fixed: memory doesn't grow with the number of
+    threads a thread-per-request server starts. Readers sum the stripes.
+    """
+    
+    STRIPES = 16
+    
+    def __init__(self):
+        self._stripes = [({}, threading.Lock()) for _ in range(self.STRIPES)]
+        self._local = threading.local()
+        self._next_stripe = itertools.count()
+    
+    def add(self, key, amount=1):
+        index = getattr(self._local, "stripe", None)
+        if index is None:
+            # Thread ids are aligned addresses, so hand out stripes in turn instead
+            index = self._local.stripe = next(self._next_stripe) % self.STRIPES
+        stripe, lock = self._stripes[index]
+        with lock:
+            stripe[key] = stripe.get(key, 0) + amount
+    
+    def snapshot(self):
+        """Totals across all stripes"""
+        totals = defaultdict(int)
+        for stripe, lock in self._stripes:
+            with lock:
+                items = list(stripe.items())
+            for key, value in items:
+                totals[key] += value
+        return totals
+
+
+def _encode_key(key):
+    """Counter key as JSON (tuples become lists)"""
+    return [_encode_key(part) for part in key] if isinstance(key, tuple) else key
+
+
+def _decode_key(key):
+    return tuple(_decode_key(part) for part in key) if isinstance(key, list) else key
+
+
+def _breakdown(totals, name):
+    """Per-label counts for counters keyed (name, label)"""
+    return defaultdict(int, {
+        key[1]: value for key, value in totals.items()
+        if isinstance(key, tuple) and key[0] == name
+    })
+
+
+# Stage durations of the turn running in this thread/task (see MetricsTracker.start_turn)
+_turn_stages = ContextVar("turn_stages", default=None)
+
+
+class StageTimer:
+    """Context manager that records the elapsed time of one pipeline stage"""
+    
+    __slots__ = ("tracker", "stage", "start")
+    
+    def __init__(self, tracker, stage):
+        self.tracker = tracker
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.tracker.record_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
 class MetricsTracker:
     """Track agent performance metrics"""
     
     def __init__(self):
-        self.metrics = {
-            "total_requests": 0,
-            "persona_detections": defaultdict(int),
-            "kb_hits": 0,
-            "kb_misses": 0,
-            "escalations": 0,
-            "avg_response_time": 0,
-            "avg_confidence": 0,
-            "sentiment_distribution": defaultdict(int),
-            "urgency_distribution": defaultdict(int),
+        self._counters = ShardedCounters()
+        self._distributions = {}  # (name, label or None) -> WindowedDistribution
+        self._distributions_lock = threading.Lock()
+    
+    @property
+    def metrics(self):
+        """Current totals, in the same shape as the original metrics dict"""
+        totals = self._counters.snapshot()
+        total = totals["total_requests"]
+        return {
+            "total_requests": total,
+            "persona_detections": _breakdown(totals, "persona_detections"),
+            "kb_hits": totals["kb_hits"],
+            "kb_misses": totals["kb_misses"],
+            "escalations": totals["escalations"],
+            "avg_response_time": self._mean("response_time"),
+            "avg_confidence": self._mean("confidence"),
+            "sentiment_distribution": _breakdown(totals, "sentiment_distribution"),
+            "urgency_distribution": _breakdown(totals, "urgency_distribution"),
+            "cache_hits": _breakdown(totals, "cache_hits"),      # per persona
+            "cache_misses": _breakdown(totals, "cache_misses"),  # per persona
+            "cache_bypassed": totals["cache_bypassed"],
+            "llm_calls": totals["llm_calls"],
+            "tokens_in": totals["tokens_in"],
+            "tokens_out": totals["tokens_out"],
+            "llm_calls_by_prompt": _breakdown(totals, "llm_calls_by_prompt"),
+            "tokens_in_by_prompt": _breakdown(totals, "tokens_in_by_prompt"),
+            "classifier_routes": _breakdown(totals, "classifier_routes"),
+            "classifier_agreement": _breakdown(totals, "classifier_agreement"),
+            "prompt_trimmed": _breakdown(totals, "prompt_trimmed"),
+            "coalesce_leaders": totals["coalesce_leaders"],
+            "coalesced_requests": totals["coalesced_requests"],
+            "llm_gateway": _breakdown(totals, "llm_gateway"),  # (event, reason) -> count
+            "llm_parse": _breakdown(totals, "llm_parse"),
+            "transcript_log": _breakdown(totals, "transcript_log"),
         }
-        self.response_times = []
-        self.confidence_scores = []
+    
+    def export_state(self):
+        """
+        All counters and distributions as JSON-serializable data
+        
+        Another tracker can add it with merge_state(), e.g. to combine the
+        workers of a multi-process server into one view (see cluster.py).
+        """
+        with self._distributions_lock:
+            distributions = list(self._distributions.items())
+        return {
+            "counters": [[_encode_key(key), value] for key, value in self._counters.snapshot().items()],
+            "distributions": [[name, label, d.to_state()] for (name, label), d in distributions],
+        }
+    
+    def merge_state(self, state):
+        """Add an export_state() from another tracker into this one"""
+        for key, value in state["counters"]:
+            self._counters.add(_decode_key(key), value)
+        for name, label, distribution_state in state["distributions"]:
+            with self._distributions_lock:
+                distribution = self._distributions.setdefault((name, label), WindowedDistribution())
+            distribution.merge_state(distribution_state)
+    
+    @classmethod
+    def merged(cls, states):
+        """New tracker holding the sum of several export_state() results"""
+        tracker = cls()
+        for state in states:
+            tracker.merge_state(state)
+        return tracker
     
     def record_request(self, persona, kb_articles, confidence, response_time, escalated, sentiment, urgency):
         """Record metrics for a single request"""
-        self.metrics["total_requests"] += 1
-        self.metrics["persona_detections"][persona] += 1
-        self.metrics["sentiment_distribution"][sentiment] += 1
-        self.metrics["urgency_distribution"][urgency] += 1
+        counters = self._counters
+        counters.add("total_requests")
+        counters.add(("persona_detections", persona))
+        counters.add(("sentiment_distribution", sentiment))
+        counters.add(("urgency_distribution", urgency))
         
         # KB metrics
-        if kb_articles:
-            self.metrics["kb_hits"] += 1
-        else:
-            self.metrics["kb_misses"] += 1
+        counters.add("kb_hits" if kb_articles else "kb_misses")
         
         # Escalation
         if escalated:
-            self.metrics["escalations"] += 1
+            counters.add("escalations")
         
-        # Track response time
-        self.response_times.append(response_time)
-        self.metrics["avg_response_time"] = sum(self.response_times) / len(self.response_times)
-        
-        # Track confidence
-        self.confidence_scores.append(confidence)
-        self.metrics["avg_confidence"] = sum(self.confidence_scores) / len(self.confidence_scores)
+        # Streaming distributions, overall and per persona
+        self.observe("response_time", response_time)
+        self.observe("response_time", response_time, label=persona)
+        self.observe("confidence", confidence)
+        self.observe("confidence", confidence, label=persona)
+    
+    def record_stage(self, stage, seconds):
+        """Record how long one pipeline stage took"""
+        self.observe("stage", seconds, label=stage)
+        stages = _turn_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    
+    def start_turn(self):
+        """Also collect the stages recorded from here on in this thread/task, for turn_stages()"""
+        _turn_stages.set({})
+    
+    def turn_stages(self):
+        """{stage: seconds} recorded since start_turn() in this thread/task"""
+        return dict(_turn_stages.get() or {})
+    
+    def time_stage(self, stage):
+        """with tracker.time_stage("llm"): ... records the block's duration"""
+        return StageTimer(self, stage)
+    
+    def record_usage(self, usage, prompt="full"):
+        """Count tokens from an OpenAI usage object (None when not reported)"""
+        if usage is None:
+            return
+        tokens_in = getattr(usage, "prompt_tokens", 0) or 0
+        tokens_out = getattr(usage, "completion_tokens", 0) or 0
+        self._counters.add("llm_calls")
+        self._counters.add("tokens_in", tokens_in)
+        self._counters.add("tokens_out", tokens_out)
+        # Per prompt kind: "full" (combined classification) or "fast" (persona-specific)
+        self._counters.add(("llm_calls_by_prompt", prompt))
+        self._counters.add(("tokens_in_by_prompt", prompt), tokens_in)
+    
+    def record_prompt(self, prompt):
+        """Prompt size per request: total and per section, plus what was trimmed to fit"""
+        self.observe("prompt_tokens", prompt.tokens)
+        for section, tokens in prompt.sections.items():
+            self.observe("prompt_tokens", tokens, label=section)
+        for section, n in prompt.trimmed.items():
+            self._counters.add(("prompt_trimmed", section), n)
+    
+    def record_coalescing(self, shared):
+        """Count an eligible LLM call: made by this request, or shared from one in flight"""
+        self._counters.add("coalesced_requests" if shared else "coalesce_leaders")
+    
+    def record_parse(self, outcome):
+        """Count how an LLM reply parsed: ok, repaired, invalid_fields, fallback"""
+        self._counters.add(("llm_parse", outcome))
+    
+    def record_llm_gateway(self, event, reason=None):
+        """
+        Count an LLM gateway event: retries / failures (by reason),
+        circuit_transitions (by new state), short_circuited, rate_limit_waits,
+        rate_limit_rejected, degraded_answers
+        """
+        self._counters.add(("llm_gateway", (event, reason)))
+    
+    def record_transcript(self, event, n=1):
+        """Count transcript log records: written, dropped, write_errors; also bytes and segments"""
+        self._counters.add(("transcript_log", event), n)
+    
+    def record_transcript_flush(self, seconds):
+        """Record how long one bulk write of the transcript log took"""
+        self.observe("transcript_flush", seconds)
+    
+    def get_gateway_summary(self, metrics=None):
+        """Retries, breaker activity and degraded answers from the LLM gateway"""
+        metrics = metrics or self.metrics
+        summary = {
+            "retries": {},
+            "failures": {},
+            "circuit_transitions": {},
+            "short_circuited": 0,
+            "rate_limit_waits": 0,
+            "rate_limit_rejected": 0,
+            "degraded_answers": 0,
+        }
+        for (event, reason), n in metrics["llm_gateway"].items():
+            if isinstance(summary.get(event), dict):
+                summary[event][reason] = n
+            else:
+                summary[event] = summary.get(event, 0) + n
+        return summary
+    
+    def record_classifier_route(self, route):
+        """Record how a turn was routed: fast_path, audit, low_confidence"""
+        self._counters.add(("classifier_routes", route))
+    
+    def record_classifier_agreement(self, prediction, result, confident):
+        """Compare a local prediction with the LLM's labels for the same turn"""
+        bucket = "confident" if confident else "uncertain"
+        for task, label in prediction.labels.items():
+            outcome = "agree" if result.get(task) == label else "disagree"
+            self._counters.add(("classifier_agreement", (task, bucket, outcome)))
+    
+    def get_coalescing_summary(self, metrics=None):
+        """LLM calls saved by sharing in-flight requests"""
+        metrics = metrics or self.metrics
+        eligible = metrics["coalesce_leaders"] + metrics["coalesced_requests"]
+        coalesced_rate = (metrics["coalesced_requests"] / eligible) * 100 if eligible > 0 else 0
+        return {
+            "eligible_requests": eligible,
+            "llm_calls": metrics["coalesce_leaders"],
+            "coalesced": metrics["coalesced_requests"],
+            "coalesced_rate": f"{coalesced_rate:.1f}%",
+        }
+    
+    def get_classifier_summary(self, metrics=None):
+        """Fast-path routing, agreement with the LLM and prompt tokens per call"""
+        metrics = metrics or self.metrics
+        agreement = {}
+        for (task, bucket, outcome), n in metrics["classifier_agreement"].items():
+            agreement.setdefault(task, {}).setdefault(bucket, {"agree": 0, "disagree": 0})[outcome] += n
+        for buckets in agreement.values():
+            for counts in buckets.values():
+                compared = counts["agree"] + counts["disagree"]
+                counts["rate"] = f"{counts['agree'] / compared * 100 if compared else 0:.1f}%"
+        return {
+            "routes": dict(metrics["classifier_routes"]),
+            "agreement": agreement,
+            "avg_prompt_tokens": {
+                prompt: round(metrics["tokens_in_by_prompt"][prompt] / calls, 1)
+                for prompt, calls in metrics["llm_calls_by_prompt"].items() if calls
+            },
+        }
+    
+    def observe(self, name, value, label=None):
+        """Add a sample to the (name, label) distribution"""
+        key = (name, label)
+        distribution = self._distributions.get(key)
+        if distribution is None:
+            with self._distributions_lock:
+                distribution = self._distributions.setdefault(key, WindowedDistribution())
+        distribution.add(value)
+    
+    def get_distribution_summary(self, name):
+        """Lifetime and rolling-window stats for a distribution and its labels"""
+        now = time.time()
+        with self._distributions_lock:
+            keys = sorted((k for k in self._distributions if k[0] == name), key=lambda k: k[1] or "")
+        summary = {"overall": None, "by_label": {}}
+        for key in keys:
+            if key[1] is None:
+                summary["overall"] = self._distributions[key].summary(now)
+            else:
+                summary["by_label"][key[1]] = self._distributions[key].summary(now)
+        return summary
+    
+    def _mean(self, name):
+        distribution = self._distributions.get((name, None))
+        return distribution.lifetime.stats.mean if distribution is not None else 0
+    
+    def record_cache_lookup(self, persona, hit):
+        """Record a response cache hit or miss for a persona"""
+        self._counters.add(("cache_hits" if hit else "cache_misses", persona))
+    
+    def record_cache_bypass(self):
+        """Record a turn that skipped the response cache (negative sentiment)"""
+        self._counters.add("cache_bypassed")
+    
+    def get_cache_summary(self, metrics=None):
+        """Response cache hit/miss counts, overall and per persona"""
+        metrics = metrics or self.metrics
+        hits = sum(metrics["cache_hits"].values())
+        misses = sum(metrics["cache_misses"].values())
+        lookups = hits + misses
+        personas = set(metrics["cache_hits"]) | set(metrics["cache_misses"])
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": metrics["cache_bypassed"],
+            "hit_rate": f"{(hits / lookups) * 100 if lookups else 0:.1f}%",
+            "by_persona": {
+                persona: {
+                    "hits": metrics["cache_hits"][persona],
+                    "misses": metrics["cache_misses"][persona],
+                }
+                for persona in sorted(personas)
+            },
+        }
     
     def get_summary(self):
         """Get metrics summary"""
-        total = self.metrics["total_requests"]
+        metrics = self.metrics
+        total = metrics["total_requests"]
         if total == 0:
             return {"message": "No requests yet"}
         
-        kb_hit_rate = (self.metrics["kb_hits"] / total) * 100 if total > 0 else 0
-        escalation_rate = (self.metrics["escalations"] / total) * 100 if total > 0 else 0
+        kb_hit_rate = (metrics["kb_hits"] / total) * 100 if total > 0 else 0
+        escalation_rate = (metrics["escalations"] / total) * 100 if total > 0 else 0
         
         return {
             "total_requests": total,
-            "persona_distribution": dict(self.metrics["persona_detections"]),
+            "persona_distribution": dict(metrics["persona_detections"]),
             "kb_hit_rate": f"{kb_hit_rate:.1f}%",
             "escalation_rate": f"{escalation_rate:.1f}%",
-            "avg_response_time": f"{self.metrics['avg_response_time']:.2f}s",
-            "avg_confidence": f"{self.metrics['avg_confidence']:.2f}",
-            "sentiment_distribution": dict(self.metrics["sentiment_distribution"]),
-            "urgency_distribution": dict(self.metrics["urgency_distribution"]),
+            "avg_response_time": f"{metrics['avg_response_time']:.2f}s",
+            "avg_confidence": f"{metrics['avg_confidence']:.2f}",
+            "sentiment_distribution": dict(metrics["sentiment_distribution"]),
+            "urgency_distribution": dict(metrics["urgency_distribution"]),
+            "response_cache": self.get_cache_summary(metrics),
+            "response_time_seconds": self._labelled("response_time", "by_persona"),
+            "confidence": self._labelled("confidence", "by_persona"),
+            "stage_seconds": self.get_distribution_summary("stage")["by_label"],
+            "llm_tokens": {
+                "calls": metrics["llm_calls"],
+                "in": metrics["tokens_in"],
+                "out": metrics["tokens_out"],
+            },
+            "persona_classifier": self.get_classifier_summary(metrics),
+            "request_coalescing": self.get_coalescing_summary(metrics),
+            "llm_gateway": self.get_gateway_summary(metrics),
+            "llm_parse": dict(metrics["llm_parse"]),
+            "transcript_log": {
+                **{event: 0 for event in ("written", "dropped", "write_errors", "bytes", "segments")},
+                **metrics["transcript_log"],
+                "flush_seconds": self.get_distribution_summary("transcript_flush")["overall"],
+            },
+            "llm_batch_size": self.get_distribution_summary("llm_batch_size")["overall"],
+            "prompt_tokens": {
+                **self._labelled("prompt_tokens", "by_section"),
+                "trimmed": dict(metrics["prompt_trimmed"]),
+            },
         }
     
+    def _labelled(self, name, label_key):
+        summary = self.get_distribution_summary(name)
+        return {**(summary["overall"] or {}), label_key: summary["by_label"]}
+    
     def get_detailed_metrics(self):
         """Get all metrics"""
         return {
             **self.metrics,
             "summary": self.get_summary()
-        }
\ No newline at end of file
+        }
+    
+    def to_prometheus(self):
+        """All counters and distributions in Prometheus text exposition format"""
+        metrics = self.metrics
+        lines = []
+        
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value, *suffix in samples:
+                lines.append(f"{name}{''.join(suffix)}{_prometheus_labels(labels)} {value}")
+        
+        family("support_requests_total", "counter", "Chat turns processed",
+               [({}, metrics["total_requests"])])
+        family("support_persona_detections_total", "counter", "Turns by detected persona",
+               [({"persona": p}, n) for p, n in sorted(metrics["persona_detections"].items())])
+        family("support_sentiment_total", "counter", "Turns by detected sentiment",
+               [({"sentiment": k}, n) for k, n in sorted(metrics["sentiment_distribution"].items())])
+        family("support_urgency_total", "counter", "Turns by detected urgency",
+               [({"urgency": k}, n) for k, n in sorted(metrics["urgency_distribution"].items())])
+        family("support_kb_lookups_total", "counter", "Turns with and without KB articles",
+               [({"result": "hit"}, metrics["kb_hits"]), ({"result": "miss"}, metrics["kb_misses"])])
+        family("support_escalations_total", "counter", "Turns escalated to a human",
+               [({}, metrics["escalations"])])
+        family("support_response_cache_total", "counter", "Response cache lookups",
+               [({"persona": p, "result": "hit"}, n) for p, n in sorted(metrics["cache_hits"].items())]
+               + [({"persona": p, "result": "miss"}, n) for p, n in sorted(metrics["cache_misses"].items())]
+               + [({"result": "bypass"}, metrics["cache_bypassed"])])
+        family("support_llm_calls_total", "counter", "LLM completions that reported token usage",
+               [({}, metrics["llm_calls"])])
+        family("support_llm_tokens_total", "counter", "LLM tokens by direction",
+               [({"direction": "in"}, metrics["tokens_in"]), ({"direction": "out"}, metrics["tokens_out"])])
+        family("support_llm_prompt_tokens_total", "counter", "LLM prompt tokens by prompt kind",
+               [({"prompt": p}, n) for p, n in sorted(metrics["tokens_in_by_prompt"].items())])
+        family("support_classifier_routes_total", "counter", "Turns by local classifier routing",
+               [({"route": r}, n) for r, n in sorted(metrics["classifier_routes"].items())])
+        family("support_classifier_agreement_total", "counter", "Local classifier vs LLM labels",
+               [({"task": t, "confidence": b, "result": o}, n)
+                for (t, b, o), n in sorted(metrics["classifier_agreement"].items())])
+        family("support_coalescing_total", "counter", "Coalescing-eligible LLM requests by outcome",
+               [({"result": "leader"}, metrics["coalesce_leaders"]),
+                ({"result": "coalesced"}, metrics["coalesced_requests"])])
+        family("support_llm_parse_total", "counter", "LLM replies by parse outcome",
+               [({"outcome": k}, n) for k, n in sorted(metrics["llm_parse"].items())])
+        family("support_llm_gateway_events_total", "counter", "LLM retries, failures, breaker and rate limit events",
+               [({"event": e, "reason": r} if r is not None else {"event": e}, n)
+                for (e, r), n in sorted(metrics["llm_gateway"].items(), key=lambda item: (item[0][0], item[0][1] or ""))])
+        family("support_transcript_records_total", "counter", "Transcript log records by outcome",
+               [({"result": k}, n) for k, n in sorted(metrics["transcript_log"].items())
+                if k in ("written", "dropped", "write_errors")])
+        family("support_prompt_trimmed_total", "counter", "Prompt items cut or shortened to fit the token budget",
+               [({"section": k}, n) for k, n in sorted(metrics["prompt_trimmed"].items())])
+        
+        for name, metric, label, help_text in (
+            ("response_time", "support_response_time_seconds", "persona", "End-to-end turn latency"),
+            ("confidence", "support_persona_confidence", "persona", "Persona detection confidence"),
+            ("stage", "support_stage_seconds", "stage", "Latency of each pipeline stage"),
+            ("prompt_tokens", "support_prompt_tokens", "section", "Estimated prompt tokens per request"),
+            ("llm_batch_size", "support_llm_batch_size", None, "Requests per LLM micro-batch"),
+            ("transcript_flush", "support_transcript_flush_seconds", None, "Duration of one transcript log bulk write"),
+        ):
+            samples = []
+            with self._distributions_lock:
+                keys = sorted((k for k in self._distributions if k[0] == name), key=lambda k: k[1] or "")
+            for key in keys:
+                labels = {label: key[1]} if key[1] is not None else {}
+                windowed = self._distributions[key]
+                with windowed._lock:
+                    stats, sketch = windowed.lifetime.stats, windowed.lifetime.sketch
+                    for q in QUANTILES:
+                        samples.append(({**labels, "quantile": q}, sketch.quantile(q) or 0))
+                    samples.append((labels, stats.mean * stats.count, "_sum"))
+                    samples.append((labels, stats.count, "_count"))
+            family(metric, "summary", help_text, samples)
+        
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
@@ -0,0 +1,90 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Gathers requests that arrive close together and dispatches them as a burst
+
+    submit() queues a payload and returns a concurrent.futures.Future (wrap it
+    with asyncio.wrap_future in coroutines). A collector thread waits for the
+    first request, then keeps taking more until max_batch_size is reached or
+    max_delay_ms has passed since that first request arrived - the most
+    queueing any request adds. Each batch is handed to a private event loop,
+    which runs call(payload) for every item concurrently over one connection
+    pool, so a self-hosted backend sees the requests together and can batch
+    them on its side. Results and exceptions are routed back to each future;
+    futures cancelled while queued are skipped.
+
+    max_in_flight caps calls running at once across batches. metrics, if
+    given, gets an llm_batch_size sample per batch and a batch_queue stage
+    per request.
+    """
+
+    def __init__(self, call, max_batch_size=16, max_delay_ms=10, max_in_flight=64, metrics=None):
+        self.call = call  # async fn(payload) -> result
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.max_in_flight = max_in_flight
+        self.metrics = metrics
+        self._queue = queue.SimpleQueue()
+        self._loop = None
+        self._slots = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, payload):
+        """Future for call(payload), run with the next batch"""
+        if self._loop is None:
+            self._start()
+        future = Future()
+        self._queue.put((payload, future, time.perf_counter()))
+        return future
+
+    def _start(self):
+        """Threads start on first use, so importing or building an agent spawns nothing"""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-batch-loop", daemon=True).start()
+            self._slots = asyncio.run_coroutine_threadsafe(self._make_slots(), loop).result()
+            threading.Thread(target=self._collect, args=(loop,), name="llm-batch-collector", daemon=True).start()
+            self._loop = loop
+
+    async def _make_slots(self):
+        return asyncio.Semaphore(self.max_in_flight)
+
+    def _collect(self, loop):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0][2] + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            asyncio.run_coroutine_threadsafe(self._dispatch(batch), loop)
+
+    async def _dispatch(self, batch):
+        dispatched = time.perf_counter()
+        live = [(payload, future) for payload, future, enqueued in batch if future.set_running_or_notify_cancel()]
+        if self.metrics is not None:
+            self.metrics.observe("llm_batch_size", len(batch))
+            for _, _, enqueued in batch:
+                self.metrics.record_stage("batch_queue", dispatched - enqueued)
+        results = await asyncio.gather(*(self._run(payload) for payload, _ in live), return_exceptions=True)
+        for (_, future), result in zip(live, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run(self, payload):
+        async with self._slots:
+            return await self.call(payload)
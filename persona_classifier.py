@@ -0,0 +1,174 @@
+"""
+Local persona / sentiment / urgency classifier
+
+Linear models over word and bigram TF-IDF features of the customer's message,
+trained from the labels the LLM produced on earlier turns (logged to
+Config.PERSONA_LABEL_LOG). When all three predictions are confident, the agent
+can skip the classification part of the prompt and ask the LLM only for the
+answer.
+
+Usage:
+    python -m persona_classifier train --labels persona_labels.jsonl --model persona_classifier.joblib
+    python -m persona_classifier evaluate --labels persona_labels.jsonl --model persona_classifier.joblib
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+
+TASKS = ("persona", "sentiment", "urgency")
+MODEL_FORMAT_VERSION = 1
+
+Prediction = namedtuple("Prediction", ["labels", "confidence"])  # {task: label}, {task: probability}
+
+_label_log_lock = threading.Lock()
+
+
+def log_label(path, message, result):
+    """Append one LLM-labelled message to the JSONL training log"""
+    record = {"message": message, "ts": time.time(), **{task: result.get(task) for task in TASKS}}
+    line = json.dumps(record) + "\n"
+    with _label_log_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def load_labels(path):
+    """Labelled messages from a JSONL log, skipping incomplete rows"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("message") and all(record.get(task) for task in TASKS):
+                records.append(record)
+    return records
+
+
+class PersonaClassifier:
+    """One shared TF-IDF vectorizer and a logistic regression per task"""
+
+    def __init__(self, vectorizer, models):
+        self.vectorizer = vectorizer
+        self.models = models  # task -> LogisticRegression, or the only label seen in training
+
+    @classmethod
+    def train(cls, records):
+        if not records:
+            raise ValueError("No training records")
+        vectorizer = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=1)
+        features = vectorizer.fit_transform([record["message"] for record in records])
+        models = {}
+        for task in TASKS:
+            labels = [record[task] for record in records]
+            if len(set(labels)) < 2:
+                models[task] = labels[0]
+                continue
+            models[task] = LogisticRegression(max_iter=1000, C=4.0).fit(features, labels)
+        return cls(vectorizer, models)
+
+    def predict(self, message):
+        return self.predict_many([message])[0]
+
+    def predict_many(self, messages):
+        features = self.vectorizer.transform(messages)
+        labels = [{} for _ in messages]
+        confidence = [{} for _ in messages]
+        for task, model in self.models.items():
+            if isinstance(model, str):
+                for i in range(len(messages)):
+                    labels[i][task], confidence[i][task] = model, 1.0
+                continue
+            probabilities = model.predict_proba(features)
+            best = probabilities.argmax(axis=1)
+            for i, column in enumerate(best):
+                labels[i][task] = str(model.classes_[column])
+                confidence[i][task] = float(probabilities[i, column])
+        return [Prediction(labels[i], confidence[i]) for i in range(len(messages))]
+
+    def save(self, path):
+        joblib.dump({"format": MODEL_FORMAT_VERSION, "vectorizer": self.vectorizer, "models": self.models}, path)
+
+    @classmethod
+    def load(cls, path):
+        data = joblib.load(path)
+        if data.get("format") != MODEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported classifier format {data.get('format')!r} in {path}")
+        return cls(data["vectorizer"], data["models"])
+
+
+def evaluate(classifier, records, threshold):
+    """
+    Agreement with the LLM labels, overall and on the confident subset
+
+    A prediction is confident when every task's probability is >= threshold;
+    coverage is the share of messages that would take the fast path.
+    """
+    predictions = classifier.predict_many([record["message"] for record in records])
+    confident = [min(p.confidence.values()) >= threshold for p in predictions]
+    report = {
+        "messages": len(records),
+        "threshold": threshold,
+        "coverage": round(sum(confident) / len(records), 4) if records else 0.0,
+        "agreement": {},
+        "confident_agreement": {},
+        "persona_confusion": {},
+    }
+    for task in TASKS:
+        agree = [p.labels[task] == r[task] for p, r in zip(predictions, records)]
+        covered = [a for a, c in zip(agree, confident) if c]
+        report["agreement"][task] = round(float(np.mean(agree)), 4) if agree else None
+        report["confident_agreement"][task] = round(float(np.mean(covered)), 4) if covered else None
+
+    confusion = Counter((r["persona"], p.labels["persona"]) for p, r in zip(predictions, records))
+    for (llm_label, predicted), count in sorted(confusion.items()):
+        report["persona_confusion"].setdefault(llm_label, {})[predicted] = count
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_cmd = commands.add_parser("train", help="Fit on logged LLM labels, report on a holdout split")
+    train_cmd.add_argument("--labels", required=True)
+    train_cmd.add_argument("--model", required=True)
+    train_cmd.add_argument("--holdout", type=float, default=0.2)
+    train_cmd.add_argument("--threshold", type=float, default=0.85)
+    train_cmd.add_argument("--seed", type=int, default=7)
+    eval_cmd = commands.add_parser("evaluate", help="Agreement and coverage of a saved model")
+    eval_cmd.add_argument("--labels", required=True)
+    eval_cmd.add_argument("--model", required=True)
+    eval_cmd.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.85, 0.9, 0.95])
+    args = parser.parse_args()
+
+    records = load_labels(args.labels)
+    if args.command == "train":
+        if not 0 <= args.holdout < 1:
+            parser.error("--holdout must be at least 0 and below 1")
+        random.Random(args.seed).shuffle(records)
+        split = int(len(records) * (1 - args.holdout))
+        if split == 0:
+            parser.error(f"no training records: {len(records)} usable labels in {args.labels}, "
+                         f"{len(records) - split} held out")
+        classifier = PersonaClassifier.train(records[:split])
+        classifier.save(args.model)
+        print(f"[OK] Trained on {split} messages, saved to {args.model}")
+        if records[split:]:
+            print(json.dumps(evaluate(classifier, records[split:], args.threshold), indent=2))
+    else:
+        classifier = PersonaClassifier.load(args.model)
+        for threshold in args.thresholds:
+            report = evaluate(classifier, records, threshold)
+            agreement = " ".join(f"{task} {report['confident_agreement'][task]}" for task in TASKS)
+            print(f"threshold {threshold:.2f}: coverage {report['coverage']:.1%}, confident agreement {agreement}")
+
+
+if __name__ == "__main__":
+    main()
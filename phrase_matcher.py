@@ -0,0 +1,98 @@
+import re
+from collections import deque
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercased word tokens; phrases and messages are matched on these"""
+    return _TOKEN.findall(text.lower())
+
+
+def load_phrases(path):
+    """One phrase per line; blank lines and # comments are skipped"""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over word tokens
+
+    Finds every phrase that occurs in a text, on word boundaries, in one pass
+    over the text's tokens. The cost per text depends on its length and the
+    number of hits, not on how many phrases are loaded, so trigger lists can
+    grow to thousands of entries. Built once; immutable afterwards.
+
+    phrases is an iterable of strings, or of (phrase, value) pairs when hits
+    should map back to something else (e.g. a KB article row).
+    """
+
+    def __init__(self, phrases):
+        self.phrases = []  # phrase id -> phrase
+        self.values = []   # phrase id -> value
+        goto = [{}]        # node -> {token: node}
+        outputs = [[]]     # node -> phrase ids ending here
+        for entry in phrases:
+            phrase, value = (entry, entry) if isinstance(entry, str) else entry
+            tokens = tokenize(phrase)
+            if not tokens:
+                continue
+            node = 0
+            for token in tokens:
+                nxt = goto[node].get(token)
+                if nxt is None:
+                    nxt = goto[node][token] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                node = nxt
+            outputs[node].append(len(self.phrases))
+            self.phrases.append(phrase)
+            self.values.append(value)
+
+        # Breadth-first failure links; each node also reports its suffixes' phrases
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and token not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(token, 0)
+                outputs[child] = outputs[child] + outputs[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [tuple(out) for out in outputs]
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def iter_matches(self, tokens):
+        """Phrase ids as they complete while scanning tokens (may repeat)"""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        node = 0
+        for token in tokens:
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            yield from outputs[node]
+
+    def find(self, text=None, tokens=None):
+        """Values of all distinct phrases in the text, in order of first hit"""
+        if tokens is None:
+            tokens = tokenize(text)
+        seen = {}
+        for phrase_id in self.iter_matches(tokens):
+            seen.setdefault(phrase_id, None)
+        return [self.values[phrase_id] for phrase_id in seen]
+
+    def search(self, text=None, tokens=None):
+        """Value of the first phrase found, or None (stops at the first hit)"""
+        if tokens is None:
+            tokens = tokenize(text)
+        for phrase_id in self.iter_matches(tokens):
+            return self.values[phrase_id]
+        return None
@@ -0,0 +1,101 @@
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler that can be switched on at runtime
+
+    While running, a daemon thread wakes every interval_ms, grabs the current
+    stack of every other thread (sys._current_frames) and counts it. Nothing
+    is hooked into the request path, so the cost is one stack walk per thread
+    per sample and zero when stopped. Stacks are reported in collapsed form
+    ("outer;inner;leaf count"), ready for flamegraph.pl or speedscope.
+    """
+
+    # Distinct stacks kept; samples of further new stacks are counted as "[other]"
+    MAX_STACKS = 10000
+    MAX_DEPTH = 64
+    # Sampling interval bounds; shorter intervals would turn the sampler into a busy loop
+    MIN_INTERVAL_MS = 1
+    MAX_INTERVAL_MS = 10000
+
+    def __init__(self):
+        self.interval_ms = None
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms=10):
+        """
+        Start sampling (restarts with the new interval if already running)
+
+        interval_ms is clamped to MIN_INTERVAL_MS..MAX_INTERVAL_MS.
+        """
+        interval_ms = min(max(interval_ms, self.MIN_INTERVAL_MS), self.MAX_INTERVAL_MS)
+        self.stop()
+        self.interval_ms = interval_ms
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(self._stop, interval_ms / 1000), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def collapsed(self, limit=None):
+        """Most frequent stacks as "frame;frame;frame count" lines"""
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks)
+
+    def status(self, top=20):
+        with self._lock:
+            top_stacks = self._stacks.most_common(top)
+            distinct = len(self._stacks)
+        return {
+            "running": self.running,
+            "interval_ms": self.interval_ms,
+            "samples": self.samples,
+            "distinct_stacks": distinct,
+            "top_stacks": [{"stack": stack, "count": count} for stack, count in top_stacks],
+        }
+
+    def _run(self, stop, interval):
+        own_id = threading.get_ident()
+        while not stop.wait(interval):
+            frames = sys._current_frames()
+            stacks = [self._collapse(frame) for thread_id, frame in frames.items() if thread_id != own_id]
+            del frames
+            with self._lock:
+                self.samples += 1
+                for stack in stacks:
+                    if stack in self._stacks or len(self._stacks) < self.MAX_STACKS:
+                        self._stacks[stack] += 1
+                    else:
+                        self._stacks["[other]"] += 1
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.MAX_DEPTH:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
@@ -0,0 +1,134 @@
+from collections import namedtuple
+
+# Sections of the dynamic tail, in the order they are given budget
+SECTIONS = ("message", "kb", "history")
+
+KB_HEADER = "AVAILABLE KNOWLEDGE BASE:\n"
+NO_KB_ARTICLES = "No specific KB articles found."
+
+# Per-message framing the chat format adds on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Least of the customer's message the budget must leave room for
+MIN_MESSAGE_TOKENS = 32
+
+Prompt = namedtuple("Prompt", ["messages", "tokens", "sections", "trimmed"])
+# messages: chat messages for the completions API
+# tokens: estimated prompt tokens in total
+# sections: {"system" | section: tokens}
+# trimmed: {section: items cut or shortened to fit the budget}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (~4 characters per token for English text)
+
+    Only used for budgeting, so a small error either way is fine; pass a real
+    tokenizer's count function to PromptBuilder for exact numbers.
+    """
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens, count_tokens=estimate_tokens):
+    """text cut down to at most max_tokens, marked with an ellipsis"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = len(text) * max_tokens // tokens
+    while cut > 0 and count_tokens(text[:cut] + "...") > max_tokens:
+        cut = cut * 9 // 10
+    return text[:cut].rstrip() + "..."
+
+
+class PromptBuilder:
+    """
+    Chat prompt with a fixed system prefix and a budgeted dynamic tail
+
+    The system message (instructions and output schema) is built once and is
+    byte-identical on every call, so providers that cache prompt prefixes can
+    reuse it. It is followed by the recent history as separate user/assistant
+    messages, and a final user message with the KB articles and the customer's
+    message. Between turns the tail only grows at the end, so the history is
+    part of the cached prefix on the next turn too.
+
+    The tail is fitted to budget_tokens (system prefix included) in the order
+    of SECTIONS: the customer's message is shortened only if it doesn't fit
+    on its own, KB articles are each capped at kb_snippet_tokens and dropped
+    from the lowest ranked, and the oldest history goes first. A budget too
+    small to keep MIN_MESSAGE_TOKENS of the message raises ValueError.
+    """
+
+    def __init__(self, system_prompt, budget_tokens, kb_snippet_tokens=300, history_messages=4,
+                 count_tokens=estimate_tokens):
+        self.budget_tokens = budget_tokens
+        self.kb_snippet_tokens = kb_snippet_tokens
+        self.history_messages = history_messages
+        self.count_tokens = count_tokens
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        minimum = (self.system_tokens + count_tokens(KB_HEADER) + count_tokens(NO_KB_ARTICLES)
+                   + count_tokens('CURRENT MESSAGE: ""') + MESSAGE_OVERHEAD_TOKENS + MIN_MESSAGE_TOKENS)
+        if budget_tokens < minimum:
+            raise ValueError(
+                f"Prompt budget of {budget_tokens} tokens leaves no room for the customer's message; "
+                f"the system prompt alone needs {self.system_tokens}, use at least {minimum}"
+            )
+
+    def build(self, message, conversation_history, kb_articles):
+        count = self.count_tokens
+        framing_tokens = count(KB_HEADER) + count(NO_KB_ARTICLES)
+        remaining = self.budget_tokens - self.system_tokens - framing_tokens
+        sections = {"system": self.system_tokens}
+        trimmed = {}
+
+        # Step 1: The customer's message, shortened only if it can't fit at all
+        message_text = f'CURRENT MESSAGE: "{message}"'
+        message_tokens = count(message_text) + MESSAGE_OVERHEAD_TOKENS
+        if message_tokens > remaining:
+            message = truncate_to_tokens(message, remaining - (message_tokens - count(message)), count)
+            message_text = f'CURRENT MESSAGE: "{message}"'
+            message_tokens = count(message_text) + MESSAGE_OVERHEAD_TOKENS
+            trimmed["message"] = 1
+        remaining -= message_tokens
+        sections["message"] = message_tokens
+
+        # Step 2: KB articles in rank order, each capped to a snippet
+        kb_lines = []
+        kb_tokens = framing_tokens
+        for rank, article in enumerate(kb_articles or []):
+            # A chunked article that matched on a later section is quoted from there
+            source = article.get("section") or article["content"]
+            content = truncate_to_tokens(source, self.kb_snippet_tokens, count)
+            line = f"- {article['title']}: {content}"
+            line_tokens = count(line) + 1
+            if line_tokens > remaining:
+                trimmed["kb"] = trimmed.get("kb", 0) + len(kb_articles) - rank
+                break
+            if content is not source:
+                trimmed["kb"] = trimmed.get("kb", 0) + 1
+            kb_lines.append(line)
+            kb_tokens += line_tokens
+            remaining -= line_tokens
+        sections["kb"] = kb_tokens
+
+        # Step 3: History, newest first, as long as whole messages fit
+        recent = list(conversation_history or [])[-self.history_messages:] if self.history_messages else []
+        history = []
+        history_tokens = 0
+        for position, msg in enumerate(reversed(recent)):
+            msg_tokens = count(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if msg_tokens > remaining:
+                trimmed["history"] = len(recent) - position
+                break
+            history.append({"role": msg["role"], "content": msg["content"]})
+            history_tokens += msg_tokens
+            remaining -= msg_tokens
+        history.reverse()
+        sections["history"] = history_tokens
+
+        kb_context = "\n".join(kb_lines) if kb_lines else NO_KB_ARTICLES
+        tail = f"{KB_HEADER}{kb_context}\n\n{message_text}"
+        messages = [self.system_message, *history, {"role": "user", "content": tail}]
+        return Prompt(messages, sum(sections.values()), sections, trimmed)
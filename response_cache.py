@@ -0,0 +1,136 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize_message(message):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(_NON_WORD.sub(" ", message.lower()).split())
+
+
+def history_fingerprint(conversation_history, window=4):
+    """Hash of the history window the prompt actually includes"""
+    recent = [(msg["role"], msg["content"]) for msg in (conversation_history or [])[-window:]]
+    return hashlib.sha1(json.dumps(recent).encode()).hexdigest()
+
+
+def _copy_result(result):
+    """Copy of a cached result that a request may change without touching the entry"""
+    copy = dict(result)
+    if isinstance(copy.get("kb_articles_used"), list):
+        copy["kb_articles_used"] = list(copy["kb_articles_used"])
+    return copy
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of LLM results, bounded by approximate size in bytes
+
+    Entries are keyed on (normalized message, bucket) where the bucket is the
+    retrieved KB article ids plus a history fingerprint, i.e. everything else
+    that goes into the prompt. With a similarity_threshold, a miss on the
+    exact message falls back to the closest cached TF-IDF query vector in the
+    same bucket. Results are copied in and out, so requests never share a
+    cached dict.
+    """
+
+    # Most recent entries per bucket compared in a similarity lookup
+    SIMILARITY_SCAN_LIMIT = 256
+
+    def __init__(self, max_bytes, ttl_seconds, similarity_threshold=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (result, expires_at, size, query_vector)
+        self._buckets = {}             # bucket -> OrderedDict of keys (insertion order)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(message, kb_articles, conversation_history, history_window=4):
+        bucket = (
+            tuple(article["id"] for article in kb_articles),
+            history_fingerprint(conversation_history, history_window)
+        )
+        return normalize_message(message), bucket
+
+    def get(self, key, query_vector=None):
+        """
+        Cached result for key, or for a similar query in the same bucket
+
+        query_vector is the retriever's QueryVector for this turn, if any.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None and query_vector is not None and self.similarity_threshold:
+                key = self._most_similar(key[1], query_vector, now)
+                entry = self._entries.get(key) if key is not None else None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            result = entry[0]
+        return _copy_result(result)  # Each hit gets its own dict
+
+    def put(self, key, result, query_vector=None):
+        size = len(json.dumps(result, default=str)) + len(key[0]) + 64
+        if query_vector is not None:
+            size += query_vector.vector.nnz * 12
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (_copy_result(result), time.time() + self.ttl_seconds, size, query_vector)
+            self._buckets.setdefault(key[1], OrderedDict())[key] = None
+            self.current_bytes += size
+            # Evict least recently used entries until back under budget
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry[2]
+        bucket = self._buckets.get(key[1])
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[key[1]]
+
+    def _most_similar(self, bucket, query_vector, now):
+        keys = list(self._buckets.get(bucket, ()))[-self.SIMILARITY_SCAN_LIMIT:]
+        candidates = [
+            k for k in keys
+            if self._entries[k][1] > now
+            and self._entries[k][3] is not None
+            and self._entries[k][3].vocabulary_version == query_vector.vocabulary_version
+        ]
+        if not candidates:
+            return None
+
+        import scipy.sparse as sp  # Deferred: only similarity lookups need it
+
+        # Vectors are L2-normalized TF-IDF rows, so one product gives cosines
+        matrix = sp.vstack([self._entries[k][3].vector for k in candidates], format="csr")
+        scores = (matrix @ query_vector.vector.T).toarray().ravel()
+        best = int(scores.argmax())
+        return candidates[best] if scores[best] >= self.similarity_threshold else None
@@ -0,0 +1,294 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Smallest history window the agent can work with: the prompt, the retriever
+# query and the repeated-question check all read the last 4 messages
+MIN_HISTORY_WINDOW = 4
+
+
+def new_session():
+    return {
+        "history": [],          # Last history_window messages
+        "message_count": 0,     # Messages ever exchanged, survives compaction
+        "sentiment_history": [],
+        "user_tokens": []       # Token set of each recent user message
+    }
+
+
+class SessionStore:
+    """
+    Per-session conversation state with bounded memory
+
+    A session is a JSON-serializable dict (see new_session) that also carries
+    the detected persona and confidence once one is cached. Sessions idle
+    for longer than ttl_seconds expire, and the least recently used ones are
+    evicted to stay under max_sessions and max_bytes. Histories are compacted
+    to the last history_window messages on save.
+
+    get() returns a private copy, so a turn can read it while another turn
+    on the same session commits. Updates go through transaction(), which
+    holds one of LOCK_STRIPES locks (chosen by session id) around a fresh
+    read-modify-write: concurrent turns on a session apply in order without
+    losing entries, while unrelated sessions rarely contend.
+
+    Backends implement _load, _store, _delete and __len__.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, ttl_seconds, max_sessions, max_bytes,
+                 history_window=MIN_HISTORY_WINDOW, sentiment_window=10):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.history_window = max(MIN_HISTORY_WINDOW, history_window)
+        self.sentiment_window = max(2, sentiment_window)
+        self.evictions = 0
+        self._stripes = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def get(self, session_id):
+        """The stored session, or None if it doesn't exist or has expired"""
+        return self._load(session_id, time.time())
+
+    def get_or_create(self, session_id):
+        session = self.get(session_id)
+        return session if session is not None else new_session()
+
+    def save(self, session_id, session):
+        """Compact the session and write it back as most recently used"""
+        session["history"] = session["history"][-self.history_window:]
+        session["sentiment_history"] = session["sentiment_history"][-self.sentiment_window:]
+        session["user_tokens"] = session.get("user_tokens", [])[-((self.history_window + 1) // 2):]
+        self._store(session_id, session, len(json.dumps(session)), time.time())
+
+    def delete(self, session_id):
+        with self.lock_for(session_id):
+            self._delete(session_id)
+
+    def lock_for(self, session_id):
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    @contextmanager
+    def transaction(self, session_id):
+        """
+        Atomically update a session: re-read it, let the caller modify it, save
+
+            with store.transaction(session_id) as session:
+                session["history"].append(...)
+        """
+        with self.lock_for(session_id):
+            session = self.get_or_create(session_id)
+            yield session
+            self.save(session_id, session)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def close(self):
+        """Release the calling thread's resources (e.g. before forking workers)"""
+
+    def _load(self, session_id, now):
+        raise NotImplementedError
+
+    def _store(self, session_id, session, size, now):
+        raise NotImplementedError
+
+    def _delete(self, session_id):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessions in an OrderedDict kept in least-recently-used order"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.current_bytes = 0
+        self._sessions = OrderedDict()  # session_id -> (session, last_access, size)
+        self._lock = threading.Lock()
+
+    def _load(self, session_id, now):
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], now, entry[2])
+            self._sessions.move_to_end(session_id)
+            session = entry[0]
+        # Copy every container a turn updates in place; the stored dict stays untouched until _store
+        snapshot = {
+            **session,
+            "history": list(session["history"]),
+            "sentiment_history": list(session["sentiment_history"]),
+            "user_tokens": list(session.get("user_tokens", []))
+        }
+        if session.get("kb_context") is not None:
+            snapshot["kb_context"] = dict(session["kb_context"])
+        return snapshot
+
+    def _store(self, session_id, session, size, now):
+        with self._lock:
+            self._pop(session_id)
+            self._sessions[session_id] = (session, now, size)
+            self.current_bytes += size
+            self._expire(now)
+            while len(self._sessions) > self.max_sessions or self.current_bytes > self.max_bytes:
+                if len(self._sessions) == 1:
+                    break  # Never evict the session being written
+                self._pop(next(iter(self._sessions)))
+                self.evictions += 1
+
+    def _delete(self, session_id):
+        with self._lock:
+            self._pop(session_id)
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.time())
+            return len(self._sessions)
+
+    def _expire(self, now):
+        # LRU order is also last-access order, so expired sessions are at the front
+        cutoff = now - self.ttl_seconds
+        while self._sessions:
+            session_id, (_, last_access, _) = next(iter(self._sessions.items()))
+            if last_access > cutoff:
+                break
+            self._pop(session_id)
+            self.evictions += 1
+
+    def _pop(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a SQLite database shared by every worker process on the host
+
+    The database runs in WAL mode so readers don't block the writer. Each
+    thread gets its own connection, and transactions also take the database
+    write lock (BEGIN IMMEDIATE) so updates from other processes aren't lost.
+    Expired rows are deleted on every save; the session/byte caps are checked
+    every EVICTION_CHECK_INTERVAL saves.
+    """
+
+    EVICTION_CHECK_INTERVAL = 64
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._saves = itertools.count(1)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        # A SQLite connection must not be used across fork; this thread reconnects on next use
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    @contextmanager
+    def transaction(self, session_id):
+        conn = self._connection()
+        with self.lock_for(session_id):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                session = self.get_or_create(session_id)
+                yield session
+                self.save(session_id, session)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _load(self, session_id, now):
+        row = self._connection().execute(
+            "SELECT data, last_access FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now - self.ttl_seconds:
+            self._delete(session_id)
+            return None
+        return json.loads(row[0])
+
+    def _store(self, session_id, session, size, now):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, data, size, last_access) VALUES (?, ?, ?, ?)",
+            (session_id, json.dumps(session), size, now)
+        )
+        expired = conn.execute(
+            "DELETE FROM sessions WHERE last_access <= ?", (now - self.ttl_seconds,)
+        ).rowcount
+        self.evictions += max(0, expired)
+
+        if next(self._saves) % self.EVICTION_CHECK_INTERVAL == 0:
+            self._enforce_caps(conn, session_id)
+
+    def _enforce_caps(self, conn, keep_id):
+        count, total_bytes = conn.execute("SELECT COUNT(*), TOTAL(size) FROM sessions").fetchone()
+        excess_sessions = count - self.max_sessions
+        excess_bytes = total_bytes - self.max_bytes
+        if excess_sessions <= 0 and excess_bytes <= 0:
+            return
+
+        # Walk the least recently used rows until both caps are met
+        victims = []
+        for session_id, size in conn.execute(
+            "SELECT session_id, size FROM sessions WHERE session_id != ? ORDER BY last_access",
+            (keep_id,)
+        ):
+            if excess_sessions <= 0 and excess_bytes <= 0:
+                break
+            victims.append((session_id,))
+            excess_sessions -= 1
+            excess_bytes -= size
+        conn.executemany("DELETE FROM sessions WHERE session_id = ?", victims)
+        self.evictions += len(victims)
+
+    def _delete(self, session_id):
+        self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions WHERE last_access > ?", (time.time() - self.ttl_seconds,)
+        ).fetchone()[0]
+
+
+def create_session_store(backend, path=None, **limits):
+    """SessionStore for a Config.SESSION_BACKEND value ("memory" or "sqlite")"""
+    if backend == "memory":
+        return InMemorySessionStore(**limits)
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, **limits)
+    raise ValueError(f"Unknown session backend: {backend!r}")
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import json
+import threading
+
+
+def fingerprint(*parts):
+    """Stable hash of JSON-serializable request parts (model, messages, ...)"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one
+
+    The first caller for a key runs fn; callers arriving while it is in flight
+    wait and get the same result (or exception). The key is forgotten as soon
+    as the call finishes, so this never serves stale results - it only
+    deduplicates work that overlaps in time.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> _Call in flight
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """(result, shared): shared is True when another caller's result was reused"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop
+
+    The shared call runs as its own task and every caller awaits it through
+    asyncio.shield, so a caller that is cancelled (e.g. a client disconnect)
+    doesn't cancel the call for everybody else.
+    """
+
+    def __init__(self):
+        self._tasks = {}  # key -> Task in flight
+
+    async def do(self, key, coro_fn):
+        """(result, shared): shared is True when another caller's result was reused"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller was cancelled
+
+    def __len__(self):
+        return len(self._tasks)
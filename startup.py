@@ -0,0 +1,101 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTracker:
+    """
+    Readiness and phase timings of a worker's startup
+
+    The process is live as soon as it can answer requests; it is ready once
+    run(fn) has finished building everything fn needs (LLM client, KB index,
+    ...). run() does that on a background thread by default, so health
+    checks are answered while indexes are still being built. Each phase(name)
+    block is timed, and a failure marks the worker failed instead of exiting,
+    so the reason can be read from the readiness endpoint.
+    """
+
+    STARTING, READY, FAILED = "starting", "ready", "failed"
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.state = self.STARTING
+        self.error = None
+        self.phases = {}  # name -> seconds, in the order they ran
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a startup step under name"""
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - phase_start)
+
+    def record(self, name, seconds):
+        self.phases[name] = seconds
+
+    def run(self, fn, background=True):
+        """
+        Call fn() once to finish startup; later calls are no-ops
+
+        Returns without waiting when background is True. Otherwise fn runs
+        here and its exception, if any, is raised after being recorded.
+        """
+        with self._lock:
+            if self._thread is not None or self.state != self.STARTING:
+                return
+            if background:
+                self._thread = threading.Thread(target=self._run, args=(fn, False), name="startup", daemon=True)
+                self._thread.start()
+                return
+            self._thread = threading.current_thread()
+        self._run(fn, True)
+
+    def _run(self, fn, reraise):
+        try:
+            fn()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = self.FAILED
+            print(f"[ERROR] Startup failed: {self.error}")
+            if reraise:
+                raise
+        else:
+            self.state = self.READY
+            print(f"[OK] Ready in {self.uptime():.2f}s ({self._phase_summary()})")
+        finally:
+            self._ready.set()
+
+    def mark_ready(self):
+        """Startup done by the caller (e.g. an agent injected for tests)"""
+        with self._lock:
+            self.state = self.READY
+            self.error = None
+        self._ready.set()
+
+    @property
+    def ready(self):
+        return self.state == self.READY
+
+    def wait(self, timeout=None):
+        """Block until startup has finished or failed; True if it is ready"""
+        self._ready.wait(timeout)
+        return self.ready
+
+    def uptime(self):
+        return time.perf_counter() - self.started
+
+    def status(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "uptime_seconds": round(self.uptime(), 3),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+    def _phase_summary(self):
+        return ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
@@ -0,0 +1,186 @@
+import json
+import re
+
+_STRING_RUN = re.compile(r'[^"\\]+')
+_SIMPLE_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+# Parser states
+_SEEK_OBJECT, _SEEK_KEY, _KEY, _SEEK_COLON, _SEEK_VALUE, _STRING, _SCALAR, _NESTED, _SEEK_COMMA, _DONE = range(10)
+
+
+class JSONEnvelopeStreamParser:
+    """
+    Incremental parser for the model's flat JSON envelope
+
+    Feed raw text chunks as they stream in. Each top-level field is reported
+    as soon as its value is complete, and string fields listed in
+    stream_fields are also reported piece by piece while they are still
+    being generated. Text before the opening brace (e.g. a ```json fence) is
+    skipped.
+
+    feed() returns a list of events:
+        ("field", key, value)  - a top-level field finished parsing
+        ("delta", key, text)   - more decoded text for a streamed string field
+    """
+
+    def __init__(self, stream_fields=("response",)):
+        self.stream_fields = set(stream_fields)
+        self.fields = {}
+        self.complete = False
+        self._state = _SEEK_OBJECT
+        self._key = None
+        self._buffer = []      # decoded string / raw scalar or nested text
+        self._escape = None    # pending escape sequence split across chunks
+        self._depth = 0        # nesting depth inside an array/object value
+        self._nested_string = False
+        self._nested_escape = False
+
+    def feed(self, chunk):
+        events = []
+        i, n = 0, len(chunk)
+        while i < n:
+            state = self._state
+            c = chunk[i]
+
+            if state == _STRING or state == _KEY:
+                i = self._read_string(chunk, i, events)
+                continue
+
+            if state == _SEEK_OBJECT:
+                if c == "{":
+                    self._state = _SEEK_KEY
+            elif state == _SEEK_KEY:
+                if c == '"':
+                    self._state = _KEY
+                elif c == "}":
+                    self._finish()
+            elif state == _SEEK_COLON:
+                if c == ":":
+                    self._state = _SEEK_VALUE
+            elif state == _SEEK_VALUE:
+                if c == '"':
+                    self._state = _STRING
+                elif c in "[{":
+                    self._state = _NESTED
+                    self._depth = 1
+                    self._buffer.append(c)
+                elif not c.isspace():
+                    self._state = _SCALAR
+                    self._buffer.append(c)
+            elif state == _SCALAR:
+                if c in ",}" or c.isspace():
+                    self._emit(json.loads("".join(self._buffer)), events)
+                    self._state = _SEEK_COMMA
+                    continue  # let _SEEK_COMMA see the delimiter
+                self._buffer.append(c)
+            elif state == _NESTED:
+                i = self._read_nested(chunk, i, events)
+                continue
+            elif state == _SEEK_COMMA:
+                if c == ",":
+                    self._state = _SEEK_KEY
+                elif c == "}":
+                    self._finish()
+            elif state == _DONE:
+                break
+            i += 1
+        return events
+
+    def _read_string(self, chunk, i, events):
+        """Decode string characters starting at i; returns the next index"""
+        n = len(chunk)
+        streaming = self._state == _STRING and self._key in self.stream_fields
+        decoded = []
+        while i < n:
+            if self._escape is not None:
+                self._escape += chunk[i]
+                i += 1
+                text = self._decode_escape()
+                if text is not None:
+                    decoded.append(text)
+                continue
+            run = _STRING_RUN.match(chunk, i)
+            if run:
+                decoded.append(run.group())
+                i = run.end()
+                continue
+            if chunk[i] == "\\":
+                self._escape = ""
+                i += 1
+                continue
+            # Closing quote
+            i += 1
+            text = "".join(decoded)
+            if streaming and text:
+                events.append(("delta", self._key, text))
+            self._buffer.append(text)
+            value = "".join(self._buffer)
+            self._buffer = []
+            if self._state == _KEY:
+                self._key = value
+                self._state = _SEEK_COLON
+            else:
+                self._emit(value, events, buffered=False)
+                self._state = _SEEK_COMMA
+            return i
+
+        text = "".join(decoded)
+        if streaming and text:
+            events.append(("delta", self._key, text))
+        self._buffer.append(text)
+        return i
+
+    def _decode_escape(self):
+        escape = self._escape
+        if escape[0] != "u":
+            self._escape = None
+            return _SIMPLE_ESCAPES.get(escape, escape)
+        if len(escape) < 5:
+            return None
+        code = int(escape[1:5], 16)
+        if 0xD800 <= code < 0xDC00:
+            # High surrogate: wait for the "\uXXXX" low half
+            if len(escape) < 11:
+                return None
+            code = 0x10000 + ((code - 0xD800) << 10) + (int(escape[7:11], 16) - 0xDC00)
+        self._escape = None
+        return chr(code)
+
+    def _read_nested(self, chunk, i, events):
+        """Collect a nested array/object value verbatim and json.loads it when closed"""
+        n = len(chunk)
+        start = i
+        while i < n:
+            c = chunk[i]
+            i += 1
+            if self._nested_string:
+                if self._nested_escape:
+                    self._nested_escape = False
+                elif c == "\\":
+                    self._nested_escape = True
+                elif c == '"':
+                    self._nested_string = False
+            elif c == '"':
+                self._nested_string = True
+            elif c in "[{":
+                self._depth += 1
+            elif c in "]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._buffer.append(chunk[start:i])
+                    self._emit(json.loads("".join(self._buffer)), events)
+                    self._state = _SEEK_COMMA
+                    return i
+        self._buffer.append(chunk[start:i])
+        return i
+
+    def _emit(self, value, events, buffered=True):
+        if buffered:
+            self._buffer = []
+        self.fields[self._key] = value
+        events.append(("field", self._key, value))
+        self._key = None
+
+    def _finish(self):
+        self._state = _DONE
+        self.complete = True
@@ -0,0 +1,303 @@
+"""
+Write-behind transcript log
+
+append() puts one finished turn on a bounded in-memory queue and returns; a
+background thread drains the queue in bulk, encodes the records and appends
+them to a segment file with one write per batch. The request path never
+touches the disk or the JSON encoder. When the queue is full the record is
+dropped and counted instead of blocking the request.
+
+Segment format: an 8-byte magic header, then frames of a 4-byte
+little-endian length followed by that many bytes of JSON. Each process
+writes its own segments, named transcripts-<unix ms>-<pid>-<seq>.seg, and
+starts a new one once a write takes it past segment_max_bytes. A torn frame at the end of a
+segment (crash mid-write) is skipped by the reader.
+
+Read offline with read_transcripts() or:
+    python -m transcript_log transcripts/ --session abc123
+    python -m transcript_log transcripts/ --stats
+"""
+import argparse
+import atexit
+import glob
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+from json_codec import make_encoder
+
+try:
+    import orjson
+except ImportError:  # Optional dependency; the standard library decoder is used instead
+    orjson = None
+
+MAGIC = b"TRNLOG1\n"
+_LENGTH = struct.Struct("<I")
+
+
+class TranscriptLog:
+    """
+    Bounded queue of turn records plus the thread that writes them out
+
+    The writer wakes every flush_interval_seconds, or as soon as batch_size
+    records are waiting. start() is a no-op when this process already runs
+    the writer; after a fork the child starts its own (and its own segments).
+    Counts go to tracker.record_transcript() when a tracker is given.
+    """
+
+    def __init__(self, directory, tracker=None, queue_size=10000, batch_size=512,
+                 flush_interval_seconds=1.0, segment_max_bytes=64 << 20, fsync=False):
+        self.directory = directory
+        self.tracker = tracker
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()        # start/close
+        self._write_lock = threading.Lock()  # the segment file
+        self._encode = make_encoder("auto", default=str)
+        self._pid = None
+        self._thread = None
+        self._closed = False
+        self._file = None
+        self._file_bytes = 0
+        self._segments = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def append(self, record):
+        """
+        Queue one record (a JSON-serializable dict the caller won't mutate)
+
+        Returns False if it was dropped because the queue is full or the log
+        is closed.
+        """
+        if self._closed or len(self._queue) >= self.queue_size:
+            self._count("dropped")
+            return False
+        self._queue.append(record)
+        if len(self._queue) >= self.batch_size and not self._wakeup.is_set():
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._closed = False
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="transcript-log", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _reset_after_fork(self):
+        """
+        In a forked child: the parent's writer thread is gone and may have held
+        a lock mid-flush, so start over with fresh locks, an empty queue (the
+        parent writes its own) and no open segment
+        """
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        if self._file is not None:
+            self._file.close()  # Only the child's copy of the descriptor
+        self._file = None
+        self._pid = None
+        self._thread = None
+        self._closed = False
+
+    def close(self, timeout=5.0):
+        """Write what is queued and stop the writer"""
+        with self._lock:
+            if self._pid != os.getpid() or self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def flush(self):
+        """Write everything queued so far; returns the number of records written"""
+        written = 0
+        with self._write_lock:
+            pop = self._queue.popleft
+            while self._queue:
+                # One write per batch_size records, so segments rotate close to their size limit
+                batch = [pop() for _ in range(min(self.batch_size, len(self._queue)))]
+                written += self._write_batch(batch)
+        return written
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        frames = []
+        for record in batch:
+            body = self._encode(record)
+            frames.append(_LENGTH.pack(len(body)))
+            frames.append(body)
+        data = b"".join(frames)
+        try:
+            self._write(data)
+        except OSError as e:
+            print(f"[WARN] Could not write {len(batch)} transcript records to {self.directory}: {e}")
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass  # Nothing more to save from this segment
+            self._file = None  # Reopen a fresh segment next time
+            self._count("write_errors", len(batch))
+            return 0
+
+        self._count("written", len(batch))
+        self._count("bytes", len(data))
+        if self.tracker is not None:
+            self.tracker.record_transcript_flush(time.perf_counter() - start)
+        return len(batch)
+
+    def _write(self, data):
+        if self._file is None or self._file_bytes >= self.segment_max_bytes:
+            if self._file is not None:
+                self._file.close()
+            self._segments += 1
+            name = f"transcripts-{int(time.time() * 1000):013d}-{os.getpid()}-{self._segments:04d}.seg"
+            # Unbuffered: each batch is one write() and nothing is left to flush at fork/exit
+            self._file = open(os.path.join(self.directory, name), "ab", buffering=0)
+            self._file.write(MAGIC)
+            self._file_bytes = len(MAGIC)
+            self._count("segments")
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]  # Raw writes may be partial
+        self._file_bytes += len(data)
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARN] Transcript log flush failed: {e}")
+            if self._closed:
+                break
+        self.flush()  # Anything appended while the last batch was written
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _count(self, event, n=1):
+        if self.tracker is not None:
+            self.tracker.record_transcript(event, n)
+
+
+def segment_paths(directory):
+    """Segment files in write order (by start time, then process and sequence)"""
+    return sorted(glob.glob(os.path.join(directory, "transcripts-*.seg")))
+
+
+def iter_frames(path):
+    """Raw JSON bytes of every complete record in one segment"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a transcript segment")
+    offset, end = len(MAGIC), len(data)
+    unpack = _LENGTH.unpack_from
+    while offset + _LENGTH.size <= end:
+        (length,) = unpack(data, offset)
+        offset += _LENGTH.size
+        if offset + length > end:
+            break  # Torn final frame
+        yield data[offset:offset + length]
+        offset += length
+
+
+def read_transcripts(directory, session_id=None, since=None):
+    """
+    Records from every segment in directory, in write order per process
+
+    session_id keeps one conversation; since (unix seconds) skips older
+    records. Decodes with orjson when it is installed.
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    for path in segment_paths(directory):
+        for frame in iter_frames(path):
+            record = loads(frame)
+            if session_id is not None and record.get("session_id") != session_id:
+                continue
+            if since is not None and record.get("ts", 0) < since:
+                continue
+            yield record
+
+
+def summarize(records):
+    """Turn counts and averages for --stats"""
+    summary = {"turns": 0, "sessions": 0, "escalations": 0, "degraded": 0,
+               "personas": {}, "sentiments": {}, "avg_response_time": 0.0, "avg_stage_seconds": {}}
+    sessions, response_time, stage_totals = set(), 0.0, {}
+    for record in records:
+        summary["turns"] += 1
+        sessions.add(record.get("session_id"))
+        summary["escalations"] += bool(record.get("escalate"))
+        summary["degraded"] += bool(record.get("degraded"))
+        for field, key in (("persona", "personas"), ("sentiment", "sentiments")):
+            summary[key][record.get(field)] = summary[key].get(record.get(field), 0) + 1
+        response_time += record.get("response_time", 0.0)
+        for stage, seconds in record.get("stages", {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    if summary["turns"]:
+        summary["sessions"] = len(sessions)
+        summary["avg_response_time"] = round(response_time / summary["turns"], 4)
+        summary["avg_stage_seconds"] = {
+            stage: round(total / summary["turns"], 6) for stage, total in sorted(stage_totals.items())
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read transcript log segments (JSON lines to stdout)")
+    parser.add_argument("directory", nargs="?", help="Segment directory (default: TRANSCRIPT_LOG_DIR)")
+    parser.add_argument("--session", help="Only this session_id")
+    parser.add_argument("--since", type=float, help="Only records at or after this unix time")
+    parser.add_argument("--stats", action="store_true", help="Print a summary instead of the records")
+    args = parser.parse_args()
+    directory = args.directory
+    if directory is None:
+        from config import Config
+        directory = Config.TRANSCRIPT_LOG_DIR
+    if not directory:
+        parser.error("no directory given and TRANSCRIPT_LOG_DIR is not set")
+
+    records = read_transcripts(directory, session_id=args.session, since=args.since)
+    if args.stats:
+        print(json.dumps(summarize(records), indent=2))
+        return
+    encode = make_encoder("auto", default=str)
+    out = sys.stdout.buffer
+    try:
+        for record in records:
+            out.write(encode(record) + b"\n")
+        out.flush()
+    except BrokenPipeError:
+        # Piped into head or similar; don't fail again when stdout is closed at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == "__main__":
+    main()